@@ -0,0 +1,182 @@
+# This file is part of ncm_cracker.
+#
+# ncm_cracker is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ncm_cracker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ncm_cracker.  If not, see <https://www.gnu.org/licenses/>.
+"""
+📦 压缩包直接输入
+zip / tar(.gz/.bz2/.xz) 中的NCM不必先解压到 01_original：
+1. 每个NCM成员作为流读取（先文件头，再音频数据），直接解密到 02_decrypted，加密文件不落盘
+2. zip 支持随机访问 - 每个成员交给独立进程，解压和解密在成员之间并行
+3. tar 只能顺序读取 - 后台线程解压，当前线程同时解密写出，解压与解密重叠执行
+"""
+
+import pathlib
+import queue
+import tarfile
+import threading
+import zipfile
+
+from crack_ultra_fast import dump_stream
+from preflight import failure
+
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+# tar 解压线程与解密之间最多缓冲的块数
+PREFETCH_CHUNKS = 8
+PREFETCH_CHUNK_SIZE = 1024 * 1024
+
+# 多个tar包并行时，同名成员只处理一次
+_claim_lock = threading.Lock()
+
+
+def is_archive(path):
+    return str(path).lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def find_archives(directory):
+    """目录中的压缩包"""
+    return sorted(path for path in pathlib.Path(directory).glob('*') if path.is_file() and is_archive(path))
+
+
+def member_name(member_path):
+    """成员路径 -> 记录用的名称（去掉目录和扩展名，与 01_original 中的 file.stem 一致）"""
+    return pathlib.PurePosixPath(member_path).stem
+
+
+def is_ncm_member(member_path):
+    name = pathlib.PurePosixPath(member_path).name
+    # 跳过 macOS 打包时带上的 ._ 资源文件
+    return name.lower().endswith('.ncm') and not name.startswith('._')
+
+
+def claim(name, skip):
+    """name 不在 skip 中时登记并返回True"""
+    with _claim_lock:
+        if name in skip:
+            return False
+        skip.add(name)
+        return True
+
+
+def collect_archive_jobs(archives, skip):
+    """把压缩包拆成任务：zip 展开为成员级任务 [(压缩包, 成员, 名称)]，tar 整包作为一个任务
+
+    skip 是已解密/已有其他来源的名称集合，登记过的成员会加入其中
+    """
+    zip_jobs = []
+    tar_archives = []
+    for archive in archives:
+        if str(archive).lower().endswith('.zip'):
+            with zipfile.ZipFile(archive) as zf:
+                for info in zf.infolist():
+                    if not info.is_dir() and is_ncm_member(info.filename):
+                        name = member_name(info.filename)
+                        if claim(name, skip):
+                            zip_jobs.append((str(archive), info.filename, name))
+        else:
+            tar_archives.append(str(archive))
+    return zip_jobs, tar_archives
+
+
+def process_zip_member(args, sink=None, covers=None):
+    """多进程包装函数，args 为 (压缩包, 成员, 名称[, 记录文件])；返回值与 dump_ultra_fast 相同"""
+    archive, member, name, *rest = args
+    try:
+        with zipfile.ZipFile(archive) as zf:
+            info = zf.getinfo(member)
+            with zf.open(info) as stream:
+                return dump_stream(stream, name, *rest, sink=sink, size=info.file_size, covers=covers)
+    except Exception as e:
+        return None, failure(e), 0
+
+
+class ChunkReader:
+    """由解压线程喂数据的只读流，read 的语义与文件相同"""
+
+    def __init__(self, size=None):
+        self.size = size
+        self.chunks = queue.Queue(maxsize=PREFETCH_CHUNKS)
+        self.buffer = b''
+        self.eof = False
+
+    def read(self, size=-1):
+        while (size < 0 or len(self.buffer) < size) and not self.eof:
+            chunk = self.chunks.get()
+            if isinstance(chunk, Exception):
+                self.eof = True
+                raise chunk
+            if not chunk:
+                self.eof = True
+            else:
+                self.buffer += chunk
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def drain(self):
+        """丢弃剩余数据，让解压线程可以继续下一个成员"""
+        while not self.eof:
+            self.buffer = b''
+            self.read(PREFETCH_CHUNK_SIZE)
+        self.buffer = b''
+
+
+def _read_tar(archive, skip, members):
+    """解压线程：顺序读取tar流，把每个待处理成员的数据分块送给解密方"""
+    reader = None
+    try:
+        with tarfile.open(archive, mode='r|*') as tf:
+            for info in tf:
+                if not info.isfile() or not is_ncm_member(info.name):
+                    continue
+                name = member_name(info.name)
+                if not claim(name, skip):
+                    continue
+                reader = ChunkReader(info.size)
+                members.put((name, reader))
+                stream = tf.extractfile(info)
+                while True:
+                    chunk = stream.read(PREFETCH_CHUNK_SIZE)
+                    reader.chunks.put(chunk)
+                    if not chunk:
+                        break
+                reader = None
+    except Exception as e:
+        if reader is not None:
+            # 成员读到一半出错，让正在解密的一方失败
+            reader.chunks.put(e)
+        members.put(e)
+    finally:
+        members.put(None)
+
+
+def dump_tar_archive(archive, skip, record_path='cracked.txt', sink=None, covers=None):
+    """流式处理一个tar包，返回 [(名称, dump_stream 的返回值), ...]；包本身损坏时以包名记一条失败"""
+    members = queue.Queue(maxsize=1)
+    reader_thread = threading.Thread(target=_read_tar, args=(archive, skip, members), daemon=True)
+    reader_thread.start()
+
+    results = []
+    while True:
+        item = members.get()
+        if item is None:
+            break
+        if isinstance(item, Exception):
+            results.append((pathlib.Path(archive).name, (None, failure(item), 0)))
+            continue
+        name, reader = item
+        results.append((name, dump_stream(reader, name, record_path, sink=sink, size=reader.size, covers=covers)))
+        reader.drain()
+    reader_thread.join()
+    return results
@@ -0,0 +1,306 @@
+# This file is part of ncm_cracker.
+#
+# ncm_cracker is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ncm_cracker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ncm_cracker.  If not, see <https://www.gnu.org/licenses/>.
+"""
+🔍 音频探测工具
+在编码前快速获取音频参数（编码格式、码率、采样率、时长）：
+1. 优先使用 ffprobe - 支持所有格式
+2. 回退到纯Python的 MP3 / FLAC 文件头解析 - 只读前64KB，无需外部程序
+3. 按时长最长优先排序 - 用于调度，时长优先取自NCM元数据
+"""
+
+import json
+import pathlib
+import shutil
+import struct
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from library_layout import load_layout
+
+# 文件头解析最多读取的字节数
+HEADER_READ_SIZE = 64 * 1024
+
+# MPEG 音频码率表 (kbps)，按 (版本是否为MPEG1, 层) 索引
+_MPEG_BITRATES = {
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+
+# MPEG 采样率表，按版本位索引 (0: MPEG2.5, 2: MPEG2, 3: MPEG1)
+_MPEG_SAMPLE_RATES = {
+    0: [11025, 12000, 8000],
+    2: [22050, 24000, 16000],
+    3: [44100, 48000, 32000],
+}
+
+
+def parse_bitrate(bitrate):
+    """把 '128k' / '320K' / '96000' 这样的码率字符串转换为 bps"""
+    text = str(bitrate).strip().lower()
+    if text.endswith('k'):
+        return int(float(text[:-1]) * 1000)
+    if text.endswith('m'):
+        return int(float(text[:-1]) * 1000 * 1000)
+    return int(float(text))
+
+
+def parse_mp3_frame_header(header):
+    """解析4字节MPEG音频帧头，无效时返回None"""
+    if len(header) < 4:
+        return None
+    b1, b2, b3 = header[1], header[2], header[3]
+    if header[0] != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None
+
+    version_bits = (b1 >> 3) & 0x03
+    layer_bits = (b1 >> 1) & 0x03
+    bitrate_index = (b2 >> 4) & 0x0F
+    sample_rate_index = (b2 >> 2) & 0x03
+    if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    is_mpeg1 = version_bits == 3
+    layer = 4 - layer_bits
+    bitrate = _MPEG_BITRATES[(is_mpeg1, layer)][bitrate_index] * 1000
+    sample_rate = _MPEG_SAMPLE_RATES[version_bits][sample_rate_index]
+    padding = (b2 >> 1) & 0x01
+    channel_mode = (b3 >> 6) & 0x03
+
+    if layer == 1:
+        samples_per_frame = 384
+        frame_length = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples_per_frame = 1152 if (layer == 2 or is_mpeg1) else 576
+        frame_length = samples_per_frame // 8 * bitrate // sample_rate + padding
+
+    return {
+        'is_mpeg1': is_mpeg1,
+        'layer': layer,
+        'bitrate': bitrate,
+        'sample_rate': sample_rate,
+        'channels': 1 if channel_mode == 3 else 2,
+        'samples_per_frame': samples_per_frame,
+        'frame_length': frame_length,
+    }
+
+
+def id3v2_size(data):
+    """返回文件开头ID3v2标签的总长度（无标签返回0）"""
+    if len(data) < 10 or data[:3] != b'ID3':
+        return 0
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def find_mp3_frame(data, start=0):
+    """从start开始查找第一个有效且后继帧头也有效的MPEG帧，返回(偏移, 帧头)"""
+    position = start
+    while True:
+        position = data.find(b'\xff', position)
+        if position < 0 or position + 4 > len(data):
+            return None, None
+        header = parse_mp3_frame_header(data[position:position + 4])
+        if header and header['frame_length'] > 0:
+            next_position = position + header['frame_length']
+            # 连续两个帧头才算真正的同步，避免把数据里的0xFF误认为帧头
+            if next_position + 4 > len(data) or parse_mp3_frame_header(data[next_position:next_position + 4]):
+                return position, header
+        position += 1
+
+
+def _parse_mp3(data, file_size, base=0):
+    """解析MP3文件头，支持 Xing/Info VBR 头；data 从文件偏移 base 处开始"""
+    audio_start = 0 if base else id3v2_size(data)
+    position, header = find_mp3_frame(data, audio_start)
+    if header is None:
+        return None
+
+    audio_bytes = file_size - base - position
+    duration = None
+
+    # Xing / Info 头位于第一帧的 side info 之后
+    if header['is_mpeg1']:
+        side_info = 17 if header['channels'] == 1 else 32
+    else:
+        side_info = 9 if header['channels'] == 1 else 17
+    xing_offset = position + 4 + side_info
+    tag = data[xing_offset:xing_offset + 4]
+    if tag in (b'Xing', b'Info') and len(data) >= xing_offset + 12:
+        flags = struct.unpack('>I', data[xing_offset + 4:xing_offset + 8])[0]
+        if flags & 0x01:
+            frames = struct.unpack('>I', data[xing_offset + 8:xing_offset + 12])[0]
+            duration = frames * header['samples_per_frame'] / header['sample_rate']
+
+    if duration:
+        bitrate = int(audio_bytes * 8 / duration)
+    else:
+        bitrate = header['bitrate']
+        duration = audio_bytes * 8 / bitrate if bitrate else None
+
+    return {
+        'codec': 'mp3',
+        'bitrate': bitrate,
+        'sample_rate': header['sample_rate'],
+        'channels': header['channels'],
+        'duration': duration,
+    }
+
+
+def _parse_flac(data, file_size):
+    """解析FLAC的STREAMINFO块"""
+    if len(data) < 42 or data[:4] != b'fLaC' or (data[4] & 0x7F) != 0:
+        return None
+    info = data[8:42]
+    sample_rate = (info[10] << 12) | (info[11] << 4) | (info[12] >> 4)
+    channels = ((info[12] >> 1) & 0x07) + 1
+    total_samples = ((info[13] & 0x0F) << 32) | struct.unpack('>I', info[14:18])[0]
+    if sample_rate == 0:
+        return None
+    duration = total_samples / sample_rate if total_samples else None
+    return {
+        'codec': 'flac',
+        'bitrate': int(file_size * 8 / duration) if duration else None,
+        'sample_rate': sample_rate,
+        'channels': channels,
+        'duration': duration,
+    }
+
+
+def parse_audio_header(path):
+    """纯Python解析 MP3 / FLAC 文件头，无法识别时返回None"""
+    with open(path, 'rb') as f:
+        data = f.read(HEADER_READ_SIZE)
+        f.seek(0, 2)
+        file_size = f.tell()
+
+    if data[:4] == b'fLaC':
+        return _parse_flac(data, file_size)
+
+    # ID3v2 标签可能比读取的窗口还大（内嵌封面），需要跳过后再读
+    tag_size = id3v2_size(data)
+    if tag_size + 4 > len(data):
+        with open(path, 'rb') as f:
+            f.seek(tag_size)
+            return _parse_mp3(f.read(HEADER_READ_SIZE), file_size, base=tag_size)
+    return _parse_mp3(data, file_size)
+
+
+def ffprobe_audio(path):
+    """使用ffprobe探测音频参数，ffprobe不可用或失败时返回None"""
+    if shutil.which('ffprobe') is None:
+        return None
+    command = [
+        'ffprobe', '-v', 'error',
+        '-select_streams', 'a:0',
+        '-show_entries', 'stream=codec_name,sample_rate,channels,bit_rate:format=duration,bit_rate',
+        '-of', 'json',
+        str(path)
+    ]
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, check=True)
+        info = json.loads(result.stdout)
+    except (subprocess.CalledProcessError, ValueError, OSError):
+        return None
+
+    streams = info.get('streams') or []
+    if not streams:
+        return None
+    stream = streams[0]
+    fmt = info.get('format', {})
+
+    def _number(value, cast):
+        try:
+            return cast(value)
+        except (TypeError, ValueError):
+            return None
+
+    return {
+        'codec': stream.get('codec_name'),
+        'bitrate': _number(stream.get('bit_rate'), int) or _number(fmt.get('bit_rate'), int),
+        'sample_rate': _number(stream.get('sample_rate'), int),
+        'channels': _number(stream.get('channels'), int),
+        'duration': _number(fmt.get('duration'), float),
+    }
+
+
+def probe_audio(path):
+    """探测音频参数：优先ffprobe，失败时回退到纯Python文件头解析"""
+    info = ffprobe_audio(path)
+    if info is None:
+        try:
+            info = parse_audio_header(path)
+        except OSError:
+            info = None
+    return info
+
+
+def iter_mp3_frames(data):
+    """依次产出MP3数据中每一帧的 (偏移, 长度)，跳过开头的ID3v2标签，遇到无效帧头即停止"""
+    position, header = find_mp3_frame(data, id3v2_size(data))
+    while header is not None:
+        frame_length = header['frame_length']
+        if position + frame_length > len(data):
+            return
+        yield position, frame_length
+        position += frame_length
+        header = parse_mp3_frame_header(data[position:position + 4])
+
+
+def ncm_duration(ncm_path):
+    """从NCM元数据中读取时长（秒），不解密音频；读取失败时返回None"""
+    try:
+        from crack_ultra_fast import read_ncm_meta
+        duration_ms = read_ncm_meta(ncm_path).get('duration')
+    except Exception:
+        # 缺少 numpy / pycryptodome、文件损坏或元数据里没有时长
+        return None
+    return duration_ms / 1000 if duration_ms else None
+
+
+def estimate_duration(path, ncm_dir=None):
+    """尽量便宜地获取时长（秒）：NCM元数据 -> 纯Python文件头解析 -> ffprobe，都失败时返回None"""
+    path = pathlib.Path(path)
+    if path.suffix.lower() == '.ncm':
+        return ncm_duration(path)
+    if ncm_dir is not None:
+        ncm_path = load_layout().locate(ncm_dir, f"{path.stem}.ncm")
+        if ncm_path.exists():
+            duration = ncm_duration(ncm_path)
+            if duration:
+                return duration
+    try:
+        info = parse_audio_header(path)
+    except OSError:
+        info = None
+    if not info or not info.get('duration'):
+        info = ffprobe_audio(path)
+    return (info or {}).get('duration')
+
+
+def longest_first(paths, ncm_dir=None, max_workers=8):
+    """按时长从长到短排序（最长处理时间优先），返回 [(路径, 时长), ...]；时长未知的按文件大小估计排在后面"""
+    paths = list(paths)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        durations = list(executor.map(lambda path: estimate_duration(path, ncm_dir), paths))
+    return sorted(
+        zip(paths, durations),
+        key=lambda item: (item[1] is not None, item[1] or pathlib.Path(item[0]).stat().st_size),
+        reverse=True
+    )
@@ -0,0 +1,137 @@
+# This file is part of ncm_cracker.
+#
+# ncm_cracker is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ncm_cracker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ncm_cracker.  If not, see <https://www.gnu.org/licenses/>.
+"""
+🌊 大批量任务的流式提交与无界面模式
+十万级文件的批次不再一次性提交全部任务，也不在内存里攒每个文件的结果：
+1. 有界提交窗口 - 任务从扫描器惰性取出，同时在途的任务不超过窗口大小，还没轮到的任务不占用future；
+   asyncio版本在线程里推进扫描器，目录扫描不阻塞事件循环
+2. 结果日志 - 无界面模式下每个文件写一行（制表符分隔，完整文件名），写完即忘，内存中只保留汇总统计
+3. 定时状态行 - 无界面模式下不渲染进度条和结果表，按固定间隔打印一行汇总，适合重定向到文件
+4. 结果表限行 - 交互模式下结果表最多显示固定行数，其余只计数，大批次结束时不会卡在渲染上
+"""
+
+import asyncio
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+# 每个工作者对应的在途任务数：留一些排队的任务，工作者做完一个马上有下一个
+WINDOW_PER_WORKER = 4
+
+# 交互模式下结果表最多显示的行数
+MAX_TABLE_ROWS = 200
+
+# 无界面模式下状态行的打印间隔（秒）
+STATUS_INTERVAL = 10
+
+_END = object()
+
+
+def as_completed_bounded(submit, jobs, window):
+    """按完成顺序产出 (任务, future)
+
+    jobs 可以是生成器，只在窗口有空位时才取下一个；submit(任务) 提交任务并返回future
+    """
+    jobs = iter(jobs)
+    pending = {}
+
+    def fill():
+        while len(pending) < window:
+            job = next(jobs, _END)
+            if job is _END:
+                return
+            pending[submit(job)] = job
+
+    fill()
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield pending.pop(future), future
+        fill()
+
+
+async def gather_bounded(run_one, jobs, window):
+    """asyncio版本：window 个协程轮流从 jobs 中取任务执行，任何时刻最多 window 个任务在途
+
+    jobs 是扫描目录的生成器时，取下一个任务要读目录、查文件，放到线程里做，不阻塞事件循环；
+    生成器不能在多个线程里同时推进，取任务时加锁
+    """
+    jobs = iter(jobs)
+    lock = asyncio.Lock()
+
+    async def worker():
+        while True:
+            async with lock:
+                job = await asyncio.to_thread(next, jobs, _END)
+            if job is _END:
+                return
+            await run_one(job)
+
+    await asyncio.gather(*(worker() for _ in range(max(1, window))))
+
+
+def _clean(text):
+    return str(text).replace('\t', ' ').replace('\n', ' ')
+
+
+class ResultLog:
+    """逐行追加的结果日志：时间、状态、名称、其他字段，以制表符分隔"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def write(self, status, name, *fields):
+        line = '\t'.join([time.strftime('%Y-%m-%dT%H:%M:%S'), status, _clean(name), *(_clean(f) for f in fields)])
+        self.file.write(line + '\n')
+
+    def close(self):
+        self.file.close()
+
+
+class CappedTable:
+    """只保留前 limit 行的rich表格"""
+
+    def __init__(self, table, limit=MAX_TABLE_ROWS):
+        self.table = table
+        self.limit = limit
+        self.hidden = 0
+
+    def add_row(self, *cells):
+        if self.table.row_count < self.limit:
+            self.table.add_row(*cells)
+        else:
+            self.hidden += 1
+
+    def render(self, console):
+        console.print(self.table)
+        if self.hidden:
+            console.print(f"[dim]… 另有 {self.hidden} 行未显示[/dim]")
+
+
+class StatusLine:
+    """无界面模式下按固定间隔打印一行汇总"""
+
+    def __init__(self, console, interval=STATUS_INTERVAL):
+        self.console = console
+        self.interval = interval
+        self.start_time = time.monotonic()
+        self.last = self.start_time
+
+    def update(self, text, force=False):
+        now = time.monotonic()
+        if force or now - self.last >= self.interval:
+            self.last = now
+            elapsed = int(now - self.start_time)
+            self.console.print(f"[{elapsed // 3600}:{elapsed // 60 % 60:02d}:{elapsed % 60:02d}] {text}", highlight=False)
@@ -0,0 +1,139 @@
+# This file is part of ncm_cracker.
+#
+# ncm_cracker is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ncm_cracker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ncm_cracker.  If not, see <https://www.gnu.org/licenses/>.
+"""
+📶 跨进程字节级进度
+工作进程在共享内存中累加已处理字节数，父进程定时采样，进度条不再只在文件完成时才前进：
+1. 共享内存计数数组 - 每个工作进程/线程独占一个槽位，只有它自己写，热循环里只是一次整数加法，不加锁不通信
+2. 父进程按固定频率采样求和，计算吞吐量（滑动平均）和剩余时间
+3. 未挂接计数器时 report_bytes 什么都不做，解密函数单独调用也不受影响
+"""
+
+import multiprocessing
+import threading
+import time
+
+from ffmpeg_progress import format_eta
+
+# 计数槽位数：进程池 + 线程池的工作者总数不会超过它，多出的工作者只是不计入进度
+DEFAULT_SLOTS = 64
+
+# 父进程采样间隔（秒）
+SAMPLE_INTERVAL = 0.25
+
+# 吞吐量滑动平均的平滑系数
+RATE_SMOOTHING = 0.3
+
+# 当前进程挂接的计数器（进程池 initializer 中设置）
+_values = None
+_next_slot = None
+_local = threading.local()
+
+
+class ByteCounters:
+    """父进程创建的共享计数数组"""
+
+    def __init__(self, slots=DEFAULT_SLOTS):
+        # RawArray 没有锁：每个槽位只有一个写者
+        self.values = multiprocessing.RawArray('q', slots)
+        self.next_slot = multiprocessing.Value('i', 0)
+
+    @property
+    def initargs(self):
+        """传给进程池 initializer=attach 的参数"""
+        return self.values, self.next_slot
+
+    def total(self):
+        return sum(self.values)
+
+
+def attach(values, next_slot):
+    """把当前进程挂接到计数器（作为进程池的 initializer，或在父进程中给线程池使用）"""
+    global _values, _next_slot
+    _values = values
+    _next_slot = next_slot
+    _local.__dict__.clear()
+
+
+def detach():
+    global _values, _next_slot
+    _values = None
+    _next_slot = None
+
+
+def report_bytes(nbytes):
+    """记录已处理的字节数；每个线程第一次调用时领取一个槽位"""
+    values = _values
+    if values is None:
+        return
+    slot = getattr(_local, 'slot', None)
+    if slot is None:
+        with _next_slot.get_lock():
+            slot = _next_slot.value
+            _next_slot.value += 1
+        _local.slot = slot
+    if slot < len(values):
+        values[slot] += nbytes
+
+
+class ByteProgressSampler:
+    """后台线程定时采样计数器，更新rich进度条中的一行：已处理 / 总量、吞吐量、剩余时间"""
+
+    def __init__(self, counters, progress, total_bytes, label="💾 数据", interval=SAMPLE_INTERVAL):
+        self.counters = counters
+        self.progress = progress
+        self.total_bytes = total_bytes
+        self.label = label
+        self.interval = interval
+        self.task_id = progress.add_task(label, total=total_bytes or None)
+        self.rate = 0
+        self.done = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._start_time = time.monotonic()
+        self._last = (self._start_time, 0)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        now = time.monotonic()
+        done = self.counters.total()
+        last_time, last_done = self._last
+        if now > last_time:
+            instant = (done - last_done) / (now - last_time)
+            self.rate = instant if not self.rate else RATE_SMOOTHING * instant + (1 - RATE_SMOOTHING) * self.rate
+        self._last = (now, done)
+        self.done = done
+
+        description = f"{self.label} {done/(1024*1024):.1f}/{self.total_bytes/(1024*1024):.1f} MB  [cyan]{self.rate/(1024*1024):.1f} MB/s[/cyan]"
+        if self.rate > 0 and self.total_bytes > done:
+            description += f" 剩余 {format_eta((self.total_bytes - done) / self.rate)}"
+        self.progress.update(self.task_id, completed=min(done, self.total_bytes), description=description)
+
+    def stop(self):
+        """停止采样，进度条补满（失败文件未处理的字节不再计入）"""
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.sample()
+        elapsed = time.monotonic() - self._start_time
+        average = self.done / elapsed if elapsed > 0 else 0
+        self.progress.update(self.task_id, completed=self.total_bytes,
+                             description=f"{self.label} {self.done/(1024*1024):.1f} MB  [cyan]平均 {average/(1024*1024):.1f} MB/s[/cyan]")
@@ -0,0 +1,436 @@
+# This file is part of ncm_cracker.
+#
+# ncm_cracker is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ncm_cracker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ncm_cracker.  If not, see <https://www.gnu.org/licenses/>.
+"""
+📐 容量规划
+解密和压缩每跑完一批，就把每个文件的吞吐量记进历史；开工之前用历史估算待处理的积压：
+1. 滚动历史 - 按 阶段/格式/大小档/并发数/主机 记录每个文件的耗时和输出大小，只保留最近的记录
+2. 预计耗时 - 对每个候选并发数按最长优先模拟调度，得到整批耗时，并用同并发数下实测的整批吞吐量兜底；
+   吞吐量只在实测过的并发数之间插值，超过实测最大并发数时不假设还能继续线性提速
+3. 推荐并发数 - 取耗时与最优值相差不超过5%的最小并发数，多开进程换不来时间就不开；
+   候选值不超过可用核心数，并给出对应工具的参数（解密 --workers，压缩 --max-jobs）
+4. 峰值磁盘 - 解密输出约等于NCM大小，压缩输出按历史压缩比估算，与剩余空间比较
+5. 只读文件头和记录文件，不启动任何解密或编码
+
+用法：
+    python capacity_planner.py plan
+    python capacity_planner.py history
+"""
+
+import argparse
+import heapq
+import json
+import os
+import pathlib
+import shutil
+import socket
+import statistics
+import time
+from rich.console import Console
+from rich.panel import Panel
+from rich.table import Table
+
+from cpu_budget import available_cpu_count
+from ffmpeg_progress import format_eta
+from library_layout import iter_library_files
+
+console = Console()
+
+HISTORY_FILE = ".throughput_history.jsonl"
+
+# 保留的文件记录数；超出一定比例后整理一次，不必每次都重写
+MAX_RECORDS = 5000
+COMPACT_SLACK = 1.25
+
+# 一个分组至少有这么多样本才采用，否则退到更粗的分组
+MIN_SAMPLES = 3
+
+# 每个分组只看最近的样本，硬件或参数变化后估算能跟上
+RECENT_SAMPLES = 200
+
+# 耗时与最优值相差在此比例内时，选更小的并发数
+RECOMMEND_TOLERANCE = 0.05
+
+# 没有历史时的单文件吞吐量（字节/秒）和压缩输出比例
+DEFAULT_RATES = {
+    'decrypt': 80 * 1024 * 1024,
+    'compress': 4 * 1024 * 1024,
+}
+DEFAULT_OUTPUT_RATIO = 0.35
+
+STAGE_NAMES = {'decrypt': "🔓 解密", 'compress': "🗜️ 压缩"}
+
+# 应用推荐并发数的命令行参数
+STAGE_FLAGS = {'decrypt': "crack_ultra_fast.py --workers", 'compress': "compresser_ultra_fast.py --max-jobs"}
+
+DECRYPT_FORMATS = ['.flac', '.mp3', '.wav', '.m4a', '.aac', '.ogg']
+
+
+def size_bucket(size):
+    """大小档：0 为不足1MB，n 为 [2^(n-1), 2^n) MB"""
+    return (int(size) // (1024 * 1024)).bit_length()
+
+
+def bucket_label(bucket):
+    if bucket == 0:
+        return "<1 MB"
+    return f"{2 ** (bucket - 1)}-{2 ** bucket} MB"
+
+
+def file_format(path):
+    """文件扩展名（不含点，小写），作为格式分组"""
+    return pathlib.Path(path).suffix.lstrip('.').lower() or 'unknown'
+
+
+def record_run(stage, files, workers, elapsed, path=HISTORY_FILE):
+    """记录一批处理的结果
+
+    files 为 [(格式, 输入字节数, 耗时秒数, 输出字节数), ...]，只应包含真正处理过的文件；
+    由父进程在整批结束后调用一次
+    """
+    files = [entry for entry in files if entry[1] > 0 and entry[2] > 0]
+    if not files:
+        return
+    host = socket.gethostname()
+    now = int(time.time())
+    lines = [
+        json.dumps({
+            'kind': 'file', 'stage': stage, 'format': (fmt or 'unknown').lower(), 'bucket': size_bucket(size),
+            'size': size, 'seconds': round(seconds, 4), 'output_size': output_size,
+            'workers': workers, 'host': host, 'time': now,
+        }, ensure_ascii=False)
+        for fmt, size, seconds, output_size in files
+    ]
+    lines.append(json.dumps({
+        'kind': 'run', 'stage': stage, 'workers': workers, 'files': len(files),
+        'bytes': sum(entry[1] for entry in files), 'elapsed': round(elapsed, 4),
+        'host': host, 'time': now,
+    }, ensure_ascii=False))
+
+    path = pathlib.Path(path)
+    existing = read_lines(path)
+    if len(existing) + len(lines) > MAX_RECORDS * COMPACT_SLACK:
+        # 整理：只保留最近的记录，临时文件写完再原子替换
+        temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join((existing + lines)[-MAX_RECORDS:]) + '\n')
+        os.replace(temp_path, path)
+    else:
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+
+
+def read_lines(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return [line.rstrip('\n') for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def interpolate(points, workers):
+    """points 为 {并发数: 值}，返回 (值, 超出方向, 端点)：实测并发数之间线性插值，超出范围时取最近端点的值
+
+    超出方向为 'below' / 'above' 表示 workers 小于最小 / 大于最大的实测并发数（否则为None），由调用方决定如何换算
+    """
+    measured = sorted(points)
+    if workers <= measured[0]:
+        return points[measured[0]], ('below' if workers < measured[0] else None), measured[0]
+    if workers >= measured[-1]:
+        return points[measured[-1]], ('above' if workers > measured[-1] else None), measured[-1]
+    for low, high in zip(measured, measured[1:]):
+        if low <= workers <= high:
+            weight = (workers - low) / (high - low)
+            return points[low] + (points[high] - points[low]) * weight, None, workers
+    return points[measured[-1]], None, measured[-1]
+
+
+def load_history(path=HISTORY_FILE):
+    """读取历史记录，跳过损坏的行"""
+    records = []
+    for line in read_lines(path):
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            continue
+    return records
+
+
+class ThroughputModel:
+    """由历史记录估算单个文件的吞吐量和整批吞吐量"""
+
+    def __init__(self, records, host=None, cpus=None):
+        self.host = host or socket.gethostname()
+        self.cpus = cpus or available_cpu_count()
+        self.files = [r for r in records if r.get('kind') == 'file' and r.get('seconds', 0) > 0]
+        self.runs = [r for r in records if r.get('kind') == 'run' and r.get('elapsed', 0) > 0]
+        self._cache = {}
+
+    def samples(self, stage, fmt, bucket):
+        """按 主机+格式+大小档 -> 格式+大小档 -> 格式 -> 阶段 逐级放宽，返回 (样本, 来源说明)"""
+        key = (stage, fmt, bucket)
+        if key in self._cache:
+            return self._cache[key]
+        stage_files = [r for r in self.files if r['stage'] == stage]
+        levels = [
+            ("本机同格式同大小", lambda r: r['host'] == self.host and r['format'] == fmt and r['bucket'] == bucket),
+            ("同格式同大小", lambda r: r['format'] == fmt and r['bucket'] == bucket),
+            ("同格式", lambda r: r['format'] == fmt),
+            ("全部", lambda r: True),
+        ]
+        result = ([], "默认值")
+        for label, match in levels:
+            matched = [r for r in stage_files if match(r)][-RECENT_SAMPLES:]
+            if len(matched) >= MIN_SAMPLES or (matched and label == "全部"):
+                result = (matched, label)
+                break
+        self._cache[key] = result
+        return result
+
+    def contention(self, workers):
+        """并发数超过核心数后每个文件分到的CPU按比例减少"""
+        return max(1.0, workers / self.cpus)
+
+    def file_rate(self, stage, fmt, size, workers):
+        """并发数为 workers 时单个文件的吞吐量（字节/秒），返回 (吞吐量, 来源说明)"""
+        samples, source = self.samples(stage, fmt, size_bucket(size))
+        if not samples:
+            return DEFAULT_RATES[stage] / self.contention(workers), source
+        by_workers = {}
+        for r in samples:
+            by_workers.setdefault(r['workers'], []).append(r['size'] / r['seconds'])
+        # 实测并发数之间插值；少于实测并发数时沿用最小并发数的速度（并发越少单文件越快，偏保守），
+        # 多于实测并发数时只按CPU争用减速，不假设单文件速度不变
+        rate, side, endpoint = interpolate({w: statistics.median(rates) for w, rates in by_workers.items()}, workers)
+        if side == 'above':
+            rate *= self.contention(endpoint) / self.contention(workers)
+        return rate, source
+
+    def run_rate(self, stage, workers):
+        """本机实测的整批吞吐量（字节/秒），包含进程启动、磁盘等单文件样本看不到的开销；没有记录时返回None
+
+        实测并发数之间插值；少于最小实测并发数时按并发数等比例缩小，
+        多于最大实测并发数时保持最大实测并发数的吞吐量——I/O受限时加进程不会更快，不做外推
+        """
+        by_workers = {}
+        for r in self.runs:
+            if r['stage'] == stage and r['host'] == self.host:
+                by_workers.setdefault(r['workers'], []).append(r['bytes'] / r['elapsed'])
+        if not by_workers:
+            return None
+        points = {w: statistics.median(rates[-RECENT_SAMPLES:]) for w, rates in by_workers.items()}
+        rate, side, endpoint = interpolate(points, workers)
+        if side == 'below':
+            rate *= workers / endpoint
+        return rate
+
+    def output_ratio(self, stage, fmt):
+        """输出大小 / 输入大小"""
+        ratios = [r['output_size'] / r['size'] for r in self.files
+                  if r['stage'] == stage and r['format'] == fmt and r['size'] > 0][-RECENT_SAMPLES:]
+        if not ratios:
+            ratios = [r['output_size'] / r['size'] for r in self.files
+                      if r['stage'] == stage and r['size'] > 0][-RECENT_SAMPLES:]
+        if ratios:
+            return statistics.median(ratios)
+        return DEFAULT_OUTPUT_RATIO if stage == 'compress' else 1.0
+
+
+def simulate_makespan(durations, workers):
+    """最长优先调度到 workers 个工作者上，返回整批耗时"""
+    finish = [0.0] * max(1, workers)
+    for duration in sorted(durations, reverse=True):
+        heapq.heapreplace(finish, finish[0] + duration)
+    return max(finish)
+
+
+def read_record(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return set(f.read().strip().split('\n'))
+    except FileNotFoundError:
+        return set()
+
+
+def pending_files(original_dir='01_original', decrypted_dir='02_decrypted'):
+    """待处理的文件：{'decrypt': [(格式, 大小)], 'compress': [(格式, 大小)]}
+
+    尚未解密的NCM在解密后还要压缩，以NCM大小近似解密输出的大小一并计入压缩
+    """
+    from crack_ultra_fast import read_ncm_meta
+
+    cracked = read_record('cracked.txt')
+    compressed = read_record('compressed.txt')
+    pending = {'decrypt': [], 'compress': []}
+
+    decrypted_stems = set()
+    decrypted_path = pathlib.Path(decrypted_dir)
+    if decrypted_path.exists():
+        for input_file in iter_library_files(decrypted_path):
+            if input_file.suffix.lower() in DECRYPT_FORMATS:
+                decrypted_stems.add(input_file.stem)
+                if input_file.stem not in compressed:
+                    pending['compress'].append((file_format(input_file), input_file.stat().st_size))
+
+    original_path = pathlib.Path(original_dir)
+    if original_path.exists():
+        for ncm_file in iter_library_files(original_path, {'.ncm'}):
+            if ncm_file.stem in cracked:
+                continue
+            try:
+                fmt = read_ncm_meta(ncm_file).get('format', 'unknown')
+            except Exception:
+                fmt = 'unknown'
+            size = ncm_file.stat().st_size
+            pending['decrypt'].append((fmt, size))
+            if ncm_file.stem not in decrypted_stems and ncm_file.stem not in compressed:
+                pending['compress'].append((fmt, size))
+    return pending
+
+
+def plan_stage(model, stage, files, candidates):
+    """估算一个阶段在各候选并发数下的耗时，返回结果字典"""
+    estimates = {}
+    sources = set()
+    for workers in candidates:
+        durations = []
+        for fmt, size in files:
+            rate, source = model.file_rate(stage, fmt, size, workers)
+            sources.add(source)
+            durations.append(size / rate)
+        makespan = simulate_makespan(durations, workers)
+        # 整批实测吞吐量作为下限，反映单文件样本看不到的瓶颈
+        run_rate = model.run_rate(stage, workers)
+        if run_rate:
+            makespan = max(makespan, sum(size for _, size in files) / run_rate)
+        estimates[workers] = makespan
+
+    best = min(estimates.values()) if estimates else 0
+    recommended = min((w for w, t in estimates.items() if t <= best * (1 + RECOMMEND_TOLERANCE)), default=1)
+    return {
+        'files': len(files),
+        'bytes': sum(size for _, size in files),
+        'output_bytes': sum(size * model.output_ratio(stage, fmt) for fmt, size in files),
+        'estimates': estimates,
+        'recommended': recommended,
+        'seconds': estimates.get(recommended, 0),
+        'sources': sorted(sources),
+    }
+
+
+def make_plan(history_path=HISTORY_FILE, max_workers=None, original_dir='01_original', decrypted_dir='02_decrypted'):
+    """生成积压处理计划（不启动任何处理）"""
+    model = ThroughputModel(load_history(history_path))
+    # 压缩的 --max-jobs 不会超过可用核心数，超出核心数的候选也不会更快
+    limit = min(max_workers or model.cpus, model.cpus)
+    candidates = range(1, limit + 1)
+    pending = pending_files(original_dir, decrypted_dir)
+    stages = {stage: plan_stage(model, stage, files, candidates) for stage, files in pending.items() if files}
+    free = shutil.disk_usage('.').free
+    peak = sum(stage['output_bytes'] for stage in stages.values())
+    return {'host': model.host, 'cpus': model.cpus, 'stages': stages, 'peak_disk': peak, 'free_disk': free}
+
+
+def show_plan(plan):
+    if not plan['stages']:
+        console.print("✅ 没有待处理的文件", style="green")
+        return
+
+    summary_table = Table(title="📐 积压估算")
+    summary_table.add_column("阶段", style="cyan")
+    summary_table.add_column("文件", justify="right")
+    summary_table.add_column("数据量", justify="right", style="yellow")
+    summary_table.add_column("推荐并发", justify="right", style="bold red")
+    summary_table.add_column("预计耗时", justify="right", style="bold green")
+    summary_table.add_column("单并发耗时", justify="right", style="dim")
+    summary_table.add_column("估算依据", style="blue")
+    for stage, result in plan['stages'].items():
+        summary_table.add_row(
+            STAGE_NAMES[stage],
+            str(result['files']),
+            f"{result['bytes']/(1024*1024):.1f} MB",
+            str(result['recommended']),
+            format_eta(result['seconds']),
+            format_eta(result['estimates'].get(1, 0)),
+            ', '.join(result['sources']),
+        )
+    console.print(summary_table)
+    for stage, result in plan['stages'].items():
+        console.print(f"💡 {STAGE_NAMES[stage]}: python {STAGE_FLAGS[stage]} {result['recommended']}", style="dim")
+
+    total = sum(result['seconds'] for result in plan['stages'].values())
+    disk_style = "bold red" if plan['peak_disk'] > plan['free_disk'] else "bold green"
+    info_table = Table(show_header=False, box=None)
+    info_table.add_column("", style="bold")
+    info_table.add_column("", style="")
+    info_table.add_row("🖥️  主机", f"{plan['host']}  (可用核心 [bold cyan]{plan['cpus']}[/bold cyan])")
+    info_table.add_row("⏱️  总计", f"[bold yellow]{format_eta(total)}[/bold yellow] (解密后再压缩)")
+    info_table.add_row("💾 新增磁盘", f"[{disk_style}]{plan['peak_disk']/(1024*1024):.1f} MB[/{disk_style}]"
+                                   f"  剩余 {plan['free_disk']/(1024*1024):.1f} MB")
+    console.print(Panel(info_table, title="📐 容量规划", border_style="cyan"))
+    if plan['peak_disk'] > plan['free_disk']:
+        console.print("⚠️ 剩余空间不足以容纳全部输出", style="bold red")
+
+
+def show_history(history_path=HISTORY_FILE):
+    records = load_history(history_path)
+    files = [r for r in records if r.get('kind') == 'file']
+    if not files:
+        console.print(f"❌ 还没有吞吐量历史 ({history_path})", style="red")
+        console.print("💡 提示：运行一次解密或压缩后会自动记录", style="yellow")
+        return
+
+    groups = {}
+    for r in files:
+        groups.setdefault((r['stage'], r['format'], r['bucket'], r['workers'], r['host']), []).append(r)
+    history_table = Table(title="📈 吞吐量历史")
+    history_table.add_column("阶段", style="cyan")
+    history_table.add_column("格式", style="magenta")
+    history_table.add_column("大小档", justify="right")
+    history_table.add_column("并发", justify="right")
+    history_table.add_column("主机", style="dim")
+    history_table.add_column("样本", justify="right")
+    history_table.add_column("单文件吞吐", justify="right", style="red")
+    history_table.add_column("输出比例", justify="right", style="green")
+    for (stage, fmt, bucket, workers, host), group in sorted(groups.items()):
+        rate = statistics.median(r['size'] / r['seconds'] for r in group if r['seconds'] > 0)
+        ratio = statistics.median(r['output_size'] / r['size'] for r in group if r['size'] > 0)
+        history_table.add_row(STAGE_NAMES.get(stage, stage), fmt, bucket_label(bucket), str(workers), host,
+                              str(len(group)), f"{rate/(1024*1024):.1f} MB/s", f"{ratio:.2f}")
+    console.print(history_table)
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="根据历史吞吐量估算积压的处理时间和并发数")
+    parser.add_argument('--history', default=HISTORY_FILE, help=f"历史记录文件 (默认: {HISTORY_FILE})")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    plan_parser = subparsers.add_parser('plan', help="估算待处理文件的耗时、峰值磁盘占用和推荐并发数")
+    plan_parser.add_argument('--max-workers', type=int, help="候选并发数上限 (默认: 可用核心数)")
+    plan_parser.add_argument('--json', action='store_true', help="以JSON输出计划")
+    subparsers.add_parser('history', help="按分组显示吞吐量历史")
+    args = parser.parse_args()
+
+    if args.command == 'plan':
+        plan = make_plan(args.history, args.max_workers)
+        if args.json:
+            print(json.dumps(plan, ensure_ascii=False, indent=2))
+        else:
+            show_plan(plan)
+    elif args.command == 'history':
+        show_history(args.history)
+
+
+if __name__ == "__main__":
+    main()
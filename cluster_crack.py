@@ -0,0 +1,452 @@
+# This file is part of ncm_cracker.
+#
+# ncm_cracker is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ncm_cracker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ncm_cracker.  If not, see <https://www.gnu.org/licenses/>.
+"""
+🌐 多节点集群解密
+多台机器挂载同一个共享目录，无需中心服务即可共同消化积压的NCM文件：
+1. 租约文件 - 每个文件用 O_EXCL 创建的租约认领，同一时刻只有一个节点处理，完成后留作完成标记
+2. 心跳续约 - 后台线程定期刷新处理中的租约，扫描和认领积压时也不会漏掉心跳，节点宕机后租约超时即可被其他节点接管；
+   临时文件按节点和租约令牌区分，被接管的节点只在仍持有租约时才把结果改名为正式文件，丢失租约的结果不计入统计
+3. 每节点独立记录 - 避免多台机器同时追加同一个文件，结束时合并进 cracked.txt
+4. 单机上同时启动多个进程即可模拟集群
+
+用法：
+    python cluster_crack.py run --workers 4
+    python cluster_crack.py status
+    python cluster_crack.py merge
+"""
+
+import argparse
+import json
+import os
+import pathlib
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from rich.console import Console
+from rich.panel import Panel
+from rich.table import Table
+
+from audio_probe import longest_first
+from crack_ultra_fast import dump_ultra_fast
+from cpu_budget import available_cpu_count
+from library_layout import iter_library_files
+from preflight import describe, failure, failure_reason
+
+console = Console()
+
+CLUSTER_DIR = ".cluster"
+
+# 租约超过该秒数未续约即视为持有节点已失联
+LEASE_TTL = 120
+
+# 没有可认领的文件、但还有别的节点在处理时的轮询间隔（秒）
+POLL_INTERVAL = 5
+
+
+def node_id():
+    """节点标识：主机名 + 进程号，同一台机器上的多个进程也互不相同"""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class LeaseTable:
+    """共享目录上的租约表：每个任务一个租约文件，内容为持有者和随机令牌，修改时间即心跳时间"""
+
+    def __init__(self, root, node, ttl=LEASE_TTL):
+        self.dir = pathlib.Path(root) / "leases"
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.node = node
+        self.ttl = ttl
+        self.tokens = {}
+
+    def _path(self, key):
+        return self.dir / f"{key}.lease"
+
+    def read(self, key):
+        """读取租约，返回 (内容, 距上次心跳的秒数)；不存在时返回 (None, None)"""
+        path = self._path(key)
+        try:
+            age = time.time() - path.stat().st_mtime
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f), age
+        except (FileNotFoundError, ValueError):
+            return None, None
+
+    def _create(self, key):
+        token = uuid.uuid4().hex
+        try:
+            fd = os.open(self._path(key), os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'node': self.node, 'token': token, 'claimed': time.time()}, f)
+        self.tokens[key] = token
+        return True
+
+    def claim(self, key):
+        """尝试认领任务；租约已过期时接管"""
+        if self._create(key):
+            return True
+        lease, age = self.read(key)
+        if lease is None or lease.get('state') == 'done' or age is None or age <= self.ttl:
+            return False
+        # 先把过期租约改名为私有文件（只有一个节点能改名成功），确认改走的正是那份过期租约
+        stale_path = self.dir / f"{key}.stale.{self.node}"
+        try:
+            os.rename(self._path(key), stale_path)
+        except FileNotFoundError:
+            return False
+        try:
+            with open(stale_path, 'r', encoding='utf-8') as f:
+                taken = json.load(f)
+        except (OSError, ValueError):
+            taken = None
+        if taken is not None and taken.get('token') != lease.get('token'):
+            # 改走的是别的节点刚创建的新租约，尽量还回去
+            try:
+                os.link(stale_path, self._path(key))
+            except OSError:
+                pass
+            stale_path.unlink(missing_ok=True)
+            return False
+        stale_path.unlink(missing_ok=True)
+        return self._create(key)
+
+    def held(self, key):
+        """租约是否仍由本节点持有（未被接管、未完成）"""
+        lease, _ = self.read(key)
+        return lease is not None and lease.get('state') != 'done' and lease.get('token') == self.tokens.get(key)
+
+    def renew(self, key):
+        """续约（刷新修改时间）；租约已被接管时返回False"""
+        lease, _ = self.read(key)
+        if lease is None or lease.get('token') != self.tokens.get(key):
+            return False
+        try:
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def complete(self, key):
+        """任务完成：租约改为永不过期的完成标记，扫描快照较旧的节点也不会重复处理"""
+        lease, _ = self.read(key)
+        if lease is None or lease.get('token') != self.tokens.get(key):
+            self.tokens.pop(key, None)
+            return False
+        temp_path = self.dir / f"{key}.done.{self.node}"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(dict(lease, state='done', finished=time.time()), f)
+        os.replace(temp_path, self._path(key))
+        self.tokens.pop(key, None)
+        return True
+
+    def release(self, key):
+        """释放自己持有的租约"""
+        lease, _ = self.read(key)
+        if lease is not None and lease.get('token') == self.tokens.get(key):
+            self._path(key).unlink(missing_ok=True)
+        self.tokens.pop(key, None)
+
+    def leases(self):
+        """列出所有租约 [(任务, 内容, 心跳秒数), ...]"""
+        result = []
+        for path in sorted(self.dir.glob('*.lease')):
+            lease, age = self.read(path.name[:-len('.lease')])
+            if lease is not None and lease.get('state') != 'done':
+                result.append((path.name[:-len('.lease')], lease, age))
+        return result
+
+
+class LeaseLost(Exception):
+    """处理过程中租约被其他节点接管"""
+
+
+class LeaseGuard:
+    """交给解密进程的租约凭据：tag 区分临时文件，调用时确认租约仍由本节点持有，否则抛出 LeaseLost"""
+
+    def __init__(self, leases, key):
+        self.leases = leases
+        self.key = key
+        self.token = leases.tokens[key]
+
+    @property
+    def tag(self):
+        return f"{self.leases.node}.{self.token}"
+
+    def __call__(self):
+        lease, _ = self.leases.read(self.key)
+        if lease is None or lease.get('state') == 'done' or lease.get('token') != self.token:
+            raise LeaseLost(f"lease on {self.key} was taken over")
+
+
+class LeaseHeartbeat:
+    """后台线程按 ttl/4 给处理中的租约续约，与主线程的扫描、认领互不阻塞；续约失败的任务记为丢失"""
+
+    def __init__(self, leases, on_lost):
+        self.leases = leases
+        self.on_lost = on_lost
+        self.interval = leases.ttl / 4
+        self.active = set()
+        self.lost = set()
+        self.lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            with self.lock:
+                names = list(self.active - self.lost)
+            for name in names:
+                if self.leases.renew(name):
+                    continue
+                with self.lock:
+                    # 主线程已经收尾的任务不算丢失
+                    if name not in self.active or name in self.lost:
+                        continue
+                    self.lost.add(name)
+                self.on_lost(name)
+
+    def add(self, name):
+        with self.lock:
+            self.active.add(name)
+
+    def __contains__(self, name):
+        with self.lock:
+            return name in self.active
+
+    def finish(self, name):
+        """任务结束，不再续约；返回心跳期间租约是否已丢失"""
+        with self.lock:
+            self.active.discard(name)
+            if name in self.lost:
+                self.lost.discard(name)
+                return True
+            return False
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+
+def records_dir(root=CLUSTER_DIR):
+    path = pathlib.Path(root) / "records"
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def load_done(record_path='cracked.txt', root=CLUSTER_DIR):
+    """已完成的任务 = cracked.txt ∪ 所有节点的记录文件"""
+    done = set()
+    for path in [pathlib.Path(record_path)] + list(records_dir(root).glob('*.txt')):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                done.update(line.strip() for line in f if line.strip())
+        except FileNotFoundError:
+            continue
+    return done
+
+
+def merge_records(record_path='cracked.txt', root=CLUSTER_DIR, own_record=None):
+    """把所有节点记录合并进 cracked.txt（去重，原子替换）；own_record 合并后删除
+
+    每个节点只删除自己的记录文件，其他节点仍在追加的文件保持不动，重复合并是幂等的。
+    合并过程持有 __merge__ 租约，避免两个节点同时改写 cracked.txt 互相覆盖。
+    """
+    lock = LeaseTable(root, node_id())
+    while not lock.claim('__merge__'):
+        time.sleep(0.2)
+    try:
+        return _merge_records_locked(record_path, root, own_record)
+    finally:
+        lock.release('__merge__')
+
+
+def _merge_records_locked(record_path, root, own_record):
+    done = load_done(record_path, root)
+    try:
+        with open(record_path, 'r', encoding='utf-8') as f:
+            existing = [line.strip() for line in f if line.strip()]
+    except FileNotFoundError:
+        existing = []
+    merged = existing + sorted(done - set(existing))
+    temp_path = f"{record_path}.{node_id()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(''.join(name + '\n' for name in merged))
+    os.replace(temp_path, record_path)
+    if own_record is not None:
+        pathlib.Path(own_record).unlink(missing_ok=True)
+    return len(merged) - len(existing)
+
+
+def run_node(workers=None, ttl=LEASE_TTL, root=CLUSTER_DIR):
+    """以集群节点身份运行：反复认领、解密、续约，直到积压清空"""
+    node = node_id()
+    workers = workers or max(1, min(available_cpu_count(), 6))
+    leases = LeaseTable(root, node, ttl)
+    own_record = records_dir(root) / f"{node}.txt"
+    original_dir = pathlib.Path("01_original")
+    pathlib.Path("02_decrypted").mkdir(exist_ok=True)
+
+    console.print(Panel.fit(f"🌐 集群解密节点 {node}", style="bold magenta"))
+    console.print(f"🔥 并行进程: [bold red]{workers}[/bold red]  租约超时: [bold yellow]{ttl}[/bold yellow] 秒\n")
+
+    stats = {'successful': 0, 'failed': 0, 'size': 0, 'lost': 0}
+    failed = set()
+    start_time = time.time()
+
+    def on_lost(name):
+        # 心跳线程调用：已丢失的租约只记一次，解密进程在下个检查点或改名前自行放弃
+        stats['lost'] += 1
+        console.print(f"⚠️  {name} 的租约已被其他节点接管", style="yellow")
+
+    heartbeat = LeaseHeartbeat(leases, on_lost).start()
+    # 按时长排好序的积压：重新扫描时只给新出现的文件读头估计时长，已排好的保持原顺序
+    backlog = []
+    known = set()
+    queue = deque()
+    last_scan = None
+    finished_since_scan = False
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            in_flight = {}
+            while True:
+                if not queue and (last_scan is None or time.time() - last_scan >= POLL_INTERVAL):
+                    # 重新扫描积压：别的节点完成的文件通过共享记录排除
+                    done = load_done(root=root) | failed
+                    pending = [file for file in iter_library_files(original_dir, {'.ncm'}) if file.stem not in done]
+                    fresh = [file for file in pending if file not in known]
+                    known.update(fresh)
+                    pending = set(pending)
+                    backlog = [file for file in backlog if file in pending] + [file for file, _ in longest_first(fresh)]
+                    queue = deque(backlog)
+                    last_scan = time.time()
+                    finished_since_scan = False
+
+                # 保持每个进程都有活干；被别的节点占着的文件本轮不再重试，等下次重新扫描
+                while queue and len(in_flight) < workers:
+                    file = queue.popleft()
+                    if file.stem in heartbeat:
+                        continue
+                    if leases.claim(file.stem):
+                        heartbeat.add(file.stem)
+                        future = executor.submit(dump_ultra_fast, str(file), file.stem, str(own_record),
+                                                 lease=LeaseGuard(leases, file.stem))
+                        in_flight[future] = (file, file.stem)
+
+                if not in_flight:
+                    if not backlog:
+                        break
+                    if finished_since_scan:
+                        # 上次扫描后本节点又完成了任务，立即重新扫描确认积压是否已清空
+                        last_scan = None
+                        continue
+                    # 剩下的都在别的节点手里：等它们完成，或租约过期后接管
+                    time.sleep(max(0, POLL_INTERVAL - (time.time() - last_scan)))
+                    continue
+
+                finished, _ = wait(in_flight, timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    finished_since_scan = True
+                    file, name = in_flight.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = (None, failure(e), 0)
+                    was_lost = heartbeat.finish(name)
+                    if was_lost or not leases.held(name):
+                        # 租约已被接管：结果归新的持有者，这里既不计数也不完成或释放租约
+                        if not was_lost:
+                            stats['lost'] += 1
+                        leases.tokens.pop(name, None)
+                        console.print(f"⚠️  {name} 的租约已被其他节点接管，放弃本节点的结果", style="yellow")
+                        continue
+                    output_name, speed, size = result
+                    if output_name:
+                        stats['successful'] += 1
+                        stats['size'] += size
+                        console.print(f"✅ {name}  {size/(1024*1024):.1f} MB  {speed:.1f} MB/s")
+                        leases.complete(name)
+                    else:
+                        # 失败的任务释放租约，留给其他节点重试
+                        stats['failed'] += 1
+                        failed.add(name)
+                        console.print(f"❌ {name}: {describe(failure_reason(result))}", style="red")
+                        leases.release(name)
+    finally:
+        heartbeat.stop()
+
+    merged = merge_records(own_record=own_record, root=root)
+    elapsed = time.time() - start_time
+
+    summary_table = Table(show_header=False, box=None)
+    summary_table.add_column("", style="bold")
+    summary_table.add_column("", style="")
+    summary_table.add_row("✅ 成功", f"[bold green]{stats['successful']}[/bold green] 个文件")
+    summary_table.add_row("❌ 失败", f"[bold red]{stats['failed']}[/bold red] 个文件")
+    summary_table.add_row("⚠️  租约丢失", f"[bold yellow]{stats['lost']}[/bold yellow] 次")
+    summary_table.add_row("📝 合并记录", f"[bold cyan]{merged}[/bold cyan] 条新记录写入 cracked.txt")
+    summary_table.add_row("⏱️  总耗时", f"[bold yellow]{elapsed:.2f}[/bold yellow] 秒")
+    summary_table.add_row("💾 总处理量", f"[bold magenta]{stats['size']/(1024*1024):.1f}[/bold magenta] MB")
+    console.print(Panel(summary_table, title=f"📊 节点 {node} 统计", border_style="magenta"))
+
+
+def show_status(ttl=LEASE_TTL, root=CLUSTER_DIR):
+    """显示当前租约和各节点记录"""
+    leases = LeaseTable(root, node_id(), ttl)
+    table = Table(title="🌐 集群租约")
+    table.add_column("任务", style="cyan", overflow="fold")
+    table.add_column("节点", style="magenta")
+    table.add_column("心跳", justify="right")
+    table.add_column("状态", justify="center")
+    for key, lease, age in leases.leases():
+        table.add_row(key, lease.get('node', '?'), f"{age:.0f}s", "💀 过期" if age > ttl else "🔒 持有")
+    console.print(table)
+
+    for path in sorted(records_dir(root).glob('*.txt')):
+        with open(path, 'r', encoding='utf-8') as f:
+            count = sum(1 for line in f if line.strip())
+        console.print(f"📝 {path.stem}: {count} 条未合并记录")
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="多节点集群解密")
+    parser.add_argument('--lease-ttl', type=float, default=LEASE_TTL, help="租约超时秒数 (默认: 120)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help="作为节点运行，处理积压直到清空")
+    run_parser.add_argument('--workers', type=int, default=None, help="本节点的解密进程数 (默认: 可用核心数，最多6)")
+    subparsers.add_parser('status', help="显示租约和未合并的节点记录")
+    subparsers.add_parser('merge', help="把所有节点记录合并进 cracked.txt")
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        run_node(args.workers, args.lease_ttl)
+    elif args.command == 'status':
+        show_status(args.lease_ttl)
+    elif args.command == 'merge':
+        console.print(f"📝 合并了 [bold cyan]{merge_records()}[/bold cyan] 条新记录")
+
+
+if __name__ == "__main__":
+    main()
@@ -20,6 +20,7 @@
 3. 智能跳过已处理文件
 4. Rich进度条显示
 5. 独立的compressed.txt记录文件
+6. 字节级进度 - 工作进程按ffmpeg已编码时长折算输入字节，写入共享计数器
 """
 
 import subprocess
@@ -33,17 +34,25 @@ from rich.progress import Progress, SpinnerColumn, TimeElapsedColumn, BarColumn,
 from rich.table import Table
 from rich.panel import Panel
 
+from audio_probe import longest_first
+from byte_progress import ByteCounters, ByteProgressSampler, attach, report_bytes
+from capacity_planner import file_format, record_run
+from library_layout import iter_library_files, load_layout
+from ffmpeg_progress import parse_out_time, progress_args
+from stats_index import StatsIndex
+
 console = Console()
 
 # 全局锁用于文件写入
 file_lock = threading.Lock()
 
-def compress_audio_optimized(input_file, output_file, bitrate='128k', sample_rate=44100):
-    """优化的音频压缩函数"""
+def compress_audio_optimized(input_file, output_file, bitrate='128k', sample_rate=44100, duration=None):
+    """优化的音频压缩函数；duration 已知时按已编码时长折算输入字节，上报字节级进度"""
     command = [
         'ffmpeg',
         '-y',  # 覆盖输出文件
         '-loglevel', 'error',  # 只显示错误信息
+        *progress_args(),
         '-i', str(input_file),
         '-c:a', 'libmp3lame',  # 使用LAME MP3编码器
         '-b:a', bitrate,
@@ -53,12 +62,37 @@ def compress_audio_optimized(input_file, output_file, bitrate='128k', sample_rat
         str(output_file)
     ]
     
+    input_size = input_file.stat().st_size
+    reported = 0
+    
     start_time = time.time()
-    result = subprocess.run(command, check=True, capture_output=True, text=True)
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    # stderr 在线程中读完，错误输出超过管道缓冲时ffmpeg不会阻塞在写stderr上
+    stderr_lines = []
+    stderr_reader = threading.Thread(target=lambda: stderr_lines.extend(process.stderr), daemon=True)
+    stderr_reader.start()
+    block = {}
+    for line in process.stdout:
+        key, _, value = line.strip().partition('=')
+        block[key] = value
+        if key != 'progress':
+            continue
+        out_time = parse_out_time(block)
+        block = {}
+        if duration and out_time is not None:
+            done = int(input_size * min(1.0, out_time / duration))
+            if done > reported:
+                report_bytes(done - reported)
+                reported = done
+    stderr_reader.join()
+    stderr = ''.join(stderr_lines)
+    if process.wait() != 0:
+        raise subprocess.CalledProcessError(process.returncode, command, stderr=stderr)
+    # 时长未知或估计偏短时，在结束时补齐
+    report_bytes(input_size - reported)
     elapsed = time.time() - start_time
     
     # 获取文件大小信息
-    input_size = input_file.stat().st_size
     output_size = output_file.stat().st_size
     compression_ratio = (1 - output_size / input_size) * 100 if input_size > 0 else 0
     
@@ -71,17 +105,22 @@ def compress_audio_optimized(input_file, output_file, bitrate='128k', sample_rat
     }
 
 def process_single_file(args):
-    """单文件处理函数，用于多进程"""
-    input_file, output_file, bitrate, sample_rate = args
+    """单文件处理函数，用于多进程；args 为 (输入, 输出, 码率, 采样率[, 时长])"""
+    input_file, output_file, bitrate, sample_rate, *rest = args
     
     try:
-        result = compress_audio_optimized(input_file, output_file, bitrate, sample_rate)
+        previous_size = output_file.stat().st_size if output_file.exists() else None
+        result = compress_audio_optimized(input_file, output_file, bitrate, sample_rate, *rest)
         
         # 线程安全地写入已处理文件列表
         with file_lock:
             with open('compressed.txt', 'a', encoding='utf-8') as f:
                 f.write(input_file.stem + '\n')
         
+        stats_index = StatsIndex()
+        stats_index.add_file('compressed', result['output_size'], previous_size)
+        stats_index.add_record('compressed')
+        
         return {
             'success': True,
             'input_file': input_file,
@@ -129,11 +168,12 @@ def main_compress():
     files_to_process = []
     supported_formats = ['.flac', '.mp3', '.wav', '.m4a', '.aac']
     
-    for input_file in decrypted_dir.glob('*.*'):
+    layout = load_layout()
+    for input_file in iter_library_files(decrypted_dir):
         if input_file.suffix.lower() in supported_formats:
             file_name_without_ext = input_file.stem
             if file_name_without_ext not in compressed:
-                output_file = compressed_dir / f"{input_file.stem}.mp3"
+                output_file = layout.output_path(compressed_dir, f"{input_file.stem}.mp3")
                 files_to_process.append((input_file, output_file, '128k', 44100))
     
     if not files_to_process:
@@ -141,6 +181,14 @@ def main_compress():
         console.print("💡 提示：请先解密NCM文件到 02_decrypted/ 目录", style="yellow")
         return
     
+    # 进程池按提交顺序派发任务，按时长从长到短提交即为最长处理时间优先
+    schedule = longest_first((f[0] for f in files_to_process), ncm_dir="01_original")
+    rank = {input_file: position for position, (input_file, _) in enumerate(schedule)}
+    durations = dict(schedule)
+    files_to_process.sort(key=lambda file_info: rank[file_info[0]])
+    # 时长用于把ffmpeg的编码进度折算成字节
+    files_to_process = [file_info + (durations[file_info[0]],) for file_info in files_to_process]
+    
     total_size = sum(f[0].stat().st_size for f in files_to_process)
     max_workers = min(multiprocessing.cpu_count(), len(files_to_process), 4)
     
@@ -164,6 +212,8 @@ def main_compress():
     failed = 0
     total_input_size = 0
     total_output_size = 0
+    # 每个文件的 (格式, 输入大小, 耗时, 输出大小)，结束后写入吞吐量历史供容量规划使用
+    throughput = []
     start_time = time.time()
     
     with Progress(
@@ -177,8 +227,11 @@ def main_compress():
     ) as progress:
         
         main_task = progress.add_task("🎵 压缩进度", total=len(files_to_process))
+        # 工作进程在共享内存里累加已编码的输入字节数，父进程定时采样
+        counters = ByteCounters()
+        sampler = ByteProgressSampler(counters, progress, total_size).start()
         
-        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=attach, initargs=counters.initargs) as executor:
             # 提交所有任务
             future_to_file = {
                 executor.submit(process_single_file, file_info): file_info[0].name 
@@ -195,6 +248,8 @@ def main_compress():
                         stats = result['stats']
                         total_input_size += stats['input_size']
                         total_output_size += stats['output_size']
+                        throughput.append((file_format(result['input_file']), stats['input_size'],
+                                           stats['processing_time'], stats['output_size']))
                         
                         # 添加到结果表
                         results_table.add_row(
@@ -227,8 +282,11 @@ def main_compress():
                     )
                 
                 progress.advance(main_task)
+        
+        sampler.stop()
     
     elapsed = time.time() - start_time
+    record_run('compress', throughput, max_workers, elapsed)
     avg_speed = total_input_size / (1024 * 1024) / elapsed if elapsed > 0 else 0
     total_compression_ratio = (1 - total_output_size / total_input_size) * 100 if total_input_size > 0 else 0
     
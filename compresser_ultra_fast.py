@@ -21,28 +21,155 @@
 4. 智能格式检测
 5. 独立compressed.txt记录
 6. 实时性能监控
+7. 编码前探测 - 已达标的MP3直接复制，低码率有损文件跳过重编码
+8. 核心预算 - 并发数 × 每任务线程数不超过可用核心（含cgroup配额），可选绑核
+9. asyncio 直接调度ffmpeg子进程 - 不再为每个任务多开一个Python工作进程
+10. 多版本输出 - 一次解码、一个ffmpeg进程同时产出多个输出配置
+11. 长音轨分段并行 - 超长文件切成时间段并行编码，再无缝拼接MP3帧
+12. 编码结果缓存 - 按内容指纹 + 编码参数寻址，命中时直接硬链接
+13. 实时进度 - 解析 ffmpeg -progress，按实时倍率显示速度、剩余时间和停滞
+14. 最长优先调度 - 按时长从长到短派发，长文件不会最后才开始
+15. 流式输出 - --out - 把压缩结果串成tar流写到stdout，编码完一个送出一个
+16. 无界面模式 - --headless 边扫描边编码，逐版本结果写入日志，适合十万级批次
 """
 
+import argparse
+import asyncio
+import collections
+import contextlib
+import heapq
+import itertools
+import math
 import subprocess
 import pathlib
-import multiprocessing
 import time
-import threading
 import os
-from concurrent.futures import ProcessPoolExecutor, as_completed
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from rich.console import Console
 from rich.progress import Progress, SpinnerColumn, TimeElapsedColumn, BarColumn, TaskProgressColumn, TextColumn
 from rich.table import Table
 from rich.panel import Panel
 
+from audio_probe import probe_audio, parse_bitrate, iter_mp3_frames, longest_first
+from batch_stream import WINDOW_PER_WORKER, CappedTable, ResultLog, StatusLine, gather_bounded
+from capacity_planner import MAX_RECORDS, file_format, record_run
+from cpu_budget import available_cpu_count, plan_thread_budget
+from encode_cache import EncodeCache, DEFAULT_CACHE_DIR
+from library_layout import LibraryLayout, iter_library_files, load_layout
+from loudness import ANALYSIS_FILTER, ANALYSIS_LOG_ARGS, LoudnessStore, analysis_command, parse_ebur128, write_loudness_tags
+from output_sink import close_sink, open_sink
+from stats_index import StatsIndex
+from ffmpeg_progress import ProgressBoard, progress_args, read_progress, track_part
+
 console = Console()
 
-# 全局锁用于文件写入
-file_lock = threading.Lock()
+# 无损编码格式 - 这些输入永远值得重新编码
+LOSSLESS_CODECS = ('flac', 'alac', 'wavpack', 'ape', 'tta')
 
-def compress_audio_ultra_fast(input_file, output_file, bitrate='128k', sample_rate=44100):
-    """超快速音频压缩函数 - 使用最激进的速度优化"""
-    command = [
+# 码率比较的容差，CBR文件的实测平均码率会因帧头/标签略高于标称值
+BITRATE_TOLERANCE = 1.02
+
+# 输出配置 - 每个配置对应一个成品版本
+# 默认配置沿用原来的输出位置 (03_compressed/<名称>.mp3) 和记录格式 (compressed.txt 中只写文件名)
+OUTPUT_PROFILES = {
+    'mp3_128k': {
+        'codec': 'libmp3lame',
+        'bitrate': '128k',
+        'sample_rate': 44100,
+        'extension': 'mp3',
+        'subdir': '',
+        'extra_args': ['-preset', 'ultrafast', '-q:a', '4', '-compression_level', '1', '-frame_size', '1152'],
+    },
+    'mp3_320k': {
+        'codec': 'libmp3lame',
+        'bitrate': '320k',
+        'sample_rate': 44100,
+        'extension': 'mp3',
+        'subdir': 'mp3_320k',
+        'extra_args': [],
+    },
+    'opus_160k': {
+        'codec': 'libopus',
+        'bitrate': '160k',
+        'sample_rate': 48000,
+        'extension': 'opus',
+        'subdir': 'opus_160k',
+        'extra_args': [],
+    },
+}
+
+DEFAULT_PROFILE = 'mp3_128k'
+
+# 压缩阶段接受的输入格式
+SUPPORTED_FORMATS = ('.flac', '.mp3', '.wav', '.m4a', '.aac', '.ogg')
+
+# 无界面模式的逐版本结果日志
+DEFAULT_RESULT_LOG = "compress_results.log"
+
+# 长音轨分段编码参数
+MP3_FRAME_SAMPLES = 1152  # MPEG-1 Layer III 每帧采样数
+SEGMENT_OVER_SECONDS = 20 * 60  # 超过该时长的文件才分段
+SEGMENT_MIN_SECONDS = 30  # 单个分段的最短时长
+SEGMENT_OVERLAP_FRAMES = 8  # 分段前后各多编码的帧数，用来吸收编码器延迟和预热
+
+def profile_record_key(stem, profile_name):
+    """每个版本在 compressed.txt 中的记录键；默认版本保持只写文件名以兼容旧记录"""
+    if profile_name == DEFAULT_PROFILE:
+        return stem
+    return f"{stem}@{profile_name}"
+
+def profile_output_path(compressed_dir, stem, profile_name, layout=None):
+    """每个版本的输出路径；layout 为None时按项目的曲库目录布局放进分片目录"""
+    profile = OUTPUT_PROFILES[profile_name]
+    folder = compressed_dir / profile['subdir'] if profile['subdir'] else compressed_dir
+    return (layout or load_layout()).path(folder, f"{stem}.{profile['extension']}")
+
+def decide_compress_action(info, codec='libmp3lame', bitrate='128k', sample_rate=44100):
+    """根据探测结果决定处理方式：'encode' 重新编码 / 'copy' 直接复制 / 'skip' 跳过"""
+    if not info or not info.get('bitrate') or not info.get('codec'):
+        return 'encode'
+
+    input_codec = info['codec']
+    lossless = input_codec in LOSSLESS_CODECS or input_codec.startswith('pcm_')
+    at_or_below_target = info['bitrate'] <= parse_bitrate(bitrate) * BITRATE_TOLERANCE
+
+    # 已经是目标码率及以下的MP3：重新编码只会浪费CPU并损失音质
+    if (codec == 'libmp3lame' and input_codec == 'mp3' and at_or_below_target
+            and (info.get('sample_rate') or 0) <= sample_rate):
+        return 'copy'
+
+    # 低码率的有损文件：转成目标码率不会更小，只会更差
+    if not lossless and at_or_below_target:
+        return 'skip'
+
+    return 'encode'
+
+def plan_compress_action(input_file, bitrate='128k', sample_rate=44100):
+    """探测输入并决定默认MP3输出的处理方式，返回 (动作, 探测结果)"""
+    info = probe_audio(input_file)
+    return decide_compress_action(info, 'libmp3lame', bitrate, sample_rate), info
+
+def copy_audio(input_file, output_file):
+    """直接复制已达标的音频文件，返回与压缩函数相同结构的统计"""
+    start_time = time.time()
+    shutil.copyfile(input_file, output_file)
+    elapsed = time.time() - start_time
+
+    input_size = input_file.stat().st_size
+    return {
+        'input_size': input_size,
+        'output_size': input_size,
+        'compression_ratio': 0,
+        'processing_time': elapsed,
+        'speed': input_size / (1024 * 1024) / elapsed if elapsed > 0 else 0
+    }
+
+def build_ffmpeg_command(input_file, output_file, bitrate='128k', sample_rate=44100, threads=0):
+    """构建超快速压缩的ffmpeg命令"""
+    return [
         'ffmpeg',
         '-y',  # 覆盖输出文件
         '-loglevel', 'error',  # 只显示错误信息
@@ -50,13 +177,64 @@ def compress_audio_ultra_fast(input_file, output_file, bitrate='128k', sample_ra
         '-c:a', 'libmp3lame',  # 使用LAME MP3编码器
         '-b:a', bitrate,
         '-ar', str(sample_rate),
-        '-threads', '0',  # 使用所有可用线程
+        '-threads', str(threads),  # 由核心预算决定，0 表示交给ffmpeg自行决定
         '-preset', 'ultrafast',  # 最快编码预设
         '-q:a', '4',  # 快速质量设置
         '-compression_level', '1',  # 最低压缩级别 = 最快速度
         '-frame_size', '1152',  # 优化帧大小
         str(output_file)
     ]
+
+def compression_stats(input_file, output_file, elapsed, audio_seconds=None):
+    """计算压缩统计信息；给出音频时长时同时计算实时倍率（音频秒数 / 墙钟秒数）"""
+    input_size = input_file.stat().st_size
+    output_size = output_file.stat().st_size
+    compression_ratio = (1 - output_size / input_size) * 100 if input_size > 0 else 0
+    
+    return {
+        'input_size': input_size,
+        'output_size': output_size,
+        'compression_ratio': compression_ratio,
+        'processing_time': elapsed,
+        'speed': input_size / (1024 * 1024) / elapsed if elapsed > 0 else 0,
+        'audio_seconds': audio_seconds,
+        'realtime_factor': audio_seconds / elapsed if audio_seconds and elapsed > 0 else None
+    }
+
+def build_multi_output_command(input_file, renditions, threads=0, analyze=False):
+    """构建一次解码、多路输出的ffmpeg命令；renditions 为 [(配置名, 输出路径), ...]
+
+    analyze 为True时用 asplit 多分出一路送给 ebur128 做响度分析，摘要输出在日志中
+    """
+    command = [
+        'ffmpeg',
+        '-y',  # 覆盖输出文件
+        *(ANALYSIS_LOG_ARGS if analyze else ['-loglevel', 'error']),  # 只显示错误信息（分析时需要info级别的摘要）
+        '-i', str(input_file),
+    ]
+    sources = ['0:a'] * len(renditions)
+    if analyze:
+        sources = [f"[a{index}]" for index in range(len(renditions))]
+        command += ['-filter_complex',
+                    f"[0:a]asplit={len(renditions) + 1}{''.join(sources)}[analysis];[analysis]{ANALYSIS_FILTER}[measured]"]
+    for source, (profile_name, output_file) in zip(sources, renditions):
+        profile = OUTPUT_PROFILES[profile_name]
+        command += [
+            '-map', source,  # 每个输出都映射同一路解码后的音频
+            '-c:a', profile['codec'],
+            '-b:a', profile['bitrate'],
+            '-ar', str(profile['sample_rate']),
+            '-threads', str(threads),
+            *profile['extra_args'],
+            str(output_file)
+        ]
+    if analyze:
+        command += ['-map', '[measured]', '-f', 'null', '-']
+    return command
+
+def compress_audio_ultra_fast(input_file, output_file, bitrate='128k', sample_rate=44100, threads=0):
+    """超快速音频压缩函数 - 使用最激进的速度优化"""
+    command = build_ffmpeg_command(input_file, output_file, bitrate, sample_rate, threads)
     
     start_time = time.time()
     
@@ -72,54 +250,454 @@ def compress_audio_ultra_fast(input_file, output_file, bitrate='128k', sample_ra
     stdout, stderr = process.communicate()
     
     if process.returncode != 0:
-        raise subprocess.CalledProcessError(process.returncode, command, stderr)
+        raise subprocess.CalledProcessError(process.returncode, command, stdout, stderr)
     
-    elapsed = time.time() - start_time
+    return compression_stats(input_file, output_file, time.time() - start_time)
+
+def compress_with_probe(input_file, output_file, bitrate='128k', sample_rate=44100, threads=0):
+    """先探测再处理，返回 (动作, 统计)；跳过时统计为None"""
+    action, info = plan_compress_action(input_file, bitrate, sample_rate)
+
+    if action == 'skip':
+        return action, None
+    if action == 'copy':
+        return action, copy_audio(input_file, output_file)
+
+    result = compress_audio_ultra_fast(input_file, output_file, bitrate, sample_rate, threads)
+
+    # 重新编码后反而没有变小的MP3输入，改为保留原文件
+    if info and info.get('codec') == 'mp3' and result['output_size'] >= result['input_size']:
+        return 'copy', copy_audio(input_file, output_file)
+
+    return action, result
+
+async def run_ffmpeg_async(command, output_files, cpu_set=None, on_progress=None, on_stderr=None):
+    """asyncio方式运行一条ffmpeg命令：父进程直接启动并等待，返回耗时
+
+    给出 on_progress 时加上 -progress pipe:1，每个进度块回调一次；
+    给出 on_stderr 时，成功结束后把ffmpeg的日志文本交给它（用于解析分析滤镜的输出）。
+    """
+    if on_progress is not None:
+        command = command[:1] + progress_args() + command[1:]
+    if cpu_set and shutil.which('taskset'):
+        # 用taskset绑核，在exec之前设置亲和性，ffmpeg创建的所有线程都会继承
+        command = ['taskset', '-c', ','.join(str(cpu) for cpu in sorted(cpu_set))] + command
     
-    # 获取文件大小信息
-    input_size = input_file.stat().st_size
-    output_size = output_file.stat().st_size
-    compression_ratio = (1 - output_size / input_size) * 100 if input_size > 0 else 0
+    start_time = time.time()
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE if on_progress is not None else asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE
+    )
     
-    return {
-        'input_size': input_size,
-        'output_size': output_size,
-        'compression_ratio': compression_ratio,
-        'processing_time': elapsed,
-        'speed': input_size / (1024 * 1024) / elapsed if elapsed > 0 else 0
-    }
+    try:
+        if on_progress is not None:
+            _, stderr, _ = await asyncio.gather(
+                read_progress(process.stdout, on_progress),
+                process.stderr.read(),
+                process.wait()
+            )
+        else:
+            _, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        # 被取消时杀掉ffmpeg并删除写了一半的输出
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        for output_file in output_files:
+            output_file.unlink(missing_ok=True)
+        raise
+    
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command, None, stderr.decode('utf-8', errors='replace'))
+    if on_stderr is not None:
+        on_stderr(stderr.decode('utf-8', errors='replace'))
+    
+    return time.time() - start_time
+
+class EncodeSlots:
+    """并发槽位：限制同时运行的ffmpeg数量，并为每个槽位分配绑核集合
 
-def process_single_file_ultra(args):
-    """单文件处理函数，用于多进程 - 超快速版本"""
-    input_file, output_file, bitrate, sample_rate = args
+    槽位不够时按权重分配：权重（音频时长）越大越先拿到槽位，即最长处理时间优先，
+    避免长文件最后才开始、独自拖慢整批；权重相同时先到先得。
+    """
     
+    def __init__(self, max_concurrency, cpu_sets=None):
+        self.max_concurrency = max_concurrency
+        self._free_slots = max_concurrency
+        self._waiters = []
+        self._order = itertools.count()
+        self._free_cpu_sets = list(cpu_sets or [])
+    
+    async def _take(self, weight):
+        if self._free_slots > 0 and not self._waiters:
+            self._free_slots -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (-weight, next(self._order), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # 槽位已经转交过来但任务被取消了，把槽位还回去
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+    
+    def _release(self):
+        # 直接把槽位转交给权重最大的等待者
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._free_slots += 1
+    
+    @contextlib.asynccontextmanager
+    async def acquire(self, weight=0):
+        """占用一个槽位，返回该槽位的核心集合（未绑核时为None）"""
+        await self._take(weight)
+        cpu_set = self._free_cpu_sets.pop() if self._free_cpu_sets else None
+        try:
+            yield cpu_set
+        finally:
+            if cpu_set is not None:
+                self._free_cpu_sets.append(cpu_set)
+            self._release()
+
+def _crc16(data, crc=0):
+    """LAME标签使用的CRC-16 (多项式0x8005，反射)"""
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return crc
+
+def _find_lame_tag(frame):
+    """定位Info帧中的Xing头和紧随其后的LAME扩展，返回 (Xing偏移, LAME偏移)"""
+    xing_offset = max(frame.find(b'Info', 0, 64), frame.find(b'Xing', 0, 64))
+    if xing_offset < 0:
+        return None, None
+    flags = int.from_bytes(frame[xing_offset + 4:xing_offset + 8], 'big')
+    lame_offset = xing_offset + 8
+    lame_offset += 4 if flags & 0x01 else 0
+    lame_offset += 4 if flags & 0x02 else 0
+    lame_offset += 100 if flags & 0x04 else 0
+    lame_offset += 4 if flags & 0x08 else 0
+    return xing_offset, lame_offset
+
+def _read_lame_padding(frame):
+    """读取LAME扩展中记录的结尾填充采样数"""
+    _, lame_offset = _find_lame_tag(frame)
+    if lame_offset is None or lame_offset + 36 > len(frame):
+        return None
+    return ((frame[lame_offset + 22] & 0x0F) << 8) | frame[lame_offset + 23]
+
+def _patch_info_frame(frame, frame_positions, total_bytes, padding):
+    """按拼接后的整条音频回填Info帧：帧数、字节数、TOC、结尾填充和标签CRC
+
+    整段音频的CRC需要逐字节计算，对几百MB的长音轨代价太高，这里置零（解码器并不校验它）。
+    """
+    xing_offset, lame_offset = _find_lame_tag(frame)
+    if xing_offset is None:
+        return
+    flags = int.from_bytes(frame[xing_offset + 4:xing_offset + 8], 'big')
+    frame_count = len(frame_positions)
+    position = xing_offset + 8
+    if flags & 0x01:
+        frame[position:position + 4] = frame_count.to_bytes(4, 'big')
+        position += 4
+    if flags & 0x02:
+        frame[position:position + 4] = total_bytes.to_bytes(4, 'big')
+        position += 4
+    if flags & 0x04:
+        for i in range(100):
+            seek_point = frame_positions[i * frame_count // 100] if frame_count else 0
+            frame[position + i] = min(255, seek_point * 256 // total_bytes)
+        position += 100
+    
+    if lame_offset + 36 > len(frame):
+        return
+    if padding is not None:
+        frame[lame_offset + 22] = (frame[lame_offset + 22] & 0xF0) | ((padding >> 8) & 0x0F)
+        frame[lame_offset + 23] = padding & 0xFF
+    frame[lame_offset + 28:lame_offset + 32] = total_bytes.to_bytes(4, 'big')
+    frame[lame_offset + 32:lame_offset + 34] = bytes(2)
+    frame[lame_offset + 34:lame_offset + 36] = _crc16(frame[:lame_offset + 34]).to_bytes(2, 'big')
+
+def plan_segments(duration, sample_rate, segment_seconds):
+    """按MP3帧边界切分时间段，返回 [(起始帧, 帧数), ...]"""
+    total_frames = math.ceil(duration * sample_rate / MP3_FRAME_SAMPLES)
+    frames_per_segment = max(1, round(segment_seconds * sample_rate / MP3_FRAME_SAMPLES))
+    segments = [
+        [first, min(frames_per_segment, total_frames - first)]
+        for first in range(0, total_frames, frames_per_segment)
+    ]
+    # 过短的尾段并入前一段：贴近文件结尾的seek不可靠，而且不值得单独启动一个ffmpeg
+    if len(segments) > 1 and segments[-1][1] < frames_per_segment // 2:
+        segments[-2][1] += segments.pop()[1]
+    return [tuple(segment) for segment in segments]
+
+async def encode_mp3_segmented(input_file, output_file, profile_name, duration, slots, threads=0, job=None):
+    """分段并行编码一个长音轨并无缝拼接
+
+    每个分段从帧对齐的采样位置开始，前后各多编码 SEGMENT_OVERLAP_FRAMES 帧；
+    因为编码器延迟在整段编码和分段编码中完全相同，对齐后只需丢弃重叠帧即可。
+    分段编码关闭比特池 (-reservoir 0)，保证每一帧都能独立解码，帧级拼接不会出错；
+    最后按整条音频回填首段的Info帧，播放器据此去掉编码器延迟和结尾填充，实现无缝播放。
+    """
+    profile = OUTPUT_PROFILES[profile_name]
+    sample_rate = profile['sample_rate']
+    segment_seconds = max(SEGMENT_MIN_SECONDS, duration / slots.max_concurrency)
+    segments = plan_segments(duration, sample_rate, segment_seconds)
+    last_index = len(segments) - 1
+    
+    temp_dir = pathlib.Path(tempfile.mkdtemp(prefix='.segments_', dir=output_file.parent))
+    
+    async def encode_segment(index, first_frame, frame_count):
+        pre_roll = min(SEGMENT_OVERLAP_FRAMES, first_frame)
+        start_sample = (first_frame - pre_roll) * MP3_FRAME_SAMPLES
+        segment_path = temp_dir / f"{index:05d}.mp3"
+        command = [
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-ss', f"{start_sample / sample_rate:.6f}",
+            '-i', str(input_file),
+        ]
+        if index != last_index:
+            total_frames = pre_roll + frame_count + SEGMENT_OVERLAP_FRAMES
+            command += ['-t', f"{total_frames * MP3_FRAME_SAMPLES / sample_rate:.6f}"]
+        command += [
+            '-map', '0:a',
+            '-c:a', profile['codec'],
+            '-b:a', profile['bitrate'],
+            '-ar', str(sample_rate),
+            '-threads', str(threads),
+            *profile['extra_args'],
+            '-reservoir', '0',  # 关闭比特池，帧之间没有依赖
+            # 首段和尾段保留Info头：首段的用作拼接后的模板，尾段的提供结尾填充长度
+            '-write_xing', '1' if index in (0, last_index) else '0',
+            '-id3v2_version', '0',
+            '-f', 'mp3',
+            str(segment_path)
+        ]
+        # 按分段自身的时长参与最长优先调度
+        async with slots.acquire(weight=frame_count * MP3_FRAME_SAMPLES / sample_rate) as cpu_set:
+            with track_part(job, (output_file, index)) as on_progress:
+                await run_ffmpeg_async(command, [segment_path], cpu_set, on_progress)
+        return segment_path, pre_roll, frame_count
+    
+    start_time = time.time()
     try:
-        result = compress_audio_ultra_fast(input_file, output_file, bitrate, sample_rate)
+        encoded = await asyncio.gather(*(
+            encode_segment(index, first_frame, frame_count)
+            for index, (first_frame, frame_count) in enumerate(segments)
+        ))
+        
+        info_frame = None
+        padding = None
+        frame_positions = []
+        with open(output_file, 'wb') as output:
+            for index, (segment_path, pre_roll, frame_count) in enumerate(encoded):
+                data = segment_path.read_bytes()
+                frames = list(iter_mp3_frames(data))
+                if index in (0, last_index):
+                    offset, length = frames.pop(0)
+                    if index == 0:
+                        info_frame = bytearray(data[offset:offset + length])
+                        # 先占位，全部音频帧写完后再回填
+                        output.write(bytes(length))
+                    if index == last_index:
+                        padding = _read_lame_padding(data[offset:offset + length])
+                # 丢弃前置重叠帧；最后一段保留到结尾（包含编码器的尾部填充）
+                if index == last_index:
+                    keep = frames[pre_roll:]
+                else:
+                    keep = frames[pre_roll:pre_roll + frame_count]
+                    if len(keep) < frame_count:
+                        raise RuntimeError(f"分段 {index} 只编码出 {len(keep)} 帧，预期 {frame_count} 帧")
+                for offset, length in keep:
+                    frame_positions.append(output.tell())
+                    output.write(data[offset:offset + length])
+            
+            if info_frame is not None:
+                _patch_info_frame(info_frame, frame_positions, output.tell(), padding)
+                output.seek(0)
+                output.write(info_frame)
+    except BaseException:
+        output_file.unlink(missing_ok=True)
+        raise
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    
+    return compression_stats(input_file, output_file, time.time() - start_time, duration)
+
+async def compress_renditions_async(input_file, renditions, slots, threads=0, segment_over=None, cache=None,
+                                    board=None, loudness=False, results=None):
+    """为一个输入产出多个版本：先逐个决定动作，需要编码的版本合并到同一个ffmpeg进程中
+
+    时长超过 segment_over 秒的输入，MP3版本改为分段并行编码。
+    启用缓存时，命中的版本直接从缓存硬链接，不启动ffmpeg。
+    给出 board 时，所有ffmpeg进程的进度汇总到该文件的进度行。
+    loudness 为True时在编码的同一个ffmpeg进程里测量响度，给编码出的版本写入增益标签，
+    测量值放在各版本结果的 'loudness' 中。
+    results 为列表时完成的版本逐个追加进去：某个ffmpeg进程失败抛出异常时，调用方仍能拿到已经写好的版本。
+    """
+    info = await asyncio.to_thread(probe_audio, input_file)
+    duration = (info or {}).get('duration') or 0
+    fingerprint = await asyncio.to_thread(cache.fingerprint, input_file) if cache else None
+    
+    results = [] if results is None else results
+    to_encode = []
+    to_segment = []
+    cache_keys = {}
+    for profile_name, output_file in renditions:
+        profile = OUTPUT_PROFILES[profile_name]
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        action = decide_compress_action(info, profile['codec'], profile['bitrate'], profile['sample_rate'])
+        segmented = bool(segment_over and duration > segment_over and profile['codec'] == 'libmp3lame')
         
-        # 线程安全地写入已处理文件列表
-        with file_lock:
-            with open('compressed.txt', 'a', encoding='utf-8') as f:
-                f.write(input_file.stem + '\n')
+        if action == 'encode' and cache:
+            # 分段编码关闭了比特池，产物与整段编码不同，需要区分缓存键
+            params = {'profile': profile, 'mode': 'segmented' if segmented else 'whole'}
+            if loudness:
+                # 写了增益标签的产物与不带标签的不同
+                params['replaygain'] = True
+            key = cache.key(fingerprint, params)
+            cached_path = cache.lookup(key, profile['extension'])
+            if cached_path:
+                start_time = time.time()
+                await asyncio.to_thread(cache.materialize, cached_path, output_file)
+                stats = compression_stats(input_file, output_file, time.time() - start_time)
+                results.append({'profile': profile_name, 'output_file': output_file, 'action': 'cached', 'stats': stats})
+                continue
+            cache_keys[profile_name] = key
         
+        if action != 'skip':
+            # 输出可能是缓存对象的硬链接，先断开再写，避免原地覆盖污染缓存
+            output_file.unlink(missing_ok=True)
+        if action == 'encode':
+            if segmented:
+                to_segment.append((profile_name, output_file))
+            else:
+                to_encode.append((profile_name, output_file))
+        elif action == 'copy':
+            stats = await asyncio.to_thread(copy_audio, input_file, output_file)
+            results.append({'profile': profile_name, 'output_file': output_file, 'action': 'copy', 'stats': stats})
+        else:
+            results.append({'profile': profile_name, 'output_file': output_file, 'action': 'skip', 'stats': None})
+    
+    # 合并编码算一遍音频，每个分段编码的版本各算一遍
+    passes = (1 if to_encode else 0) + len(to_segment)
+    job = board.start(input_file.name, duration * passes) if board and passes else None
+    
+    measured = {}
+    
+    def on_analysis(log_text):
+        measured['loudness'] = parse_ebur128(log_text)
+    
+    async def encode_together():
+        if not to_encode:
+            return []
+        command = build_multi_output_command(input_file, to_encode, threads, analyze=loudness)
+        async with slots.acquire(weight=duration) as cpu_set:
+            with track_part(job, 'together') as on_progress:
+                elapsed = await run_ffmpeg_async(command, [output_file for _, output_file in to_encode], cpu_set, on_progress,
+                                                 on_analysis if loudness else None)
+        audio_seconds = duration or (job.parts.get('together') if job else None)
+        return [(profile_name, output_file, compression_stats(input_file, output_file, elapsed, audio_seconds))
+                for profile_name, output_file in to_encode]
+    
+    async def encode_segmented(profile_name, output_file):
+        stats = await encode_mp3_segmented(input_file, output_file, profile_name, duration, slots, threads, job)
+        return [(profile_name, output_file, stats)]
+    
+    async def analyze_alone():
+        # 只有分段编码时没有整段解码的进程可以搭车，单独解码一遍做分析
+        async with slots.acquire(weight=duration) as cpu_set:
+            await run_ffmpeg_async(analysis_command(input_file), [], cpu_set, on_stderr=on_analysis)
+        return []
+    
+    try:
+        # 一个ffmpeg进程失败时其他进程照常完成，成功的版本先登记，最后再报告错误
+        encoded = await asyncio.gather(
+            encode_together(),
+            *(encode_segmented(profile_name, output_file) for profile_name, output_file in to_segment),
+            *([analyze_alone()] if loudness and to_segment and not to_encode else []),
+            return_exceptions=True
+        )
+    finally:
+        if job is not None:
+            board.finish(job)
+    errors = [group for group in encoded if isinstance(group, BaseException)]
+    
+    for profile_name, output_file, stats in (item for group in encoded if not isinstance(group, BaseException)
+                                             for item in group):
+        action = 'segmented' if (profile_name, output_file) in to_segment else 'encode'
+        # 重新编码后反而没有变小的MP3输入，改为保留原文件
+        if (info and info.get('codec') == 'mp3' and OUTPUT_PROFILES[profile_name]['codec'] == 'libmp3lame'
+                and stats['output_size'] >= stats['input_size']):
+            stats = await asyncio.to_thread(copy_audio, input_file, output_file)
+            action = 'copy'
+        else:
+            if measured.get('loudness'):
+                # 标签在存入缓存之前写好，缓存命中的产物同样带有增益
+                await asyncio.to_thread(write_loudness_tags, output_file, measured['loudness'])
+                stats = compression_stats(input_file, output_file, stats['processing_time'], stats['audio_seconds'])
+            if profile_name in cache_keys:
+                await asyncio.to_thread(cache.store, cache_keys[profile_name], OUTPUT_PROFILES[profile_name]['extension'], output_file)
+        results.append({'profile': profile_name, 'output_file': output_file, 'action': action, 'stats': stats,
+                        'loudness': measured.get('loudness')})
+    
+    if errors:
+        raise errors[0]
+    return results
+
+async def process_single_file_async(job, slots, segment_over=None, cache=None, board=None, loudness=False):
+    """单文件处理协程 - 只返回结果，记录文件由父进程统一写入"""
+    input_file, renditions, threads = job
+    # 失败时也带上已经完成的版本（复制、缓存命中、成功的分段编码），由父进程照常记录和发送
+    results = []
+    
+    try:
+        await compress_renditions_async(input_file, renditions, slots, threads, segment_over, cache, board,
+                                        loudness, results)
         return {
             'success': True,
             'input_file': input_file,
-            'output_file': output_file,
-            'stats': result
+            'renditions': results
         }
     except subprocess.CalledProcessError as e:
         return {
             'success': False,
             'input_file': input_file,
+            'renditions': results,
             'error': f"FFmpeg错误: {e.stderr if hasattr(e, 'stderr') else str(e)}"
         }
     except Exception as e:
         return {
             'success': False,
             'input_file': input_file,
+            'renditions': results,
             'error': str(e)
         }
 
+async def run_compress_jobs(jobs, max_concurrency, on_result, cpu_sets=None, segment_over=None, cache=None,
+                            board=None, loudness=False):
+    """asyncio任务调度器：槽位控制ffmpeg并发（分段编码的每一段各占一个槽位），结果回调在父进程中执行"""
+    slots = EncodeSlots(max_concurrency, cpu_sets)
+    
+    async def run_one(job):
+        on_result(await process_single_file_async(job, slots, segment_over, cache, board, loudness))
+    
+    watcher = asyncio.create_task(board.watch()) if board else None
+    try:
+        # 任务按顺序从 jobs 中取出，在途的协程数有上限；窗口比槽位多，分段编码的文件也能把槽位填满
+        await gather_bounded(run_one, jobs, max_concurrency * WINDOW_PER_WORKER)
+    finally:
+        if watcher:
+            watcher.cancel()
+            board.refresh()
+
 def detect_audio_files():
     """智能检测音频文件"""
     supported_formats = ['.flac', '.mp3', '.wav', '.m4a', '.aac', '.ogg', '.wma']
@@ -137,66 +715,163 @@ def detect_audio_files():
     
     return audio_files
 
-def main_compress_ultra():
-    """主压缩函数 - 超快速版本"""
+def iter_compress_jobs(decrypted_dir, compressed_dir, profiles, layout, compressed, use_cache, previous_sizes):
+    """惰性产出 (输入文件, [(配置, 输出文件), ...])，只包含还缺少的版本
+
+    已存在的输出文件大小记入 previous_sizes，用于增量更新统计索引
+    """
+    for input_file in iter_library_files(decrypted_dir):
+        if input_file.suffix.lower() in SUPPORTED_FORMATS:
+            # 每个版本单独记录，新增配置时只会编码缺少的版本；
+            # 启用缓存时不看记录，由缓存键判断参数是否变化
+            renditions = [
+                (profile_name, profile_output_path(compressed_dir, input_file.stem, profile_name, layout))
+                for profile_name in profiles
+                if use_cache or profile_record_key(input_file.stem, profile_name) not in compressed
+            ]
+            if renditions:
+                for _, output_file in renditions:
+                    if output_file.exists():
+                        previous_sizes[output_file] = output_file.stat().st_size
+                yield input_file, renditions
+
+def main_compress_ultra(max_jobs=None, threads=None, pin_cpus=False, profiles=None, segment_over=SEGMENT_OVER_SECONDS,
+                        cache_dir=None, out=None, loudness=False, headless=False, result_log=DEFAULT_RESULT_LOG):
+    """主压缩函数 - 超快速版本
+
+    out 为 '-' 或tar文件路径时，压缩结果串成tar流输出：ffmpeg先写到临时目录，完成一个送出并删除一个，
+    不写 03_compressed，也不读写 compressed.txt；
+    loudness 为True时编码的同时测量响度并写入增益标签，测量值记录到 loudness.jsonl（tar流模式只写标签）；
+    headless 为True时边扫描边编码（不做最长优先排序），不显示进度条和结果表，逐版本结果追加到 result_log
+    """
+    if out == '-':
+        # stdout 留给tar流，界面输出改到stderr
+        console.file = sys.stderr
+    profiles = profiles or [DEFAULT_PROFILE]
+    unknown = [name for name in profiles if name not in OUTPUT_PROFILES]
+    if unknown:
+        console.print(f"❌ 未知的输出配置: {', '.join(unknown)}", style="red")
+        console.print(f"💡 可用配置: {', '.join(OUTPUT_PROFILES)}", style="yellow")
+        return
+
     console.print(Panel.fit("🚀 超级快速音频压缩器", style="bold red"))
-    console.print("🔥 终极优化：最多8进程并行 + FFmpeg超快预设 + 内存优化")
+    console.print("🔥 终极优化：asyncio直接调度ffmpeg + 核心预算 + FFmpeg超快预设")
     console.print("📁 使用规范化目录结构：02_decrypted -> 03_compressed")
     console.print("📝 使用独立的 compressed.txt 记录文件")
     console.print("💡 [bold yellow]WARNING: 追求极致速度，音质可能略有损失[/bold yellow]\n")
     
+    sink = open_sink(out)
+    
     # 确保目录结构存在
     decrypted_dir = pathlib.Path("02_decrypted")
-    compressed_dir = pathlib.Path("03_compressed")
     decrypted_dir.mkdir(exist_ok=True)
-    compressed_dir.mkdir(exist_ok=True)
+    if sink is None:
+        compressed_dir = pathlib.Path("03_compressed")
+        compressed_dir.mkdir(exist_ok=True)
+        layout = load_layout()
+    else:
+        # ffmpeg 需要可寻址的输出文件（写MP3头信息），先写到临时目录，写进流后立即删除；
+        # 流中的条目保持平铺，由接收方决定怎么放
+        compressed_dir = pathlib.Path(tempfile.mkdtemp(prefix='.out_spool_', dir='.'))
+        layout = LibraryLayout()
     
     # 读取已压缩的文件列表
     try:
         with open('compressed.txt', 'r', encoding='utf-8') as f:
-            compressed = set(f.read().strip().split('\n'))
+            compressed = set(f.read().strip().split('\n')) if sink is None else set()
     except FileNotFoundError:
         compressed = set()
     
-    # 查找需要压缩的文件（从02_decrypted目录）
-    supported_formats = ['.flac', '.mp3', '.wav', '.m4a', '.aac', '.ogg']
-    files_to_process = []
+    cache = EncodeCache(cache_dir) if cache_dir else None
+    loudness_store = LoudnessStore() if loudness and sink is None else None
     
-    for input_file in decrypted_dir.glob('*.*'):
-        if input_file.suffix.lower() in supported_formats:
-            if input_file.stem not in compressed:
-                output_file = compressed_dir / f"{input_file.stem}.mp3"
-                files_to_process.append((input_file, output_file, '128k', 44100))
+    # 查找需要压缩的文件（从02_decrypted目录）；无界面模式下边扫描边编码，不先列出全部文件
+    # 已存在的输出文件大小，用于增量更新统计索引；结果处理完即删除
+    previous_sizes = {}
+    stats_index = StatsIndex()
+    files_to_process = iter_compress_jobs(decrypted_dir, compressed_dir, profiles, layout, compressed, bool(cache),
+                                          previous_sizes)
+    if headless:
+        first = next(files_to_process, None)
+        if first is not None:
+            files_to_process = itertools.chain([first], files_to_process)
+        has_jobs = first is not None
+    else:
+        files_to_process = list(files_to_process)
+        has_jobs = bool(files_to_process)
     
-    if not files_to_process:
+    if not has_jobs:
         console.print("❌ 在 02_decrypted/ 目录中没有找到需要压缩的音频文件", style="red")
         console.print("💡 提示：请先解密NCM文件到 02_decrypted/ 目录", style="yellow")
+        if sink is not None:
+            close_sink(sink)
+            shutil.rmtree(compressed_dir, ignore_errors=True)
         return
     
-    total_size = sum(f[0].stat().st_size for f in files_to_process)
-    # 超快速版本使用更多进程
-    max_workers = min(multiprocessing.cpu_count(), len(files_to_process), 8)
+    if headless:
+        # 十万级批次里尾部效应可以忽略，不为排序先探测全部文件的时长
+        total_jobs = None
+        job_count = available_cpu_count()
+        console.print("🌊 无界面模式：边扫描边编码，逐版本结果写入 "
+                      f"[bold cyan]{result_log}[/bold cyan]，终端只定时打印汇总")
+    else:
+        # 最长处理时间优先：长文件先开始，批次总耗时接近理论下限
+        schedule = longest_first((input_file for input_file, _ in files_to_process), ncm_dir="01_original")
+        rank = {input_file: position for position, (input_file, _) in enumerate(schedule)}
+        files_to_process.sort(key=lambda file_info: rank[file_info[0]])
+        total_audio = sum(duration or 0 for _, duration in schedule)
+        longest_audio = schedule[0][1] or 0
+        
+        total_size = sum(f[0].stat().st_size for f in files_to_process)
+        total_jobs = job_count = len(files_to_process)
+        console.print(f"📁 找到 [bold cyan]{total_jobs}[/bold cyan] 个文件需要压缩")
+        console.print(f"💾 总大小: [bold yellow]{total_size/(1024*1024):.1f} MB[/bold yellow]")
+        console.print(f"🎧 音频总时长: [bold yellow]{total_audio/60:.1f} 分钟[/bold yellow]  "
+                      f"最长: [bold yellow]{longest_audio/60:.1f} 分钟[/bold yellow] (最长优先调度)")
+    
+    # 按可用核心分配并发数与每任务线程数，避免 N 个 ffmpeg 各自吃满所有核心
+    if segment_over:
+        # 分段模式下即使只有一个长文件也能用满所有核心
+        job_count = max(job_count, available_cpu_count())
+    budget = plan_thread_budget(job_count, max_jobs=max_jobs, threads=threads)
+    max_workers = budget['jobs']
+    files_to_process = (file_info + (budget['threads'],) for file_info in files_to_process)
+    cpu_sets = budget['cpu_sets'] if pin_cpus and shutil.which('taskset') else None
     
-    console.print(f"📁 找到 [bold cyan]{len(files_to_process)}[/bold cyan] 个文件需要压缩")
-    console.print(f"💾 总大小: [bold yellow]{total_size/(1024*1024):.1f} MB[/bold yellow]")
-    console.print(f"🚀 使用 [bold red]{max_workers}[/bold red] 个并行进程 (超快速模式)")
-    console.print(f"📂 输出目录: [bold blue]03_compressed/[/bold blue]")
-    console.print(f"🎯 支持格式: [bold blue]{', '.join(supported_formats)}[/bold blue]\n")
+    console.print(f"🚀 最多 [bold red]{max_workers}[/bold red] 个ffmpeg并发 (超快速模式)")
+    console.print(f"🧮 可用核心: [bold cyan]{budget['cpus']}[/bold cyan]  每任务线程: [bold cyan]{budget['threads']}[/bold cyan]"
+                  f"{'  绑核: [bold green]开启[/bold green]' if cpu_sets else ''}")
+    console.print(f"📂 输出目录: [bold blue]{'03_compressed/' if sink is None else ('stdout (tar流)' if out == '-' else out + ' (tar流)')}[/bold blue]")
+    console.print(f"🎚️  输出配置: [bold blue]{', '.join(profiles)}[/bold blue]")
+    console.print(f"🎯 支持格式: [bold blue]{', '.join(SUPPORTED_FORMATS)}[/bold blue]\n")
     
     # 创建结果统计表
     results_table = Table(title="🎵 超快速压缩结果统计")
     results_table.add_column("文件名", style="cyan", width=20)
+    results_table.add_column("版本", style="magenta")
     results_table.add_column("原大小", justify="right", style="yellow")
     results_table.add_column("压缩后", justify="right", style="green")
     results_table.add_column("压缩率", justify="right", style="blue")
-    results_table.add_column("速度", justify="right", style="red")
+    results_table.add_column("实时倍率", justify="right", style="red")
     results_table.add_column("状态", justify="center")
+    results_table = CappedTable(results_table)
+    log = ResultLog(result_log) if headless else None
+    status = StatusLine(console) if headless else None
     
     # 并行处理文件
-    successful = 0
-    failed = 0
-    total_input_size = 0
-    total_output_size = 0
+    totals = {
+        'successful': 0,
+        'failed': 0,
+        'copied': 0,
+        'skipped': 0,
+        'cached': 0,
+        'input_size': 0,
+        'output_size': 0,
+        'measured': 0,
+    }
+    # 每个输入文件的 (格式, 输入大小, 耗时, 各版本输出总大小)，结束后写入吞吐量历史供容量规划使用；
+    # 历史只保留最近的记录，这里也只留这么多
+    throughput = collections.deque(maxlen=MAX_RECORDS)
     start_time = time.time()
     
     with Progress(
@@ -206,71 +881,169 @@ def main_compress_ultra():
         TaskProgressColumn(),
         TimeElapsedColumn(),
         console=console,
-        transient=False
+        transient=False,
+        disable=headless
     ) as progress:
         
-        main_task = progress.add_task("🚀 超快速压缩中", total=len(files_to_process))
+        main_task = progress.add_task("🚀 超快速压缩中", total=total_jobs)
+        # 每个正在编码的文件一行：按音频时长推进，显示实时倍率、剩余时间和停滞
+        board = ProgressBoard(progress)
+        # 写流可能被下游拖慢，放到单独的线程里按完成顺序逐个送出，不阻塞事件循环
+        sink_writer = ThreadPoolExecutor(max_workers=1) if sink is not None else None
+        ship_failures = []
+        
+        def ship(output_file):
+            try:
+                sink.write_path(output_file.relative_to(compressed_dir), output_file)
+            except Exception as e:
+                ship_failures.append((output_file.name, str(e)))
+            finally:
+                output_file.unlink(missing_ok=True)
         
-        with ProcessPoolExecutor(max_workers=max_workers) as executor:
-            # 提交所有任务
-            future_to_file = {
-                executor.submit(process_single_file_ultra, file_info): file_info[0].name 
-                for file_info in files_to_process
-            }
+        def handle_result(result):
+            """处理单个任务结果（在父进程的事件循环中执行）"""
+            display_name = result['input_file'].name[:18] + "..." if len(result['input_file'].name) > 20 else result['input_file'].name
             
-            # 处理完成的任务
-            for future in as_completed(future_to_file):
-                file_name = future_to_file[future]
-                try:
-                    result = future.result()
-                    if result['success']:
-                        successful += 1
-                        stats = result['stats']
-                        total_input_size += stats['input_size']
-                        total_output_size += stats['output_size']
-                        
-                        # 根据速度选择显示颜色
-                        speed_style = "bold red" if stats['speed'] > 30 else "red" if stats['speed'] > 20 else "yellow"
-                        
-                        # 添加到结果表
-                        results_table.add_row(
-                            result['input_file'].name[:18] + "..." if len(result['input_file'].name) > 20 else result['input_file'].name,
-                            f"{stats['input_size']/(1024*1024):.1f} MB",
-                            f"{stats['output_size']/(1024*1024):.1f} MB",
-                            f"{stats['compression_ratio']:.1f}%",
-                            f"[{speed_style}]{stats['speed']:.1f} MB/s[/{speed_style}]",
-                            "🚀 超快"
-                        )
-                    else:
-                        failed += 1
-                        results_table.add_row(
-                            result['input_file'].name[:18] + "..." if len(result['input_file'].name) > 20 else result['input_file'].name,
-                            "N/A",
-                            "N/A",
-                            "N/A",
-                            "N/A",
-                            "❌ 失败"
-                        )
-                except Exception as e:
-                    failed += 1
+            for rendition in result['renditions']:
+                if sink is not None:
+                    if rendition['action'] != 'skip' and rendition['stats']:
+                        sink_writer.submit(ship, rendition['output_file'])
+                else:
+                    # 只有父进程写记录文件，不存在多进程竞争；每个版本单独一行
+                    record_key = profile_record_key(result['input_file'].stem, rendition['profile'])
+                    if record_key not in compressed:
+                        compressed.add(record_key)
+                        with open('compressed.txt', 'a', encoding='utf-8') as f:
+                            f.write(record_key + '\n')
+                        stats_index.add_record('compressed')
+                    if rendition['stats']:
+                        stats_index.add_file('compressed', rendition['stats']['output_size'],
+                                             previous_sizes.get(rendition['output_file']))
+                previous_sizes.pop(rendition['output_file'], None)
+                
+                if rendition['action'] == 'skip':
+                    totals['skipped'] += 1
+                    if log is not None:
+                        log.write('skip', result['input_file'].name, rendition['profile'])
+                        continue
                     results_table.add_row(
-                        file_name[:18] + "..." if len(file_name) > 20 else file_name,
-                        "N/A",
+                        display_name,
+                        rendition['profile'],
+                        f"{result['input_file'].stat().st_size/(1024*1024):.1f} MB",
                         "N/A",
                         "N/A",
                         "N/A",
-                        "💥 异常"
+                        "⏭️ 跳过"
                     )
+                    continue
+                
+                totals['successful'] += 1
+                if rendition['action'] == 'copy':
+                    totals['copied'] += 1
+                elif rendition['action'] == 'cached':
+                    totals['cached'] += 1
+                stats = rendition['stats']
+                totals['input_size'] += stats['input_size']
+                totals['output_size'] += stats['output_size']
+                
+                if log is not None:
+                    log.write(rendition['action'], result['input_file'].name, rendition['profile'],
+                              stats['input_size'], stats['output_size'], f"{stats.get('realtime_factor') or 0:.1f}")
+                    continue
                 
-                progress.advance(main_task)
+                # 按实时倍率选择显示颜色；复制和缓存命中没有编码，不计倍率
+                realtime_factor = stats.get('realtime_factor') if rendition['action'] in ('encode', 'segmented') else None
+                if realtime_factor:
+                    speed_style = "bold red" if realtime_factor > 100 else "red" if realtime_factor > 50 else "yellow"
+                    speed_text = f"[{speed_style}]{realtime_factor:.1f}x[/{speed_style}]"
+                else:
+                    speed_text = "N/A"
+                
+                # 添加到结果表
+                results_table.add_row(
+                    display_name,
+                    rendition['profile'],
+                    f"{stats['input_size']/(1024*1024):.1f} MB",
+                    f"{stats['output_size']/(1024*1024):.1f} MB",
+                    f"{stats['compression_ratio']:.1f}%",
+                    speed_text,
+                    {'copy': "📋 复制", 'segmented': "🧩 分段", 'cached': "🗃️ 缓存"}.get(rendition['action'], "🚀 超快")
+                )
+            
+            # 各版本共用同一次测量，每个输入记录一条
+            measured = next((rendition['loudness'] for rendition in result['renditions'] if rendition.get('loudness')), None)
+            if measured:
+                totals['measured'] += 1
+                if loudness_store is not None:
+                    loudness_store.add(result['input_file'].stem, measured)
+            
+            # 多个版本由同一个ffmpeg进程一起编码，耗时取最长的一个，输出大小相加；复制和缓存命中不算编码
+            encoded = [rendition['stats'] for rendition in result['renditions']
+                       if rendition['action'] in ('encode', 'segmented') and rendition['stats']]
+            if encoded:
+                throughput.append((file_format(result['input_file']), encoded[0]['input_size'],
+                                   max(stats['processing_time'] for stats in encoded),
+                                   sum(stats['output_size'] for stats in encoded)))
+            
+            if not result['success']:
+                totals['failed'] += 1
+                if log is not None:
+                    log.write('failed', result['input_file'].name, result.get('error', ''))
+                else:
+                    results_table.add_row(
+                        display_name,
+                        "N/A",
+                        "N/A",
+                        "N/A",
+                        "N/A",
+                        "N/A",
+                        "❌ 失败"
+                    )
+            
+            progress.advance(main_task)
+            if status is not None:
+                status.update(f"✅ {totals['successful']}  ⏭️ {totals['skipped']}  ❌ {totals['failed']}  "
+                              f"🎧 {board.audio_seconds/60:.1f} 分钟")
+        
+        asyncio.run(run_compress_jobs(files_to_process, max_workers, handle_result, cpu_sets, segment_over, cache, board,
+                                      loudness))
+        
+        if sink is not None:
+            sink_writer.shutdown(wait=True)
+            close_sink(sink)
+            shutil.rmtree(compressed_dir, ignore_errors=True)
+            for name, error in ship_failures:
+                totals['failed'] += 1
+                if log is not None:
+                    log.write('failed', name, error)
+                    continue
+                results_table.add_row(name[:18] + "..." if len(name) > 20 else name, "N/A", "N/A", "N/A", "N/A", "N/A", "❌ 输出失败")
+    
+    if cache:
+        cache.save()
+    if log is not None:
+        log.close()
+    
+    successful = totals['successful']
+    failed = totals['failed']
+    copied = totals['copied']
+    skipped = totals['skipped']
+    cached = totals['cached']
+    total_input_size = totals['input_size']
+    total_output_size = totals['output_size']
     
     elapsed = time.time() - start_time
-    avg_speed = total_input_size / (1024 * 1024) / elapsed if elapsed > 0 else 0
+    record_run('compress', list(throughput), max_workers, elapsed)
+    # 整批吞吐量：每秒墙钟时间编码的音频秒数，用来估算编码容量
+    throughput = board.audio_seconds / elapsed if elapsed > 0 else 0
+    # 单任务平均实时倍率：反映单个ffmpeg进程的编码速度
+    job_realtime_factor = board.audio_seconds / board.encode_seconds if board.encode_seconds > 0 else 0
     total_compression_ratio = (1 - total_output_size / total_input_size) * 100 if total_input_size > 0 else 0
     
     # 显示结果表
     console.print("\n")
-    console.print(results_table)
+    if log is None:
+        results_table.render(console)
     
     # 显示总结信息
     summary_table = Table(show_header=False, box=None)
@@ -279,9 +1052,19 @@ def main_compress_ultra():
     
     summary_table.add_row("🎉 超快速压缩完成", "")
     summary_table.add_row("✅ 成功", f"[bold green]{successful}[/bold green] 个文件")
+    summary_table.add_row("📋 直接复制", f"[bold cyan]{copied}[/bold cyan] 个文件 (已达标MP3)")
+    summary_table.add_row("⏭️  跳过", f"[bold cyan]{skipped}[/bold cyan] 个文件 (低码率有损格式)")
+    if cache:
+        summary_table.add_row("🗃️  缓存命中", f"[bold cyan]{cached}[/bold cyan] 个文件")
+    if loudness:
+        summary_table.add_row("🔊 响度分析", f"[bold cyan]{totals['measured']}[/bold cyan] 个文件 (已写入增益标签)")
     summary_table.add_row("❌ 失败", f"[bold red]{failed}[/bold red] 个文件")
     summary_table.add_row("⏱️  总耗时", f"[bold yellow]{elapsed:.2f}[/bold yellow] 秒")
-    summary_table.add_row("🚀 平均速度", f"[bold red]{avg_speed:.1f}[/bold red] MB/s")
+    summary_table.add_row("🎧 编码音频", f"[bold magenta]{board.audio_seconds/60:.1f}[/bold magenta] 分钟")
+    summary_table.add_row("🚀 整体吞吐", f"[bold red]{throughput:.1f}x[/bold red] 实时 (音频秒 / 墙钟秒)")
+    summary_table.add_row("⚙️  单任务倍率", f"[bold red]{job_realtime_factor:.1f}x[/bold red] 实时")
+    if board.stalls:
+        summary_table.add_row("⚠️  停滞", f"[bold red]{board.stalls}[/bold red] 个文件: {', '.join(board.stalled_files)}")
     summary_table.add_row("💾 原始大小", f"[bold magenta]{total_input_size/(1024*1024):.1f}[/bold magenta] MB")
     summary_table.add_row("📦 压缩后大小", f"[bold blue]{total_output_size/(1024*1024):.1f}[/bold blue] MB")
     summary_table.add_row("📊 总压缩率", f"[bold red]{total_compression_ratio:.1f}%[/bold red]")
@@ -291,14 +1074,49 @@ def main_compress_ultra():
     if saved_space > 0:
         summary_table.add_row("💰 节省空间", f"[bold green]{saved_space/(1024*1024):.1f}[/bold green] MB")
     
-    if avg_speed > 50:
+    if throughput > 500:
         summary_table.add_row("🔥 速度评价", "[bold red]疯狂压缩！[/bold red]")
-    elif avg_speed > 30:
+    elif throughput > 200:
         summary_table.add_row("⚡ 速度评价", "[bold yellow]超快压缩！[/bold yellow]")
     else:
         summary_table.add_row("👍 速度评价", "[bold green]快速压缩！[/bold green]")
     
     console.print(Panel(summary_table, title="📊 超快速压缩统计", border_style="red"))
 
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="超级快速音频压缩器")
+    parser.add_argument('--max-jobs', type=int, default=None, help="最多并发ffmpeg任务数 (默认: 可用核心数)")
+    parser.add_argument('--threads', type=int, default=None, help="每个ffmpeg任务的线程数 (默认: 按核心预算自动分配)")
+    parser.add_argument('--pin', action='store_true', help="用taskset把每个并发槽位绑定到独立的核心集合")
+    parser.add_argument('--profiles', default=DEFAULT_PROFILE,
+                        help=f"逗号分隔的输出配置，一次解码同时产出 (可选: {', '.join(OUTPUT_PROFILES)})")
+    parser.add_argument('--segment-over', type=float, default=SEGMENT_OVER_SECONDS / 60,
+                        help="时长超过该分钟数的文件分段并行编码MP3，0 表示关闭 (默认: 20)")
+    parser.add_argument('--cache', action='store_true',
+                        help="启用按内容指纹 + 编码参数寻址的编码缓存 (用 encode_cache.py 管理和淘汰)")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help="编码缓存目录 (默认: .encode_cache)")
+    parser.add_argument('--loudness', action='store_true',
+                        help="编码的同时测量响度，写入 ReplayGain / R128 增益标签并记录到 loudness.jsonl")
+    parser.add_argument('--out', default=None,
+                        help="输出为tar流：'-' 写到stdout，或tar文件路径 (默认: 写入 03_compressed/)")
+    parser.add_argument('--headless', action='store_true',
+                        help="无界面模式：边扫描边编码，逐版本结果写入日志，终端只定时打印汇总（适合十万级批次）")
+    parser.add_argument('--result-log', default=DEFAULT_RESULT_LOG,
+                        help=f"无界面模式的结果日志 (默认: {DEFAULT_RESULT_LOG})")
+    return parser.parse_args()
+
 if __name__ == '__main__':
-    main_compress_ultra()
+    args = parse_args()
+    main_compress_ultra(
+        max_jobs=args.max_jobs,
+        threads=args.threads,
+        pin_cpus=args.pin,
+        profiles=[name.strip() for name in args.profiles.split(',') if name.strip()],
+        segment_over=args.segment_over * 60 or None,
+        cache_dir=args.cache_dir if args.cache else None,
+        out=args.out,
+        loudness=args.loudness,
+        headless=args.headless,
+        result_log=args.result_log,
+    )
@@ -0,0 +1,251 @@
+# This file is part of ncm_cracker.
+#
+# ncm_cracker is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ncm_cracker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ncm_cracker.  If not, see <https://www.gnu.org/licenses/>.
+"""
+🖼️ 封面去重存储
+解析NCM文件头时顺便取出内嵌封面，按内容哈希存储：
+1. 内容寻址 - 同一专辑的曲目封面相同，只存一份，占用随专辑数而不是曲目数增长
+2. 目录文件记录 "曲目名 -> 封面哈希"（追加写，多进程安全），前端按哈希取图，不必再读NCM
+3. 可选缩略图 - 封面入库时用ffmpeg按指定宽度生成，已入库的封面缺少某个尺寸时补建
+4. 可以只读文件头，为已有的NCM补建封面库
+
+用法：
+    python crack_ultra_fast.py --covers --thumb-sizes 300
+    python cover_store.py extract --thumb-sizes 300,600
+    python cover_store.py stats
+    python cover_store.py lookup 曲目名
+"""
+
+import argparse
+import hashlib
+import mmap
+import os
+import pathlib
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from rich.console import Console
+from rich.panel import Panel
+from rich.table import Table
+
+from crack_ultra_fast import read_ncm_header
+from library_layout import iter_library_files
+
+console = Console()
+
+DEFAULT_COVER_DIR = "covers"
+CATALOG_NAME = "catalog.txt"
+
+# 按文件头识别图片格式
+_IMAGE_MAGIC = [
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF8', 'gif'),
+]
+
+
+def image_extension(image):
+    for magic, extension in _IMAGE_MAGIC:
+        if image.startswith(magic):
+            return extension
+    if image[:4] == b'RIFF' and image[8:12] == b'WEBP':
+        return 'webp'
+    return 'bin'
+
+
+def cover_digest(image):
+    """封面内容哈希"""
+    return hashlib.blake2b(image, digest_size=20).hexdigest()
+
+
+def parse_sizes(text):
+    """把 '300,600' 转换为 (300, 600)"""
+    return tuple(int(size) for size in str(text or '').split(',') if size.strip())
+
+
+class CoverStore:
+    def __init__(self, root=DEFAULT_COVER_DIR, thumb_sizes=()):
+        self.root = pathlib.Path(root)
+        self.objects = self.root / "objects"
+        self.thumbs = self.root / "thumbs"
+        self.catalog_path = self.root / CATALOG_NAME
+        self.thumb_sizes = tuple(thumb_sizes)
+
+    def object_path(self, digest, extension):
+        """封面对象路径，按哈希前两位分目录"""
+        return self.objects / digest[:2] / f"{digest}.{extension}"
+
+    def thumbnail_path(self, digest, size):
+        return self.thumbs / str(size) / digest[:2] / f"{digest}.jpg"
+
+    def find(self, digest):
+        """按哈希查找封面对象"""
+        return next(iter((self.objects / digest[:2]).glob(f"{digest}.*")), None)
+
+    def put(self, image):
+        """存入一张封面，已存在时不再写对象，只补上缺少的缩略图；返回哈希"""
+        digest = cover_digest(image)
+        path = self.object_path(digest, image_extension(image))
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # 多个进程/线程可能同时存同一张新封面，各写各的临时文件再原子改名，内容相同谁覆盖谁都一样
+            fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix=f"{path.name}.", suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(image)
+            os.replace(temp_path, path)
+        # 之前入库时没有要求这个尺寸的封面，这次补建
+        for size in self.thumb_sizes:
+            self.make_thumbnail(path, digest, size)
+        return digest
+
+    def make_thumbnail(self, source, digest, size):
+        """用ffmpeg生成宽度不超过 size 的JPEG缩略图；ffmpeg不可用或失败时跳过"""
+        path = self.thumbnail_path(digest, size)
+        if path.exists():
+            return path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix=f"{digest}.", suffix='.tmp.jpg')
+        os.close(fd)
+        command = [
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-i', str(source),
+            '-vf', f"scale='min({size},iw)':-2",
+            '-frames:v', '1', '-q:v', '3',
+            str(temp_path),
+        ]
+        try:
+            subprocess.run(command, check=True, capture_output=True)
+            os.replace(temp_path, path)
+            return path
+        except (OSError, subprocess.CalledProcessError):
+            pathlib.Path(temp_path).unlink(missing_ok=True)
+            return None
+
+    def add_track(self, name, image):
+        """存入曲目封面并在目录文件中记录引用；没有封面时返回None"""
+        if not image:
+            return None
+        digest = self.put(bytes(image))
+        self.root.mkdir(parents=True, exist_ok=True)
+        # 一次write的短行在追加模式下不会与其他进程交错
+        with open(self.catalog_path, 'a', encoding='utf-8') as f:
+            f.write(f"{name}\t{digest}\n")
+        return digest
+
+    def catalog(self):
+        """曲目名 -> 封面哈希（同名多次记录时以最后一次为准）"""
+        result = {}
+        try:
+            with open(self.catalog_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    name, _, digest = line.rstrip('\n').rpartition('\t')
+                    if name and digest:
+                        result[name] = digest
+        except FileNotFoundError:
+            pass
+        return result
+
+    def cover_for(self, name):
+        """曲目的封面路径"""
+        digest = self.catalog().get(name)
+        return self.find(digest) if digest else None
+
+    def stats(self):
+        objects = [path for path in self.objects.glob('*/*') if not path.name.endswith('.tmp')]
+        return {
+            'tracks': len(self.catalog()),
+            'covers': len(objects),
+            'bytes': sum(path.stat().st_size for path in objects),
+            'thumbnails': sum(1 for path in self.thumbs.glob('*/*/*') if '.tmp' not in path.name),
+        }
+
+
+def read_cover(file_path):
+    """只读NCM文件头，取出内嵌封面"""
+    with open(file_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mmapped_file:
+            header = read_ncm_header(mmapped_file)
+            return mmapped_file[header['image_offset']:header['image_offset'] + header['image_size']]
+
+
+def extract_covers(store, ncm_dir='01_original', max_workers=8):
+    """为目录中已有的NCM补建封面库（不解密音频），返回 (曲目数, 无封面数, 失败数)"""
+    known = store.catalog()
+    files = [path for path in sorted(iter_library_files(ncm_dir, {'.ncm'})) if path.stem not in known]
+
+    def extract(path):
+        try:
+            return store.add_track(path.stem, read_cover(path)) is not None
+        except Exception:
+            return None
+
+    def backfill(digest):
+        source = store.find(digest)
+        if source is not None:
+            for size in store.thumb_sizes:
+                store.make_thumbnail(source, digest, size)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(extract, files))
+        # 已在目录中的曲目不再读NCM，但之前入库时没有要求的缩略图尺寸要补上
+        if store.thumb_sizes:
+            list(executor.map(backfill, set(known.values())))
+    return len(files), results.count(False), results.count(None)
+
+
+def show_stats(store):
+    stats = store.stats()
+    summary_table = Table(show_header=False, box=None)
+    summary_table.add_column("", style="bold")
+    summary_table.add_column("", style="")
+    summary_table.add_row("🎵 曲目", f"[bold cyan]{stats['tracks']}[/bold cyan] 首")
+    summary_table.add_row("🖼️  封面", f"[bold cyan]{stats['covers']}[/bold cyan] 张")
+    if stats['covers']:
+        summary_table.add_row("♻️  去重", f"[bold green]{stats['tracks'] / stats['covers']:.1f}[/bold green] 首/张")
+    summary_table.add_row("💾 总大小", f"[bold yellow]{stats['bytes']/(1024*1024):.1f}[/bold yellow] MB")
+    summary_table.add_row("🔍 缩略图", f"[bold blue]{stats['thumbnails']}[/bold blue] 张")
+    console.print(Panel(summary_table, title="🖼️ 封面库统计", border_style="cyan"))
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="封面去重存储")
+    parser.add_argument('--cover-dir', default=DEFAULT_COVER_DIR, help="封面库目录 (默认: covers)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    extract_parser = subparsers.add_parser('extract', help="只读文件头，为已有的NCM补建封面库")
+    extract_parser.add_argument('--dir', default='01_original', help="NCM文件目录 (默认: 01_original)")
+    extract_parser.add_argument('--thumb-sizes', default='', help="逗号分隔的缩略图宽度，如 300,600")
+    subparsers.add_parser('stats', help="显示封面库统计")
+    lookup_parser = subparsers.add_parser('lookup', help="查找曲目的封面文件")
+    lookup_parser.add_argument('name', help="曲目名（不含扩展名）")
+    args = parser.parse_args()
+
+    if args.command == 'extract':
+        store = CoverStore(args.cover_dir, parse_sizes(args.thumb_sizes))
+        total, missing, failed = extract_covers(store, args.dir)
+        console.print(f"🖼️ 处理 [bold cyan]{total}[/bold cyan] 首曲目，无封面 [bold yellow]{missing}[/bold yellow]，"
+                      f"失败 [bold red]{failed}[/bold red]")
+        show_stats(store)
+    elif args.command == 'stats':
+        show_stats(CoverStore(args.cover_dir))
+    elif args.command == 'lookup':
+        path = CoverStore(args.cover_dir).cover_for(args.name)
+        if path is None:
+            console.print(f"❌ 没有找到 {args.name} 的封面", style="red")
+        else:
+            console.print(str(path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# This file is part of ncm_cracker.
+#
+# ncm_cracker is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ncm_cracker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ncm_cracker.  If not, see <https://www.gnu.org/licenses/>.
+"""
+🧮 CPU 核心预算
+在并发ffmpeg任务数与每个任务的 -threads 之间分配可用核心，避免过度订阅：
+1. 识别真正可用的核心 - CPU亲和性 + cgroup 配额 (v1 / v2)
+2. 并发任务数 × 每任务线程数 ≤ 可用核心数
+3. 可选地为每个任务划分独立的核心集合用于绑核
+"""
+
+import math
+import os
+import pathlib
+
+# cgroup v2 / v1 的 CPU 配额文件
+_CGROUP_V2_CPU_MAX = pathlib.Path("/sys/fs/cgroup/cpu.max")
+_CGROUP_V1_DIRS = [pathlib.Path("/sys/fs/cgroup/cpu"), pathlib.Path("/sys/fs/cgroup/cpu,cpuacct")]
+
+
+def affinity_cpus():
+    """返回当前进程允许运行的CPU编号列表"""
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        # 非Linux平台没有 sched_getaffinity
+        return list(range(os.cpu_count() or 1))
+
+
+def cgroup_cpu_quota():
+    """读取cgroup的CPU配额（以核心数计），没有限制时返回None"""
+    try:
+        quota, period = _CGROUP_V2_CPU_MAX.read_text().split()[:2]
+        if quota != 'max' and int(period) > 0:
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+
+    for cgroup_dir in _CGROUP_V1_DIRS:
+        try:
+            quota = int((cgroup_dir / "cpu.cfs_quota_us").read_text())
+            period = int((cgroup_dir / "cpu.cfs_period_us").read_text())
+        except (OSError, ValueError):
+            continue
+        if quota > 0 and period > 0:
+            return quota / period
+    return None
+
+
+def available_cpu_count():
+    """真正可用的核心数：亲和性集合与cgroup配额取较小值"""
+    count = len(affinity_cpus())
+    quota = cgroup_cpu_quota()
+    if quota is not None:
+        count = min(count, max(1, math.ceil(quota)))
+    return max(1, count)
+
+
+def plan_thread_budget(job_count, max_jobs=None, threads=None):
+    """规划核心预算
+
+    返回 {'cpus': 可用核心数, 'jobs': 并发任务数, 'threads': 每任务线程数,
+          'cpu_sets': 每个并发槽位的核心集合}。
+    默认让每个任务单线程、并发数等于核心数——LAME本身基本是单线程的，
+    多开 -threads 只会带来上下文切换。
+    """
+    cpus = available_cpu_count()
+    job_count = max(1, job_count)
+
+    if threads:
+        threads = max(1, min(threads, cpus))
+        jobs = max(1, cpus // threads)
+    else:
+        jobs = cpus
+    if max_jobs:
+        jobs = min(jobs, max_jobs)
+    jobs = max(1, min(jobs, job_count))
+    if not threads:
+        # 任务数少于核心数时，把剩余核心分给每个任务
+        threads = max(1, cpus // jobs)
+
+    # 只有在亲和性集合足够切分时才提供绑核方案
+    cpu_list = affinity_cpus()
+    cpu_sets = []
+    if len(cpu_list) >= jobs * threads:
+        cpu_sets = [set(cpu_list[slot * threads:(slot + 1) * threads]) for slot in range(jobs)]
+
+    return {'cpus': cpus, 'jobs': jobs, 'threads': threads, 'cpu_sets': cpu_sets}
+
+
+def pin_current_process(cpu_set):
+    """把当前进程绑定到指定核心集合（不支持的平台上静默忽略）"""
+    if not cpu_set:
+        return
+    try:
+        os.sched_setaffinity(0, cpu_set)
+    except (AttributeError, OSError):
+        pass
@@ -18,6 +18,7 @@ from rich.progress import Progress, SpinnerColumn, TimeElapsedColumn, BarColumn,
 from rich.table import Table
 from rich.panel import Panel
 import multiprocessing
+import pathlib
 import binascii
 import struct
 import base64
@@ -27,6 +28,13 @@ import threading
 import time
 from Crypto.Cipher import AES
 
+from byte_progress import ByteCounters, ByteProgressSampler, attach, report_bytes
+from capacity_planner import file_format, record_run
+from library_layout import iter_library_files, load_layout
+from preflight import (PREFLIGHT_BYTES, REASONS, PreflightError, check_audio, check_audio_bounds, check_key,
+                       check_length, failure, failure_reason)
+from stats_index import StatsIndex
+
 console = Console()
 
 # 全局锁用于文件写入
@@ -44,7 +52,7 @@ def decrypt_chunk(chunk, key_box, start_offset):
     return decrypted
 
 def dump(file_path, name, progress_callback=None):
-    """优化的解密函数"""
+    """优化的解密函数；失败时返回 (None, 原因, 0)，原因为 {'reason', 'detail'}（见 preflight.py）"""
     core_key = binascii.a2b_hex("687A4852416D736F356B496E62617857")
     meta_key = binascii.a2b_hex("2331346C6A6B5F215C5D2630553C2728")
     unpad = lambda s: s[0:-(s[-1] if type(s[-1]) == int else ord(s[-1]))]
@@ -52,19 +60,25 @@ def dump(file_path, name, progress_callback=None):
     try:
         start_time = time.time()
         with open(file_path, 'rb') as f:
+            file_size = os.fstat(f.fileno()).st_size
             # 验证文件头
             header = f.read(8)
-            assert binascii.b2a_hex(header) == b'4354454e4644414d'
+            if binascii.b2a_hex(header) != b'4354454e4644414d':
+                raise PreflightError('not_ncm', f"magic is {header!r}")
             f.seek(2, 1)
             
-            # 读取并解密密钥
+            # 读取并解密密钥；长度字段先与文件大小核对
+            check_length('key length', f.tell(), 4, file_size)
             key_length = struct.unpack('<I', f.read(4))[0]
+            check_length('key', f.tell(), key_length, file_size)
+            if not key_length or key_length % 16:
+                raise PreflightError('bad_key', f"key length {key_length} is not a whole number of AES blocks")
             key_data = bytearray(f.read(key_length))
             for i in range(len(key_data)):
                 key_data[i] ^= 0x64
             
             cryptor = AES.new(core_key, AES.MODE_ECB)
-            key_data = unpad(cryptor.decrypt(key_data))[17:]
+            key_data = check_key(unpad(cryptor.decrypt(key_data)))
             
             # 生成密钥盒
             key_box = bytearray(range(256))
@@ -82,35 +96,51 @@ def dump(file_path, name, progress_callback=None):
                 last_byte = c
             
             # 读取元数据
+            check_length('meta length', f.tell(), 4, file_size)
             meta_length = struct.unpack('<I', f.read(4))[0]
+            check_length('meta', f.tell(), meta_length, file_size)
             meta_data = bytearray(f.read(meta_length))
             for i in range(len(meta_data)):
                 meta_data[i] ^= 0x63
             
-            meta_data = base64.b64decode(meta_data[22:])
-            cryptor = AES.new(meta_key, AES.MODE_ECB)
-            meta_data = json.loads(unpad(cryptor.decrypt(meta_data)).decode('utf-8')[6:])
+            try:
+                meta_data = base64.b64decode(meta_data[22:])
+                cryptor = AES.new(meta_key, AES.MODE_ECB)
+                meta_data = json.loads(unpad(cryptor.decrypt(meta_data)).decode('utf-8')[6:])
+            except (ValueError, IndexError) as e:
+                raise PreflightError('bad_meta', str(e)) from e
+            if not isinstance(meta_data, dict) or not meta_data.get('format'):
+                raise PreflightError('bad_meta', "metadata has no audio format")
             
             # 跳过CRC32和封面数据
             f.seek(4, 1)  # CRC32
             f.seek(5, 1)  # gap
+            check_length('image length', f.tell(), 4, file_size)
             image_size = struct.unpack('<I', f.read(4))[0]
             f.seek(image_size, 1)  # 跳过封面数据
             
             # 准备输出文件
             file_name = os.path.splitext(os.path.basename(file_path))[0] + '.' + meta_data['format']
-            output_path = os.path.join("02_decrypted", file_name)
+            output_path = str(load_layout().output_path("02_decrypted", file_name))
             
             # 获取音频数据大小
             audio_start = f.tell()
-            f.seek(0, 2)  # 移到文件末尾
-            total_size = f.tell() - audio_start
+            check_audio_bounds(audio_start, file_size)
+            total_size = file_size - audio_start
+            
+            # 预检：只解密音频开头几KB，确认密钥正确、格式与元数据一致，再开始写出
+            check_audio(decrypt_chunk(f.read(PREFLIGHT_BYTES), key_box, 0), meta_data['format'])
             f.seek(audio_start)  # 回到音频数据开始位置
             
+            # 覆盖旧文件时统计索引只更新字节数
+            previous_size = os.path.getsize(output_path) if os.path.exists(output_path) else None
+            
             # 使用更大的缓冲区进行解密
             BUFFER_SIZE = 0x40000  # 256KB 缓冲区
             
-            with open(output_path, 'wb') as output_file:
+            # 先写到 .part 临时文件，完成后再改名，中途被杀掉不会留下半截文件
+            part_path = output_path + '.part'
+            with open(part_path, 'wb') as output_file:
                 processed = 0
                 
                 while processed < total_size:
@@ -126,6 +156,8 @@ def dump(file_path, name, progress_callback=None):
                     # 回调进度更新
                     if progress_callback:
                         progress_callback(len(chunk))
+            
+            os.replace(part_path, output_path)
         
         elapsed = time.time() - start_time
         speed = total_size / (1024 * 1024) / elapsed if elapsed > 0 else 0
@@ -135,15 +167,19 @@ def dump(file_path, name, progress_callback=None):
             with open('cracked.txt', 'a', encoding='utf-8') as f:
                 f.write(name + '\n')
         
+        stats_index = StatsIndex()
+        stats_index.add_file('decrypted', total_size, previous_size)
+        stats_index.add_record('cracked')
+        
         return file_name, speed, total_size
         
     except Exception as e:
-        return None, 0, 0
+        return None, failure(e), 0
 
 def process_file_wrapper(args):
-    """多进程包装函数"""
+    """多进程包装函数；已处理字节数写入共享计数器，父进程据此显示字节级进度"""
     file_path, name = args
-    return dump(file_path, name)
+    return dump(file_path, name, progress_callback=report_bytes)
 
 def main():
     """主函数，实现并行处理"""
@@ -166,7 +202,7 @@ def main():
     # 查找需要处理的文件（从01_original目录）
     files_to_process = []
     
-    for file in original_dir.glob("*.ncm"):
+    for file in iter_library_files(original_dir, {'.ncm'}):
         name = file.stem
         if name not in cracked:
             files_to_process.append((file, name))
@@ -195,6 +231,8 @@ def main():
     successful = 0
     failed = 0
     total_processed_size = 0
+    # 每个文件的 (格式, 大小, 耗时, 输出大小)，结束后写入吞吐量历史供容量规划使用
+    throughput = []
     start_time = time.time()
     
     with Progress(
@@ -208,8 +246,11 @@ def main():
     ) as progress:
         
         main_task = progress.add_task("🔓 总体进度", total=len(files_to_process))
+        # 工作进程在共享内存里累加字节数，父进程定时采样，大文件也能看到进度
+        counters = ByteCounters()
+        sampler = ByteProgressSampler(counters, progress, total_size).start()
         
-        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=attach, initargs=counters.initargs) as executor:
             # 提交所有任务
             future_to_file = {
                 executor.submit(process_file_wrapper, file_info): file_info 
@@ -221,10 +262,13 @@ def main():
                 file_path, file_name = future_to_file[future]
                 try:
                     result = future.result()
-                    if result and len(result) == 3:
+                    if result and len(result) == 3 and result[0]:
                         output_name, speed, file_size = result
                         successful += 1
                         total_processed_size += file_size
+                        if speed > 0:
+                            throughput.append((file_format(output_name), file_size,
+                                               file_size / (1024 * 1024) / speed, file_size))
                         
                         # 添加到结果表
                         results_table.add_row(
@@ -235,11 +279,12 @@ def main():
                         )
                     else:
                         failed += 1
+                        reason = failure_reason(result)
                         results_table.add_row(
                             file_name[:23] + "..." if len(file_name) > 25 else file_name,
                             "N/A",
                             "N/A",
-                            "❌ 失败"
+                            f"❌ {REASONS[reason['reason']]}" if reason else "❌ 失败"
                         )
                 except Exception as e:
                     failed += 1
@@ -251,8 +296,11 @@ def main():
                     )
                 
                 progress.advance(main_task)
+        
+        sampler.stop()
     
     elapsed = time.time() - start_time
+    record_run('decrypt', throughput, max_workers, elapsed)
     avg_speed = total_processed_size / (1024 * 1024) / elapsed if elapsed > 0 else 0
     
     # 显示结果表
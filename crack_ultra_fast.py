@@ -20,19 +20,28 @@
 3. 内存映射文件 - 直接操作内存，避免频繁I/O
 4. 多进程并行 - 榨干CPU每个核心
 5. 大缓冲区处理 - 1MB vs 32KB，减少系统调用
+6. 原子输出 + 断点续传 - 先写 .part 再改名，大文件定期记录检查点
+7. 压缩包直接输入 - zip/tar 中的NCM流式解密，不先解压到磁盘
+8. 流式输出 - --out - 把结果串成tar流写到stdout，可直接接 ssh / 上传工具
+9. 封面去重 - --covers 解析文件头时把封面按内容哈希存入封面库
+10. 无界面模式 - --headless 边扫描边提交，逐文件结果写入日志，适合十万级批次
+11. 解密前预检 - 核对文件头长度、只解密开头几KB检查音频格式，坏文件在写出数据前就被拒绝并给出原因
 """
 
 import numpy as np
 import mmap
 import multiprocessing
 import pathlib
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from rich.console import Console
 from rich.progress import Progress, SpinnerColumn, TimeElapsedColumn, BarColumn, TaskProgressColumn, TextColumn
 from rich.table import Table
 from rich.panel import Panel
 import binascii
+import collections
+import itertools
 import struct
+import sys
 import base64
 import json
 import os
@@ -40,11 +49,28 @@ import threading
 from Crypto.Cipher import AES
 import time
 
+from batch_stream import WINDOW_PER_WORKER, CappedTable, ResultLog, StatusLine, as_completed_bounded
+from byte_progress import ByteCounters, ByteProgressSampler, attach, detach, report_bytes
+from capacity_planner import MAX_RECORDS, file_format, record_run
+from library_layout import iter_library_files, load_layout
+from output_sink import DirectorySink, close_sink, open_sink
+from preflight import (PREFLIGHT_BYTES, REASONS, PreflightError, check_audio, check_audio_bounds, check_key,
+                       check_length, failure, failure_reason)
+from stats_index import StatsIndex
+
 console = Console()
 
 # 全局锁
 file_lock = threading.Lock()
 
+# 音频数据超过该大小时启用断点续传检查点
+CHECKPOINT_MIN_SIZE = 64 * 1024 * 1024
+# 每解密这么多字节记录一次检查点
+CHECKPOINT_INTERVAL = 64 * 1024 * 1024
+
+# 无界面模式的逐文件结果日志
+DEFAULT_RESULT_LOG = "decrypt_results.log"
+
 def create_key_lookup_table(key_box):
     """预计算密钥查找表以加速解密 - 这是速度提升的关键！"""
     lookup_table = np.zeros(256, dtype=np.uint8)
@@ -62,117 +88,397 @@ def decrypt_chunk_vectorized(chunk_data, key_lookup, start_offset):
     decrypted = chunk_array ^ key_lookup[indices]
     return decrypted.tobytes()
 
-def dump_ultra_fast(file_path, name):
-    """超快速解密函数"""
-    core_key = binascii.a2b_hex("687A4852416D736F356B496E62617857")
-    meta_key = binascii.a2b_hex("2331346C6A6B5F215C5D2630553C2728")
-    unpad = lambda s: s[0:-(s[-1] if type(s[-1]) == int else ord(s[-1]))]
+NCM_CORE_KEY = binascii.a2b_hex("687A4852416D736F356B496E62617857")
+NCM_META_KEY = binascii.a2b_hex("2331346C6A6B5F215C5D2630553C2728")
+
+def _unpad(data):
+    """去掉PKCS#7填充"""
+    return data[0:-(data[-1] if type(data[-1]) == int else ord(data[-1]))]
+
+def read_ncm_header(data):
+    """解析NCM文件头（data 可以是 bytes 或 mmap）
+
+    返回 {'key_data': RC4密钥, 'meta': 元数据字典, 'image_offset', 'image_size', 'audio_offset'}；
+    各长度字段先与数据长度核对，文件头损坏时抛出带原因代码的 PreflightError
+    """
+    # 验证文件头
+    if data[:8] != b'CTENFDAM':
+        raise PreflightError('not_ncm', f"magic is {bytes(data[:8])!r}")
+    limit = len(data)
+    
+    offset = 10  # 跳过文件头和2字节间隔
+    
+    # 读取并解密密钥
+    check_length('key length', offset, 4, limit)
+    key_length = struct.unpack('<I', data[offset:offset+4])[0]
+    offset += 4
+    check_length('key', offset, key_length, limit)
+    if not key_length or key_length % 16:
+        raise PreflightError('bad_key', f"key length {key_length} is not a whole number of AES blocks")
+    
+    # 优化的异或操作
+    key_data = np.frombuffer(bytes(data[offset:offset+key_length]), dtype=np.uint8) ^ 0x64
+    offset += key_length
+    
+    cryptor = AES.new(NCM_CORE_KEY, AES.MODE_ECB)
+    key_data = check_key(_unpad(cryptor.decrypt(key_data.tobytes())))
+    
+    # 读取元数据
+    check_length('meta length', offset, 4, limit)
+    meta_length = struct.unpack('<I', data[offset:offset+4])[0]
+    offset += 4
+    check_length('meta', offset, meta_length, limit)
+    
+    meta_data = np.frombuffer(
+        bytes(data[offset:offset+meta_length]), 
+        dtype=np.uint8
+    ) ^ 0x63
+    offset += meta_length
     
+    try:
+        meta_data = base64.b64decode(meta_data.tobytes()[22:])
+        cryptor = AES.new(NCM_META_KEY, AES.MODE_ECB)
+        meta_data = json.loads(_unpad(cryptor.decrypt(meta_data)).decode('utf-8')[6:])
+    except (ValueError, IndexError) as e:
+        raise PreflightError('bad_meta', str(e)) from e
+    if not isinstance(meta_data, dict) or not meta_data.get('format'):
+        raise PreflightError('bad_meta', "metadata has no audio format")
+    
+    # 跳过CRC32和封面数据
+    offset += 4  # CRC32
+    offset += 5  # gap
+    check_length('image length', offset, 4, limit)
+    image_size = struct.unpack('<I', data[offset:offset+4])[0]
+    offset += 4
+    
+    return {
+        'key_data': key_data,
+        'meta': meta_data,
+        'image_offset': offset,
+        'image_size': image_size,
+        'audio_offset': offset + image_size,
+    }
+
+def _read_exact(stream, size):
+    """从流中读出恰好 size 字节，提前结束说明文件被截断"""
+    data = bytearray()
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            raise PreflightError('truncated_header', f"stream ended after {len(data)} of {size} bytes")
+        data.extend(chunk)
+    return bytes(data)
+
+def read_ncm_stream_header(stream, keep_image=False, size=None):
+    """从只能顺序读取的流（如压缩包成员）中解析NCM文件头，并跳过封面，返回后流正好位于音频数据开头
+
+    keep_image 为True时封面数据放在返回值的 'image' 中；已知流的总大小 size 时，
+    长度字段先与它核对，损坏的长度不会让这里读进大量数据
+    """
+    buffer = bytearray()
+    
+    def take(size):
+        data = _read_exact(stream, size)
+        buffer.extend(data)
+        return data
+    
+    def check(field, length):
+        if size is not None:
+            check_length(field, len(buffer), length, size)
+    
+    if take(10)[:8] != b'CTENFDAM':
+        raise PreflightError('not_ncm', f"magic is {bytes(buffer[:8])!r}")
+    key_length = struct.unpack('<I', take(4))[0]
+    check('key', key_length)
+    take(key_length)
+    meta_length = struct.unpack('<I', take(4))[0]
+    check('meta', meta_length + 4 + 5 + 4)
+    take(meta_length + 4 + 5 + 4)  # 元数据 + CRC32 + gap + 封面长度
+    header = read_ncm_header(bytes(buffer))
+    
+    if keep_image:
+        header['image'] = _read_exact(stream, header['image_size'])
+        return header
+    
+    # 跳过封面
+    remaining = header['image_size']
+    while remaining > 0:
+        remaining -= len(_read_exact(stream, min(remaining, 1024 * 1024)))
+    return header
+
+def read_ncm_meta(file_path):
+    """只读取NCM文件头中的元数据（格式、时长等），不解密音频"""
+    with open(file_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mmapped_file:
+            return read_ncm_header(mmapped_file)['meta']
+
+def build_key_box(key_data):
+    """由RC4密钥生成密钥盒（这部分无法避免循环）"""
+    key_box = bytearray(range(256))
+    c = 0
+    last_byte = 0
+    key_offset = 0
+    key_length = len(key_data)
+    
+    for i in range(256):
+        swap = key_box[i]
+        c = (swap + last_byte + key_data[key_offset]) & 0xff
+        key_offset = (key_offset + 1) % key_length
+        key_box[i] = key_box[c]
+        key_box[c] = swap
+        last_byte = c
+    return key_box
+
+def checkpoint_source_id(file_path, audio_offset):
+    """源文件的身份：大小 + 修改时间 + 音频起始偏移，任何一项变化都说明检查点已失效"""
+    stat = os.stat(file_path)
+    return [stat.st_size, stat.st_mtime_ns, audio_offset]
+
+def load_checkpoint(part_path, source_id):
+    """读取 .part 文件的检查点，返回可以继续的字节偏移（无效时返回0）"""
+    try:
+        with open(part_path + '.ckpt', 'r', encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        processed = int(checkpoint['processed'])
+        if checkpoint['source'] != source_id or os.path.getsize(part_path) < processed:
+            return 0
+        return processed
+    except (OSError, ValueError, KeyError, TypeError):
+        return 0
+
+def save_checkpoint(part_path, source_id, processed):
+    """原子地写入检查点"""
+    checkpoint_path = part_path + '.ckpt'
+    with open(checkpoint_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'source': source_id, 'processed': processed}, f)
+    os.replace(checkpoint_path + '.tmp', checkpoint_path)
+
+def remove_checkpoint(part_path):
+    try:
+        os.remove(part_path + '.ckpt')
+    except FileNotFoundError:
+        pass
+
+def remove_part(part_path):
+    """删除 .part 文件和它的检查点"""
+    try:
+        os.remove(part_path)
+    except FileNotFoundError:
+        pass
+    remove_checkpoint(part_path)
+
+def iter_decrypted(stream, key_lookup, chunk_size=1024 * 1024, head=b''):
+    """从位于音频数据开头的流中逐块读出并解密；head 为预检时已经从流中读出的开头数据"""
+    processed = 0
+    chunk_data = head or stream.read(chunk_size)
+    while chunk_data:
+        yield decrypt_chunk_vectorized(chunk_data, key_lookup, processed)
+        processed += len(chunk_data)
+        report_bytes(len(chunk_data))
+        chunk_data = stream.read(chunk_size)
+
+def save_cover(covers, name, image):
+    """把封面存入封面库；封面只是附带产物，出错不影响解密"""
+    try:
+        covers.add_track(name, image)
+    except Exception:
+        pass
+
+def dump_ultra_fast(file_path, name, record_path='cracked.txt', sink=None, covers=None, lease=None):
+    """超快速解密函数；成功后把名称追加到 record_path
+
+    sink 为None时写入 02_decrypted（支持断点续传），否则把解密结果写到该输出目标；
+    covers 为 CoverStore 时顺便把封面存入封面库；
+    lease 为集群租约凭据（见 cluster_crack.LeaseGuard）时，临时文件名带上 lease.tag，
+    每个检查点和最后改名之前调用 lease() 确认租约仍在手中，已被接管时它抛出异常，这次结果作废；
+    返回 (输出文件名, 速度, 大小)，失败时为 (None, 原因, 0)，原因为 {'reason', 'detail'}（见 preflight.py）
+    """
     try:
         file_size = os.path.getsize(file_path)
         
         with open(file_path, 'rb') as f:
             # 使用内存映射加速文件读取
             with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mmapped_file:
-                # 验证文件头
-                if mmapped_file[:8] != b'CTENFDAM':
-                    raise ValueError("Invalid NCM file format")
-                
-                offset = 10  # 跳过文件头和2字节间隔
-                
-                # 读取并解密密钥
-                key_length = struct.unpack('<I', mmapped_file[offset:offset+4])[0]
-                offset += 4
-                
-                key_data = bytearray(mmapped_file[offset:offset+key_length])
-                offset += key_length
-                
-                # 优化的异或操作
-                key_data = np.frombuffer(key_data, dtype=np.uint8) ^ 0x64
-                
-                cryptor = AES.new(core_key, AES.MODE_ECB)
-                key_data = unpad(cryptor.decrypt(key_data.tobytes()))[17:]
-                
-                # 生成密钥盒（这部分无法避免循环）
-                key_box = bytearray(range(256))
-                c = 0
-                last_byte = 0
-                key_offset = 0
-                key_length = len(key_data)
-                
-                for i in range(256):
-                    swap = key_box[i]
-                    c = (swap + last_byte + key_data[key_offset]) & 0xff
-                    key_offset = (key_offset + 1) % key_length
-                    key_box[i] = key_box[c]
-                    key_box[c] = swap
-                    last_byte = c
+                header = read_ncm_header(mmapped_file)
+                meta_data = header['meta']
+                offset = header['audio_offset']
+                check_audio_bounds(offset, file_size)
                 
                 # 预计算查找表
-                key_lookup = create_key_lookup_table(key_box)
-                
-                # 读取元数据
-                meta_length = struct.unpack('<I', mmapped_file[offset:offset+4])[0]
-                offset += 4
+                key_lookup = create_key_lookup_table(build_key_box(header['key_data']))
                 
-                meta_data = np.frombuffer(
-                    mmapped_file[offset:offset+meta_length], 
-                    dtype=np.uint8
-                ) ^ 0x63
-                offset += meta_length
+                # 预检：只解密音频开头几KB，确认密钥正确、格式与元数据一致，再开始写出
+                check_audio(decrypt_chunk_vectorized(mmapped_file[offset:offset + PREFLIGHT_BYTES], key_lookup, 0),
+                            meta_data['format'])
                 
-                meta_data = base64.b64decode(meta_data.tobytes()[22:])
-                cryptor = AES.new(meta_key, AES.MODE_ECB)
-                meta_data = json.loads(unpad(cryptor.decrypt(meta_data)).decode('utf-8')[6:])
-                
-                # 跳过CRC32和封面数据
-                offset += 4  # CRC32
-                offset += 5  # gap
-                image_size = struct.unpack('<I', mmapped_file[offset:offset+4])[0]
-                offset += 4 + image_size
+                if covers is not None:
+                    image_offset = header['image_offset']
+                    save_cover(covers, name, mmapped_file[image_offset:image_offset + header['image_size']])
                 
                 # 准备输出文件
                 file_name = os.path.splitext(os.path.basename(file_path))[0] + '.' + meta_data['format']
-                output_path = os.path.join("02_decrypted", file_name)
                 
                 # 音频数据处理 - 使用1MB大缓冲区！
                 audio_data_size = file_size - offset
                 CHUNK_SIZE = 1024 * 1024  # 1MB 块大小 - 比普通版本大4倍！
                 
+                if sink is not None:
+                    # 边解密边写入输出目标，结果不经过 02_decrypted
+                    start_time = time.time()
+                    mmapped_file.seek(offset)
+                    sink.write_stream(file_name, audio_data_size, iter_decrypted(mmapped_file, key_lookup, CHUNK_SIZE))
+                    elapsed = time.time() - start_time
+                    speed = audio_data_size / (1024 * 1024) / elapsed if elapsed > 0 else 0
+                    if sink.local:
+                        record_output(record_path, name, audio_data_size, None)
+                    return file_name, speed, audio_data_size
+                
+                output_path = str(load_layout().output_path("02_decrypted", file_name))
+                # 覆盖旧文件时统计索引只更新字节数
+                previous_size = os.path.getsize(output_path) if os.path.exists(output_path) else None
+                
+                # 先写到 .part 临时文件，完成后再改名，被杀掉时不会留下看似完整的半截文件；
+                # 集群中按租约区分临时文件，接管同一文件的节点不会写进同一个 .part
+                part_path = output_path + (f'.{lease.tag}.part' if lease is not None else '.part')
+                source_id = checkpoint_source_id(file_path, offset)
+                use_checkpoints = audio_data_size >= CHECKPOINT_MIN_SIZE
+                # 密钥流只与偏移量有关，可以从任意检查点继续解密
+                resumed = load_checkpoint(part_path, source_id) if use_checkpoints else 0
+                
                 start_time = time.time()
                 
-                with open(output_path, 'wb') as output_file:
-                    processed = 0
-                    
-                    while processed < audio_data_size:
-                        chunk_size = min(CHUNK_SIZE, audio_data_size - processed)
-                        chunk_data = mmapped_file[offset + processed:offset + processed + chunk_size]
+                try:
+                    with open(part_path, 'r+b' if resumed else 'wb') as output_file:
+                        processed = resumed
+                        report_bytes(resumed)
+                        output_file.seek(processed)
+                        output_file.truncate()
+                        next_checkpoint = processed + CHECKPOINT_INTERVAL
+                        
+                        while processed < audio_data_size:
+                            chunk_size = min(CHUNK_SIZE, audio_data_size - processed)
+                            chunk_data = mmapped_file[offset + processed:offset + processed + chunk_size]
+                            
+                            # 使用向量化解密 - 这里是魔法发生的地方！
+                            decrypted_chunk = decrypt_chunk_vectorized(chunk_data, key_lookup, processed)
+                            output_file.write(decrypted_chunk)
+                            processed += chunk_size
+                            report_bytes(chunk_size)
+                            
+                            if use_checkpoints and processed >= next_checkpoint:
+                                # 数据落盘之后才记录检查点，检查点永远不会超前于文件内容
+                                output_file.flush()
+                                os.fsync(output_file.fileno())
+                                save_checkpoint(part_path, source_id, processed)
+                                next_checkpoint = processed + CHECKPOINT_INTERVAL
+                                if lease is not None:
+                                    lease()
                         
-                        # 使用向量化解密 - 这里是魔法发生的地方！
-                        decrypted_chunk = decrypt_chunk_vectorized(chunk_data, key_lookup, processed)
-                        output_file.write(decrypted_chunk)
-                        processed += chunk_size
+                        output_file.flush()
+                        os.fsync(output_file.fileno())
+                    
+                    if lease is not None:
+                        lease()
+                    os.replace(part_path, output_path)
+                except BaseException:
+                    if lease is not None:
+                        # 带租约标记的临时文件以后没有人会续传，放弃时直接清理
+                        remove_part(part_path)
+                    raise
+                remove_checkpoint(part_path)
                 
                 elapsed = time.time() - start_time
-                speed = audio_data_size / (1024 * 1024) / elapsed if elapsed > 0 else 0
-        
-        # 线程安全地写入已处理文件列表
-        with file_lock:
-            with open('cracked.txt', 'a', encoding='utf-8') as f:
-                f.write(name + '\n')
+                speed = (audio_data_size - resumed) / (1024 * 1024) / elapsed if elapsed > 0 else 0
         
+        record_output(record_path, name, audio_data_size, previous_size)
         return file_name, speed, audio_data_size
         
     except Exception as e:
-        return None, 0, 0
+        return None, failure(e), 0
+
+def record_output(record_path, name, size, previous_size):
+    """解密成功后写入记录文件并更新统计索引"""
+    # 线程安全地写入已处理文件列表
+    with file_lock:
+        with open(record_path, 'a', encoding='utf-8') as f:
+            f.write(name + '\n')
+    
+    stats_index = StatsIndex()
+    stats_index.add_file('decrypted', size, previous_size)
+    stats_index.add_record('cracked')
+
+def dump_stream(stream, name, record_path='cracked.txt', sink=None, size=None, covers=None):
+    """从顺序读取的流中解密一个NCM（压缩包成员），加密文件本身不落盘；返回值与 dump_ultra_fast 相同
+
+    sink 为None时写入 02_decrypted；size 为成员总字节数，流式输出目标需要事先知道条目大小
+    """
+    try:
+        sink = sink or DirectorySink("02_decrypted", load_layout())
+        header = read_ncm_stream_header(stream, keep_image=covers is not None, size=size)
+        if size is not None:
+            check_audio_bounds(header['audio_offset'], size)
+        key_lookup = create_key_lookup_table(build_key_box(header['key_data']))
+        # 预检：只解密音频开头几KB，通过后才交给输出目标，这几KB随后作为第一块写出
+        head = stream.read(PREFLIGHT_BYTES)
+        check_audio(decrypt_chunk_vectorized(head, key_lookup, 0), header['meta']['format'])
+        if covers is not None:
+            save_cover(covers, name, header['image'])
+        
+        file_name = name + '.' + header['meta']['format']
+        output_path = load_layout().locate("02_decrypted", file_name)
+        previous_size = os.path.getsize(output_path) if sink.local and os.path.exists(output_path) else None
+        # 目录输出不需要事先知道大小
+        audio_data_size = size - header['audio_offset'] if size is not None else None
+        if audio_data_size is None and not sink.local:
+            raise ValueError("Stream size is required for this sink")
+        
+        start_time = time.time()
+        processed = sink.write_stream(file_name, audio_data_size, iter_decrypted(stream, key_lookup, head=head))
+        elapsed = time.time() - start_time
+        speed = processed / (1024 * 1024) / elapsed if elapsed > 0 else 0
+        
+        if sink.local:
+            record_output(record_path, name, processed, previous_size)
+        return file_name, speed, processed
+    
+    except Exception as e:
+        return None, failure(e), 0
 
 def process_file_ultra_fast(args):
-    """多进程包装函数"""
-    file_path, name = args
-    return dump_ultra_fast(file_path, name)
+    """多进程包装函数，args 为 (文件路径, 名称[, 记录文件])"""
+    return dump_ultra_fast(*args)
 
-def main_ultra_fast():
-    """主函数，实现超快速并行处理"""
+def iter_decrypt_jobs(original_dir, cracked, archives):
+    """惰性产出解密任务 (类型, 参数)：先是目录中的NCM，目录扫完后再展开压缩包（同名成员以目录中的文件为准）"""
+    from archive_input import collect_archive_jobs
+    seen = set()
+    for file in iter_library_files(original_dir, {'.ncm'}):
+        name = file.stem
+        if name not in cracked:
+            if archives:
+                seen.add(name)
+            yield 'file', (str(file), name)
+    if not archives:
+        return
+    skip = cracked | seen
+    zip_jobs, tar_archives = collect_archive_jobs(archives, skip)
+    for job in zip_jobs:
+        yield 'zip', job
+    for archive in tar_archives:
+        yield 'tar', (archive, skip)
+
+def main_ultra_fast(archives=None, out=None, covers=None, headless=False, result_log=DEFAULT_RESULT_LOG,
+                    workers=None):
+    """主函数，实现超快速并行处理；archives 为额外的压缩包输入（01_original 中的压缩包会自动加入）
+
+    out 为 '-' 或tar文件路径时，解密结果串成tar流输出，不写 02_decrypted，也不读写 cracked.txt；
+    covers 为 CoverStore 时解析文件头时顺便提取封面；
+    headless 为True时不显示进度条和结果表，逐文件结果追加到 result_log，内存中只保留汇总
+    """
+    sink = open_sink(out)
+    if out == '-':
+        # stdout 留给tar流，界面输出改到stderr
+        console.file = sys.stderr
     console.print(Panel.fit("🚀 NCM 超快速解密器", style="bold magenta"))
     console.print("💫 黑科技加持：NumPy向量化 + 内存映射 + 预计算查找表 + 多进程并行")
     console.print("📁 使用规范化目录结构：01_original -> 02_decrypted")
@@ -186,45 +492,68 @@ def main_ultra_fast():
     
     try:
         with open('cracked.txt', 'r', encoding='utf-8') as f:
-            cracked = set(f.read().strip().split('\n'))
+            cracked = set(f.read().strip().split('\n')) if sink is None else set()
     except FileNotFoundError:
         cracked = set()
     
-    # 查找需要处理的文件（从01_original目录）
-    files_to_process = []
-    
-    for file in original_dir.glob("*.ncm"):
-        name = file.stem
-        if name not in cracked:
-            files_to_process.append((str(file), name))
+    # 查找需要处理的文件（从01_original目录）；无界面模式下边扫描边提交，不先列出全部文件
+    from archive_input import dump_tar_archive, find_archives, process_zip_member
+    archives = find_archives(original_dir) + [pathlib.Path(archive) for archive in archives or []]
+    jobs = iter_decrypt_jobs(original_dir, cracked, archives)
+    if headless:
+        first = next(jobs, None)
+        if first is not None:
+            jobs = itertools.chain([first], jobs)
+        has_jobs = first is not None
+    else:
+        jobs = list(jobs)
+        has_jobs = bool(jobs)
     
-    if not files_to_process:
+    if not has_jobs:
         console.print("❌ 在 01_original/ 目录中没有找到需要处理的 .ncm 文件", style="red")
-        console.print("💡 提示：请将NCM文件放入 01_original/ 目录", style="yellow")
+        console.print("💡 提示：请将NCM文件或包含NCM的压缩包放入 01_original/ 目录", style="yellow")
+        close_sink(sink)
         return
     
-    total_size = sum(pathlib.Path(fp).stat().st_size for fp, _ in files_to_process)
-    max_workers = min(multiprocessing.cpu_count(), len(files_to_process), 6)
-    
-    console.print(f"📁 找到 [bold cyan]{len(files_to_process)}[/bold cyan] 个文件需要处理")
-    console.print(f"💾 总大小: [bold yellow]{total_size/(1024*1024):.1f} MB[/bold yellow]")
-    console.print(f"🔥 使用 [bold red]{max_workers}[/bold red] 个并行进程 (超快速模式)")
-    console.print(f"📂 输出目录: [bold blue]02_decrypted/[/bold blue]")
-    console.print("🎯 [bold green]准备释放洪荒之力...[/bold green]\n")
+    if headless:
+        total_jobs = None
+        total_size = 0
+        max_workers = workers or min(multiprocessing.cpu_count(), 6)
+        console.print("🌊 无界面模式：边扫描边提交，逐文件结果写入 "
+                      f"[bold cyan]{result_log}[/bold cyan]，终端只定时打印汇总")
+    else:
+        kinds = collections.Counter(kind for kind, _ in jobs)
+        total_jobs = len(jobs)
+        total_size = sum(pathlib.Path(args[0]).stat().st_size for kind, args in jobs if kind == 'file')
+        total_size += sum(pathlib.Path(archive).stat().st_size for archive in archives)
+        max_workers = min(workers or min(multiprocessing.cpu_count(), 6), kinds['file'] + kinds['zip']) or 1
+        console.print(f"📁 找到 [bold cyan]{kinds['file']}[/bold cyan] 个文件需要处理")
+        if archives:
+            console.print(f"📦 压缩包: [bold cyan]{len(archives)}[/bold cyan] 个  "
+                          f"(zip成员 [bold cyan]{kinds['zip']}[/bold cyan] 个，tar包 [bold cyan]{kinds['tar']}[/bold cyan] 个流式处理)")
+        console.print(f"💾 总大小: [bold yellow]{total_size/(1024*1024):.1f} MB[/bold yellow]")
     console.print(f"🔥 使用 [bold red]{max_workers}[/bold red] 个并行进程 (超快速模式)")
+    console.print(f"📂 输出目录: [bold blue]{'02_decrypted/' if sink is None else ('stdout (tar流)' if out == '-' else out + ' (tar流)')}[/bold blue]")
     console.print("🎯 [bold green]准备释放洪荒之力...[/bold green]\n")
     
-    # 创建结果统计表
+    # 创建结果统计表（无界面模式下结果写进日志，不进表）
     results_table = Table(title="🎵 超快速解密结果统计")
     results_table.add_column("文件名", style="cyan", width=25)
     results_table.add_column("大小", justify="right", style="yellow")
     results_table.add_column("速度", justify="right", style="red")
     results_table.add_column("状态", justify="center")
+    results_table = CappedTable(results_table)
+    log = ResultLog(result_log) if headless else None
+    status = StatusLine(console) if headless else None
     
     # 并行处理文件
     successful = 0
     failed = 0
+    # 失败原因代码 -> 文件数
+    failure_reasons = collections.Counter()
     total_processed_size = 0
+    # 每个文件的 (格式, 大小, 耗时, 输出大小)，结束后写入吞吐量历史供容量规划使用；历史只保留最近的记录，这里也只留这么多
+    throughput = collections.deque(maxlen=MAX_RECORDS)
     start_time = time.time()
     
     with Progress(
@@ -234,61 +563,106 @@ def main_ultra_fast():
         TaskProgressColumn(),
         TimeElapsedColumn(),
         console=console,
-        transient=False
+        transient=False,
+        disable=headless
     ) as progress:
         
-        main_task = progress.add_task("🚀 超快速处理中", total=len(files_to_process))
+        main_task = progress.add_task("🚀 超快速处理中", total=total_jobs)
+        # 工作进程/线程在共享内存里累加已解密字节数，父进程定时采样显示吞吐量和剩余时间
+        counters = ByteCounters()
+        attach(*counters.initargs)
+        sampler = ByteProgressSampler(counters, progress, total_size).start()
         
-        with ProcessPoolExecutor(max_workers=max_workers) as executor:
-            # 提交所有任务
-            future_to_file = {
-                executor.submit(process_file_ultra_fast, file_info): file_info 
-                for file_info in files_to_process
-            }
+        # 输出到流时所有结果要写进同一个流，改用线程，各任务按条目轮流写入
+        if sink is None:
+            pool = ProcessPoolExecutor(max_workers=max_workers, initializer=attach, initargs=counters.initargs)
+        else:
+            pool = ThreadPoolExecutor(max_workers=max_workers)
+        # tar 包只能顺序读取，每个包占一个线程
+        with pool as executor, ThreadPoolExecutor(max_workers=max_workers) as tar_executor:
+            def submit(job):
+                kind, args = job
+                if kind == 'file':
+                    return executor.submit(dump_ultra_fast, *args, sink=sink, covers=covers)
+                if kind == 'zip':
+                    return executor.submit(process_zip_member, args, sink, covers)
+                archive, skip = args
+                return tar_executor.submit(dump_tar_archive, archive, skip, sink=sink, covers=covers)
             
-            # 处理完成的任务
-            for future in as_completed(future_to_file):
-                file_path, file_name = future_to_file[future]
+            def member_results(job, future):
+                kind, args = job
+                if kind == 'tar':
+                    try:
+                        results = future.result()
+                    except Exception:
+                        results = [(pathlib.Path(args[0]).name, None)]
+                    # 一个tar包在进度中占一格，展开成员后修正总数
+                    if total_jobs is not None:
+                        progress.update(main_task, total=progress.tasks[main_task].total + len(results) - 1)
+                    return results
+                file_name = args[1] if kind == 'file' else args[2]
                 try:
-                    result = future.result()
-                    if result and len(result) == 3:
+                    return [(file_name, future.result())]
+                except Exception:
+                    return [(file_name, None)]
+            
+            # 同时在途的任务不超过窗口大小，做完一个再从扫描器取下一个
+            for job, future in as_completed_bounded(submit, jobs, max_workers * WINDOW_PER_WORKER):
+                for file_name, result in member_results(job, future):
+                    if result and len(result) == 3 and result[0]:
                         output_name, speed, file_size = result
                         successful += 1
                         total_processed_size += file_size
+                        if speed > 0:
+                            throughput.append((file_format(output_name), file_size,
+                                               file_size / (1024 * 1024) / speed, file_size))
                         
-                        # 添加到结果表 - 用红色显示超高速度！
-                        speed_style = "bold red" if speed > 50 else "green"
-                        results_table.add_row(
-                            file_name[:23] + "..." if len(file_name) > 25 else file_name,
-                            f"{file_size/(1024*1024):.1f} MB",
-                            f"[{speed_style}]{speed:.1f} MB/s[/{speed_style}]",
-                            "🚀 超快"
-                        )
+                        if log is not None:
+                            log.write('ok', file_name, file_size, f"{speed:.1f}")
+                        else:
+                            # 添加到结果表 - 用红色显示超高速度！
+                            speed_style = "bold red" if speed > 50 else "green"
+                            results_table.add_row(
+                                file_name[:23] + "..." if len(file_name) > 25 else file_name,
+                                f"{file_size/(1024*1024):.1f} MB",
+                                f"[{speed_style}]{speed:.1f} MB/s[/{speed_style}]",
+                                "🚀 超快"
+                            )
                     else:
                         failed += 1
-                        results_table.add_row(
-                            file_name[:23] + "..." if len(file_name) > 25 else file_name,
-                            "N/A",
-                            "N/A",
-                            "❌ 失败"
-                        )
-                except Exception as e:
-                    failed += 1
-                    results_table.add_row(
-                        file_name[:23] + "..." if len(file_name) > 25 else file_name,
-                        "N/A",
-                        "N/A",
-                        "💥 异常"
-                    )
-                
-                progress.advance(main_task)
+                        reason = failure_reason(result)
+                        if reason:
+                            failure_reasons[reason['reason']] += 1
+                        if log is not None:
+                            log.write('failed' if result else 'error', file_name,
+                                      *((reason['reason'], reason['detail']) if reason else ()))
+                        else:
+                            results_table.add_row(
+                                file_name[:23] + "..." if len(file_name) > 25 else file_name,
+                                "N/A",
+                                "N/A",
+                                f"❌ {REASONS[reason['reason']]}" if reason else "❌ 失败" if result else "💥 异常"
+                            )
+                    
+                    progress.advance(main_task)
+                if status is not None:
+                    status.update(f"✅ {successful}  ❌ {failed}  💾 {total_processed_size/(1024*1024):.1f} MB  "
+                                  f"⚡ {sampler.rate/(1024*1024):.1f} MB/s")
+        
+        sampler.stop()
+        detach()
     
+    close_sink(sink)
+    if log is not None:
+        log.close()
     elapsed = time.time() - start_time
+    record_run('decrypt', list(throughput), max_workers, elapsed)
     avg_speed = total_processed_size / (1024 * 1024) / elapsed if elapsed > 0 else 0
     
     # 显示结果表
     console.print("\n")
-    console.print(results_table)
+    if log is None:
+        results_table.render(console)
     
     # 显示总结信息 - 特别强调超高速度
     summary_table = Table(show_header=False, box=None)
@@ -298,6 +672,10 @@ def main_ultra_fast():
     summary_table.add_row("🎉 超快速处理完成", "")
     summary_table.add_row("✅ 成功", f"[bold green]{successful}[/bold green] 个文件")
     summary_table.add_row("❌ 失败", f"[bold red]{failed}[/bold red] 个文件")
+    rejected = {code: count for code, count in failure_reasons.items() if code != 'error'}
+    if rejected:
+        summary_table.add_row("🛂 预检拒绝", f"[bold red]{sum(rejected.values())}[/bold red] 个文件 ("
+                              + "，".join(f"{REASONS[code]} {count}" for code, count in rejected.items()) + ")")
     summary_table.add_row("⏱️  总耗时", f"[bold yellow]{elapsed:.2f}[/bold yellow] 秒")
     summary_table.add_row("🚀 平均速度", f"[bold red]{avg_speed:.1f}[/bold red] MB/s")
     summary_table.add_row("💾 总处理量", f"[bold magenta]{total_processed_size/(1024*1024):.1f}[/bold magenta] MB")
@@ -316,7 +694,27 @@ if __name__ == '__main__':
     # 检查是否安装了 numpy
     try:
         import numpy as np
-        main_ultra_fast()
+        import argparse
+        parser = argparse.ArgumentParser(description="NCM 超快速解密器")
+        parser.add_argument('archives', nargs='*', help="额外的zip/tar压缩包输入（01_original 中的压缩包会自动加入）")
+        parser.add_argument('--out', default=None,
+                            help="输出为tar流：'-' 写到stdout，或tar文件路径 (默认: 写入 02_decrypted/)")
+        parser.add_argument('--covers', action='store_true', help="解密时把封面去重存入封面库")
+        parser.add_argument('--cover-dir', default='covers', help="封面库目录 (默认: covers)")
+        parser.add_argument('--thumb-sizes', default='', help="新封面入库时生成的缩略图宽度，逗号分隔，如 300,600")
+        parser.add_argument('--headless', action='store_true',
+                            help="无界面模式：边扫描边提交，逐文件结果写入日志，终端只定时打印汇总（适合十万级批次）")
+        parser.add_argument('--result-log', default=DEFAULT_RESULT_LOG,
+                            help=f"无界面模式的结果日志 (默认: {DEFAULT_RESULT_LOG})")
+        parser.add_argument('--workers', type=int, default=None,
+                            help="并行解密进程数 (默认: CPU核心数，最多6；capacity_planner.py plan 会给出推荐值)")
+        args = parser.parse_args()
+        covers = None
+        if args.covers:
+            from cover_store import CoverStore, parse_sizes
+            covers = CoverStore(args.cover_dir, parse_sizes(args.thumb_sizes))
+        main_ultra_fast(args.archives, out=args.out, covers=covers,
+                        headless=args.headless, result_log=args.result_log, workers=args.workers)
     except ImportError:
         print("错误: 需要安装 numpy 才能使用超快速模式")
         print("请运行: pip install numpy")
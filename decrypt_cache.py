@@ -0,0 +1,371 @@
+# This file is part of ncm_cracker.
+#
+# ncm_cracker is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ncm_cracker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ncm_cracker.  If not, see <https://www.gnu.org/licenses/>.
+"""
+💽 按需解密缓存
+不必让整个 02_decrypted 常驻磁盘：曲目在被请求时才从 01_original 解密，放进有容量上限的缓存目录：
+1. 按曲目名请求（库调用 DecryptCache.get 或命令行 get），命中时直接返回缓存中的文件
+2. 索引持久化在 index.json 中，记录每个条目的大小、最近访问时间和源NCM的 (大小, 修改时间)
+3. 写入新条目后按最近访问时间淘汰，直到总大小不超过预算；刚写入的条目不会被淘汰
+4. 被淘汰或源文件变化后再次请求时透明地重新解密 - 向量化解密很快，用一点CPU换大量磁盘空间
+5. 同一曲目同时被多次请求时只解密一次，其他请求等它完成
+6. 多个进程可以共用一个缓存目录 - 索引在锁文件保护下重新读取后再修改和保存，各进程的条目和计数互不覆盖；
+   启动时只清理超过宽限期、不在索引中的残留文件，其他进程正在写的文件不受影响
+
+用法：
+    python decrypt_cache.py --max-size 5G get 曲目名
+    python decrypt_cache.py stats
+    python decrypt_cache.py evict --to 2G
+
+    from decrypt_cache import DecryptCache
+    path = DecryptCache(max_bytes=5 * 1024 ** 3).get("曲目名")
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import pathlib
+import threading
+import time
+import uuid
+from rich.console import Console
+from rich.panel import Panel
+from rich.table import Table
+
+from encode_cache import parse_size
+from library_layout import LibraryLayout, load_layout
+from output_sink import DirectorySink
+from preflight import describe, failure_reason
+
+console = Console()
+
+DEFAULT_CACHE_DIR = ".decrypt_cache"
+DEFAULT_MAX_SIZE = "10G"
+
+# 缓存目录按曲目名分一级片，条目多时单个目录也不会太大
+CACHE_LAYOUT = LibraryLayout(1)
+
+# 不在索引中的文件超过该秒数才当作残留删除：更新的可能是别的进程刚写好、还没登记的条目
+ORPHAN_GRACE_SECONDS = 3600
+
+# 索引锁文件超过该秒数没有刷新，视为持有进程已退出；持有者在长事务中按 LOCK_REFRESH_SECONDS 刷新
+LOCK_STALE_SECONDS = 30
+LOCK_REFRESH_SECONDS = 5
+
+# 等待索引锁时的轮询间隔（秒）
+LOCK_POLL_INTERVAL = 0.02
+
+
+class _CacheSink(DirectorySink):
+    """写进缓存目录；不算项目中的解密结果，不写 cracked.txt 和统计索引"""
+
+    local = False
+
+    def part_path(self, output_path):
+        # 多个进程/线程可能同时解密同一首曲目，各写各的临时文件
+        return output_path.with_name(f"{output_path.name}.{os.getpid()}.{threading.get_ident()}.part")
+
+
+class DecryptCache:
+    """曲目名 -> 缓存中的解密结果，总大小不超过 max_bytes（按最近访问时间淘汰）"""
+
+    def __init__(self, root=DEFAULT_CACHE_DIR, max_bytes=None, original_dir="01_original"):
+        self.root = pathlib.Path(root)
+        self.objects = self.root / "objects"
+        self.index_path = self.root / "index.json"
+        self.lock_path = self.root / "index.lock"
+        self.max_bytes = max_bytes if max_bytes is not None else parse_size(DEFAULT_MAX_SIZE)
+        self.original_dir = pathlib.Path(original_dir)
+        self.objects.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        # 正在解密的曲目名 -> Event，同名的并发请求等待同一次解密
+        self.pending = {}
+        # 本进程持有索引锁时锁文件中的令牌，以及上次刷新锁文件的时间
+        self.lock_token = None
+        self.lock_touched = 0
+        self.index = self._load()
+        self._reconcile()
+
+    @property
+    def entries(self):
+        return self.index['entries']
+
+    def _load(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (FileNotFoundError, ValueError):
+            index = {}
+        index.setdefault('entries', {})
+        index.setdefault('hits', 0)
+        index.setdefault('misses', 0)
+        index.setdefault('evictions', 0)
+        return index
+
+    def save(self):
+        """原子地保存索引（调用方持有索引锁）"""
+        temp_path = self.index_path.with_name(f"{self.index_path.name}.{os.getpid()}.tmp")
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.index, f, ensure_ascii=False)
+        os.replace(temp_path, self.index_path)
+
+    def _read_lock(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _acquire_file_lock(self):
+        """用 O_EXCL 创建写有随机令牌的锁文件，已被持有时等待；持有者退出后留下的过期锁由一个等待者接管"""
+        token = uuid.uuid4().hex
+        while True:
+            try:
+                fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                pass
+            else:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    f.write(token)
+                self.lock_token = token
+                self.lock_touched = time.monotonic()
+                return
+            observed = self._read_lock(self.lock_path)
+            try:
+                stale = time.time() - self.lock_path.stat().st_mtime > LOCK_STALE_SECONDS
+            except FileNotFoundError:
+                continue
+            if stale and observed is not None:
+                self._break_stale_lock(observed)
+                continue
+            time.sleep(LOCK_POLL_INTERVAL)
+
+    def _break_stale_lock(self, observed):
+        """与 cluster_crack.LeaseTable.claim 相同：先把过期锁改名为私有文件（只有一个等待者能改名成功），
+        确认改走的正是看到的那份过期锁再删除；改走的是别人刚创建的新锁时尽量还回去"""
+        stale_path = self.lock_path.with_name(f"{self.lock_path.name}.stale.{os.getpid()}.{threading.get_ident()}")
+        try:
+            os.rename(self.lock_path, stale_path)
+        except FileNotFoundError:
+            return
+        if self._read_lock(stale_path) != observed:
+            try:
+                os.link(stale_path, self.lock_path)
+            except OSError:
+                pass
+        stale_path.unlink(missing_ok=True)
+
+    def refresh_lock(self):
+        """长事务中定期刷新锁文件的修改时间，不被其他进程当成过期锁接管"""
+        now = time.monotonic()
+        if self.lock_token is not None and now - self.lock_touched >= LOCK_REFRESH_SECONDS:
+            try:
+                os.utime(self.lock_path)
+            except FileNotFoundError:
+                pass
+            self.lock_touched = now
+
+    def _release_file_lock(self):
+        """只删除仍属于本进程的锁文件"""
+        if self._read_lock(self.lock_path) == self.lock_token:
+            self.lock_path.unlink(missing_ok=True)
+        self.lock_token = None
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """修改索引：持有线程锁和索引锁，先从磁盘重新读取（包含其他进程的修改），结束时保存"""
+        with self.lock:
+            self._acquire_file_lock()
+            try:
+                self.index = self._load()
+                yield self.index
+                self.save()
+            finally:
+                self._release_file_lock()
+
+    def object_path(self, file_name):
+        return CACHE_LAYOUT.path(self.objects, file_name)
+
+    def total_bytes(self):
+        return sum(entry['size'] for entry in self.entries.values())
+
+    def _reconcile(self):
+        """启动时对齐索引与磁盘：丢掉文件已不存在的条目，删除不在索引中的残留文件
+
+        只删除超过宽限期的文件，并且不碰 .part：别的进程可能正在写入，或刚写好还没来得及登记
+        """
+        with self.transaction():
+            indexed = set()
+            for name, entry in list(self.entries.items()):
+                self.refresh_lock()
+                path = self.object_path(entry['file'])
+                if path.exists():
+                    indexed.add(path)
+                else:
+                    del self.entries[name]
+            cutoff = time.time() - ORPHAN_GRACE_SECONDS
+            for path in self.objects.glob('*/*'):
+                self.refresh_lock()
+                if path in indexed or path.name.endswith('.part'):
+                    continue
+                try:
+                    if path.stat().st_mtime < cutoff:
+                        path.unlink()
+                except FileNotFoundError:
+                    continue
+
+    def source_path(self, name):
+        """曲目对应的NCM（按项目的目录布局查找）"""
+        return load_layout().locate(self.original_dir, name + '.ncm')
+
+    @staticmethod
+    def _stamp(path):
+        stat = path.stat()
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def _lookup(self, name, source):
+        """有效的缓存条目；源NCM变化过（重新下载等）的条目作废"""
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+        if source.exists() and entry.get('source') != self._stamp(source):
+            return None
+        path = self.object_path(entry['file'])
+        return path if path.exists() else None
+
+    def get(self, name):
+        """返回曲目解密结果的路径，不在缓存中时先解密；没有源文件时抛出 FileNotFoundError，解密失败时抛出 ValueError"""
+        source = self.source_path(name)
+        while True:
+            with self.transaction():
+                path = self._lookup(name, source)
+                if path is not None:
+                    self.entries[name]['last_access'] = time.time()
+                    self.index['hits'] += 1
+                    return path
+                waiting = self.pending.get(name)
+                if waiting is None:
+                    self.pending[name] = threading.Event()
+                    break
+            # 别的线程正在解密同一首曲目，等它完成后再查一次
+            waiting.wait()
+
+        try:
+            return self._fill(name, source)
+        finally:
+            with self.lock:
+                self.pending.pop(name).set()
+
+    def _fill(self, name, source):
+        """解密到缓存并登记，然后淘汰到预算以内"""
+        from crack_ultra_fast import dump_ultra_fast
+
+        if not source.exists():
+            raise FileNotFoundError(f"{name}: source not found in {self.original_dir}")
+        stamp = self._stamp(source)
+        result = dump_ultra_fast(str(source), name, sink=_CacheSink(self.objects, CACHE_LAYOUT))
+        file_name, _, size = result
+        if not file_name:
+            raise ValueError(f"{name}: {describe(failure_reason(result))}")
+
+        with self.transaction():
+            previous = self.entries.get(name)
+            if previous is not None and previous['file'] != file_name:
+                self.object_path(previous['file']).unlink(missing_ok=True)
+            self.entries[name] = {'file': file_name, 'size': size, 'last_access': time.time(), 'source': stamp}
+            self.index['misses'] += 1
+            self._evict_locked(self.max_bytes, keep=name)
+        return self.object_path(file_name)
+
+    def _evict_locked(self, max_bytes, keep=None):
+        """按最近访问时间从旧到新删除条目，直到总大小不超过 max_bytes；返回 (删除数量, 释放字节)"""
+        total = self.total_bytes()
+        removed = 0
+        freed = 0
+        for name, entry in sorted(self.entries.items(), key=lambda item: item[1]['last_access']):
+            if total <= max_bytes:
+                break
+            if name == keep or name in self.pending:
+                continue
+            self.refresh_lock()
+            try:
+                self.object_path(entry['file']).unlink(missing_ok=True)
+            except OSError:
+                # 文件正被占用（Windows上正在播放的文件不能删除），下次再淘汰
+                continue
+            del self.entries[name]
+            total -= entry['size']
+            removed += 1
+            freed += entry['size']
+        self.index['evictions'] += removed
+        return removed, freed
+
+    def evict(self, max_bytes=None):
+        """淘汰到 max_bytes（默认为缓存预算）以内，返回 (删除数量, 释放字节)"""
+        with self.transaction():
+            result = self._evict_locked(self.max_bytes if max_bytes is None else max_bytes)
+        return result
+
+
+def show_stats(cache):
+    """显示缓存统计"""
+    total = cache.total_bytes()
+    requests = cache.index['hits'] + cache.index['misses']
+    oldest = min((entry['last_access'] for entry in cache.entries.values()), default=None)
+
+    summary_table = Table(show_header=False, box=None)
+    summary_table.add_column("", style="bold")
+    summary_table.add_column("", style="")
+    summary_table.add_row("📦 缓存曲目", f"[bold cyan]{len(cache.entries)}[/bold cyan] 首")
+    summary_table.add_row("💾 占用 / 预算", f"[bold yellow]{total/(1024*1024):.1f}[/bold yellow] / "
+                                             f"{cache.max_bytes/(1024*1024):.1f} MB")
+    if requests:
+        summary_table.add_row("🎯 命中率", f"[bold green]{cache.index['hits'] / requests * 100:.1f}%[/bold green] "
+                                          f"({cache.index['hits']} / {requests})")
+    summary_table.add_row("🧹 累计淘汰", f"[bold red]{cache.index['evictions']}[/bold red] 首")
+    if oldest is not None:
+        summary_table.add_row("⏳ 最久未访问", f"[bold magenta]{(time.time() - oldest)/3600:.1f}[/bold magenta] 小时")
+    console.print(Panel(summary_table, title="💽 解密缓存统计", border_style="cyan"))
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="按需解密缓存（有容量上限，按最近访问淘汰）")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help=f"缓存目录 (默认: {DEFAULT_CACHE_DIR})")
+    parser.add_argument('--max-size', default=DEFAULT_MAX_SIZE, help=f"缓存总大小上限，如 5G / 500M (默认: {DEFAULT_MAX_SIZE})")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    get_parser = subparsers.add_parser('get', help="取得曲目的解密结果（需要时解密），输出文件路径")
+    get_parser.add_argument('names', nargs='+', help="曲目名（不含扩展名）")
+    subparsers.add_parser('stats', help="显示缓存统计")
+    evict_parser = subparsers.add_parser('evict', help="按最近访问时间淘汰到给定大小以内")
+    evict_parser.add_argument('--to', default=None, help="淘汰后的目标大小 (默认: --max-size)")
+    args = parser.parse_args()
+
+    cache = DecryptCache(args.cache_dir, parse_size(args.max_size))
+    if args.command == 'get':
+        for name in args.names:
+            try:
+                print(cache.get(name))
+            except (FileNotFoundError, ValueError) as e:
+                console.print(f"❌ {e}", style="red")
+    elif args.command == 'stats':
+        show_stats(cache)
+    elif args.command == 'evict':
+        removed, freed = cache.evict(parse_size(args.to) if args.to else None)
+        console.print(f"🧹 淘汰 [bold red]{removed}[/bold red] 首，释放 [bold green]{freed/(1024*1024):.1f}[/bold green] MB")
+
+
+if __name__ == "__main__":
+    main()
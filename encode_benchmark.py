@@ -0,0 +1,289 @@
+# This file is part of ncm_cracker.
+#
+# ncm_cracker is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ncm_cracker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ncm_cracker.  If not, see <https://www.gnu.org/licenses/>.
+"""
+📏 编码参数基准测试
+用同一批语料在 "参数组合 × 线程数 × 并发数" 矩阵下实测编码，用数据挑选预设：
+1. 语料 - 指定目录中的音频，或自动生成的合成音频
+2. 每个组合报告吞吐量（实时倍率）、输出大小、实际码率和码率模式 (CBR/VBR)
+3. 报告ffmpeg提示"未被使用"的参数 - 这些参数对编码没有任何作用
+
+用法：
+    python encode_benchmark.py
+    python encode_benchmark.py --corpus 02_decrypted --threads 1,2 --jobs 1,4
+    python encode_benchmark.py --flags "lame_q2=-compression_level 2" --repeat 3
+"""
+
+import argparse
+import asyncio
+import json
+import pathlib
+import re
+import shlex
+import shutil
+import subprocess
+import tempfile
+import time
+from rich.console import Console
+from rich.panel import Panel
+from rich.table import Table
+
+from audio_probe import find_mp3_frame, id3v2_size, parse_bitrate, probe_audio
+from compresser_ultra_fast import DEFAULT_PROFILE, OUTPUT_PROFILES, EncodeSlots, run_ffmpeg_async
+from cpu_budget import available_cpu_count
+from library_layout import iter_library_files
+
+console = Console()
+
+# 内置的参数组合：名称 -> 追加在 -b:a 之后的libmp3lame参数
+FLAG_SETS = {
+    'profile': None,  # 当前输出配置里的 extra_args
+    'cbr': [],
+    'cbr_fastest': ['-compression_level', '9'],
+    'cbr_level1': ['-compression_level', '1'],
+    'vbr_q4': ['-q:a', '4'],
+}
+
+SUPPORTED_FORMATS = ['.flac', '.mp3', '.wav', '.m4a', '.aac', '.ogg']
+
+# ffmpeg对未生效参数的提示，例如 "Codec AVOption preset (...) has not been used for any stream."
+_UNUSED_OPTION = re.compile(r"AVOption (\S+) .*has not been used")
+
+
+def parse_int_list(text):
+    """'1,2,4' -> [1, 2, 4]"""
+    return [int(item) for item in str(text).split(',') if item.strip()]
+
+
+def build_corpus(work_dir, count, duration):
+    """用ffmpeg生成合成语料：粉红噪声叠加和弦正弦波的双声道FLAC，接近真实音乐的编码负载"""
+    corpus = []
+    for index in range(count):
+        path = work_dir / f"synthetic_{index:02d}.flac"
+        base = 220 * (index + 1)
+        command = [
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-f', 'lavfi', '-i', f"anoisesrc=d={duration}:c=pink:a=0.2:seed={index + 1}",
+            '-f', 'lavfi', '-i', f"sine=f={base}:d={duration}",
+            '-f', 'lavfi', '-i', f"sine=f={base * 5 // 4}:d={duration}",
+            '-filter_complex', "[0][1][2]amix=inputs=3,aformat=channel_layouts=stereo",
+            '-ar', '44100', '-c:a', 'flac',
+            str(path)
+        ]
+        subprocess.run(command, check=True, capture_output=True)
+        corpus.append(path)
+    return corpus
+
+
+def load_corpus(corpus_dir):
+    """读取指定目录中的音频文件"""
+    return sorted(f for f in iter_library_files(corpus_dir) if f.suffix.lower() in SUPPORTED_FORMATS)
+
+
+def bitrate_mode(path):
+    """根据首帧的Xing/Info标签判断码率模式：Xing为VBR，Info为CBR"""
+    with open(path, 'rb') as f:
+        data = f.read(64 * 1024)
+    position, header = find_mp3_frame(data, id3v2_size(data))
+    if header is None:
+        return '?'
+    side_info = (17 if header['channels'] == 1 else 32) if header['is_mpeg1'] else (9 if header['channels'] == 1 else 17)
+    tag = data[position + 4 + side_info:position + 8 + side_info]
+    return {b'Xing': 'VBR', b'Info': 'CBR'}.get(tag, 'CBR')
+
+
+def build_encode_command(input_file, output_file, profile, flags, threads):
+    """构建一条基准测试用的编码命令：码率和采样率来自输出配置，其余参数来自参数组合"""
+    return [
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-i', str(input_file),
+        '-map', '0:a',
+        '-c:a', profile['codec'],
+        '-b:a', profile['bitrate'],
+        '-ar', str(profile['sample_rate']),
+        '-threads', str(threads),
+        *flags,
+        '-f', profile['extension'],
+        str(output_file)
+    ]
+
+
+def unused_options(input_file, profile, flags):
+    """用warning日志级别编码一次，收集ffmpeg报告为未使用的参数"""
+    command = build_encode_command(input_file, '-', profile, flags, 1)
+    command[command.index('error')] = 'warning'
+    command[-1:] = ['-t', '1', 'pipe:1']
+    result = subprocess.run(command, capture_output=True, text=True, errors='replace')
+    return sorted(set(_UNUSED_OPTION.findall(result.stderr)))
+
+
+async def run_combination(corpus, out_dir, profile, flags, threads, jobs):
+    """在给定并发数下编码整个语料，返回墙钟耗时"""
+    slots = EncodeSlots(jobs)
+
+    async def encode(index, input_file):
+        output_file = out_dir / f"{index:03d}.{profile['extension']}"
+        command = build_encode_command(input_file, output_file, profile, flags, threads)
+        async with slots.acquire():
+            await run_ffmpeg_async(command, [output_file])
+        return output_file
+
+    start_time = time.time()
+    outputs = await asyncio.gather(*(encode(index, f) for index, f in enumerate(corpus)))
+    return time.time() - start_time, outputs
+
+
+def benchmark(corpus, flag_sets, thread_counts, job_counts, profile_name=DEFAULT_PROFILE, repeat=1):
+    """跑完整个矩阵，返回每个组合的结果字典列表"""
+    profile = OUTPUT_PROFILES[profile_name]
+    audio_seconds = sum((probe_audio(f) or {}).get('duration') or 0 for f in corpus)
+    results = []
+
+    with tempfile.TemporaryDirectory(prefix='.benchmark_', dir='.') as temp:
+        out_dir = pathlib.Path(temp)
+        for name, flags in flag_sets.items():
+            unused = unused_options(corpus[0], profile, flags)
+            for threads in thread_counts:
+                for jobs in job_counts:
+                    # 多次运行取最快的一次，减少系统噪声
+                    elapsed = None
+                    for _ in range(repeat):
+                        run_time, outputs = asyncio.run(run_combination(corpus, out_dir, profile, flags, threads, jobs))
+                        elapsed = run_time if elapsed is None else min(elapsed, run_time)
+                    output_size = sum(f.stat().st_size for f in outputs)
+                    results.append({
+                        'flags': name,
+                        'args': ' '.join(flags),
+                        'threads': threads,
+                        'jobs': jobs,
+                        'elapsed': elapsed,
+                        'realtime_factor': audio_seconds / elapsed if elapsed > 0 else 0,
+                        'output_size': output_size,
+                        'bitrate': output_size * 8 / audio_seconds if audio_seconds else 0,
+                        'mode': bitrate_mode(outputs[0]) if profile['extension'] == 'mp3' else '-',
+                        'unused': unused,
+                    })
+                    console.print(f"  ✅ {name} × {threads}线程 × {jobs}并发: {elapsed:.2f} 秒")
+    return results, audio_seconds
+
+
+def show_results(results, audio_seconds, target_bitrate):
+    """显示基准测试结果表"""
+    best = max(results, key=lambda r: r['realtime_factor'])
+
+    table = Table(title="📏 编码参数基准测试结果")
+    table.add_column("参数组合", style="cyan")
+    table.add_column("线程", justify="right")
+    table.add_column("并发", justify="right")
+    table.add_column("耗时", justify="right", style="yellow")
+    table.add_column("实时倍率", justify="right", style="red")
+    table.add_column("输出大小", justify="right", style="green")
+    table.add_column("实际码率", justify="right", style="blue")
+    table.add_column("模式", justify="center")
+    table.add_column("未生效参数", style="magenta", overflow="fold")
+
+    for result in results:
+        bitrate_style = "bold red" if abs(result['bitrate'] - target_bitrate) > target_bitrate * 0.1 else "blue"
+        marker = " 🏆" if result is best else ""
+        table.add_row(
+            result['flags'] + marker,
+            str(result['threads']),
+            str(result['jobs']),
+            f"{result['elapsed']:.2f}s",
+            f"{result['realtime_factor']:.1f}x",
+            f"{result['output_size']/(1024*1024):.2f} MB",
+            f"[{bitrate_style}]{result['bitrate']/1000:.0f} kbps[/{bitrate_style}]",
+            result['mode'],
+            ', '.join(result['unused']) or "-"
+        )
+    console.print(table)
+
+    legend = {result['flags']: result['args'] for result in results}
+    for name, flags in legend.items():
+        console.print(f"  [cyan]{name}[/cyan]: {flags or '(仅 -b:a)'}")
+
+    summary_table = Table(show_header=False, box=None)
+    summary_table.add_column("", style="bold")
+    summary_table.add_column("", style="")
+    summary_table.add_row("🎧 语料时长", f"[bold magenta]{audio_seconds/60:.1f}[/bold magenta] 分钟")
+    summary_table.add_row("🏆 最快组合", f"[bold red]{best['flags']}[/bold red] × {best['threads']}线程 × {best['jobs']}并发 "
+                                         f"({best['realtime_factor']:.1f}x)")
+    summary_table.add_row("🎯 目标码率", f"[bold blue]{target_bitrate/1000:.0f}[/bold blue] kbps (偏离超过10%标红)")
+    console.print(Panel(summary_table, title="📊 基准测试统计", border_style="cyan"))
+
+
+def parse_args():
+    """解析命令行参数"""
+    cpus = available_cpu_count()
+    parser = argparse.ArgumentParser(description="编码参数基准测试")
+    parser.add_argument('--corpus', default=None, help="语料目录 (默认: 生成合成语料)")
+    parser.add_argument('--synthetic', type=int, default=4, help="合成语料的文件数 (默认: 4)")
+    parser.add_argument('--duration', type=int, default=60, help="每个合成文件的秒数 (默认: 60)")
+    parser.add_argument('--profile', default=DEFAULT_PROFILE, help=f"输出配置 (可选: {', '.join(OUTPUT_PROFILES)})")
+    parser.add_argument('--sets', default=','.join(FLAG_SETS), help="逗号分隔的内置参数组合")
+    parser.add_argument('--flags', action='append', default=[],
+                        help="自定义参数组合，格式 名称=\"参数\"，可重复")
+    parser.add_argument('--threads', default='1', help="逗号分隔的每任务线程数 (默认: 1)")
+    parser.add_argument('--jobs', default=f"1,{cpus}" if cpus > 1 else "1", help="逗号分隔的并发数 (默认: 1 和可用核心数)")
+    parser.add_argument('--repeat', type=int, default=1, help="每个组合重复次数，取最快一次 (默认: 1)")
+    parser.add_argument('--json', default=None, help="把结果另存为JSON文件")
+    return parser.parse_args()
+
+
+def main():
+    """命令行入口"""
+    args = parse_args()
+    if args.profile not in OUTPUT_PROFILES:
+        console.print(f"❌ 未知的输出配置: {args.profile}", style="red")
+        return
+    if shutil.which('ffmpeg') is None:
+        console.print("❌ 没有找到ffmpeg", style="red")
+        return
+    profile = OUTPUT_PROFILES[args.profile]
+
+    flag_sets = {}
+    for name in (item.strip() for item in args.sets.split(',') if item.strip()):
+        if name not in FLAG_SETS:
+            console.print(f"❌ 未知的参数组合: {name}", style="red")
+            return
+        flag_sets[name] = list(profile['extra_args']) if FLAG_SETS[name] is None else FLAG_SETS[name]
+    for item in args.flags:
+        name, _, flags = item.partition('=')
+        flag_sets[name.strip()] = shlex.split(flags)
+
+    console.print(Panel.fit("📏 编码参数基准测试", style="bold cyan"))
+    with tempfile.TemporaryDirectory(prefix='.corpus_', dir='.') as temp:
+        if args.corpus:
+            corpus = load_corpus(args.corpus)
+        else:
+            console.print(f"🎼 生成合成语料: {args.synthetic} 个 × {args.duration} 秒")
+            corpus = build_corpus(pathlib.Path(temp), args.synthetic, args.duration)
+        if not corpus:
+            console.print("❌ 语料目录中没有音频文件", style="red")
+            return
+
+        console.print(f"📁 语料: [bold cyan]{len(corpus)}[/bold cyan] 个文件  "
+                      f"组合: [bold cyan]{len(flag_sets)}[/bold cyan] 组参数 × {args.threads} 线程 × {args.jobs} 并发\n")
+        results, audio_seconds = benchmark(corpus, flag_sets, parse_int_list(args.threads),
+                                           parse_int_list(args.jobs), args.profile, args.repeat)
+
+    show_results(results, audio_seconds, parse_bitrate(profile['bitrate']))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        console.print(f"💾 结果已保存到 [bold blue]{args.json}[/bold blue]")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+# This file is part of ncm_cracker.
+#
+# ncm_cracker is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ncm_cracker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ncm_cracker.  If not, see <https://www.gnu.org/licenses/>.
+"""
+🗃️ 编码结果缓存
+以 "输入内容指纹 + 完整编码参数哈希" 为键的内容寻址缓存：
+1. 改码率 / 采样率 / ffmpeg版本 - 键变化，自动重新编码
+2. 文件改名 - 内容指纹不变，直接硬链接已有结果，不启动ffmpeg
+3. 指纹按 (大小, 修改时间, inode) 记忆，未变化的文件不重复读取
+4. 支持按最久未使用时间和总大小淘汰
+
+缓存对象与 03_compressed 中的输出是同一个文件的硬链接：输出还在时淘汰对象不释放磁盘空间，
+所以总大小预算只统计缓存独占（链接数为1）的对象，淘汰结果报告实际释放的字节。
+也因为是硬链接，不要原地修改 03_compressed 中的文件（如直接改写标签），那会同时改坏缓存对象；
+需要修改时先复制出新文件再替换。
+
+用法：
+    python encode_cache.py stats
+    python encode_cache.py evict --max-age-days 30 --max-size 20G
+"""
+
+import argparse
+import functools
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import subprocess
+import time
+from rich.console import Console
+from rich.panel import Panel
+from rich.table import Table
+
+console = Console()
+
+DEFAULT_CACHE_DIR = ".encode_cache"
+
+# 计算指纹时每次读取的块大小
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+@functools.lru_cache(maxsize=1)
+def ffmpeg_version():
+    """ffmpeg版本字符串（-version 的第一行），作为编码参数的一部分"""
+    try:
+        result = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True, check=True)
+        return result.stdout.splitlines()[0].strip()
+    except (OSError, subprocess.CalledProcessError, IndexError):
+        return 'unknown'
+
+
+def parse_size(text):
+    """把 '20G' / '500M' / '1048576' 这样的大小字符串转换为字节数"""
+    text = str(text).strip().upper().rstrip('B')
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(float(text))
+
+
+def params_digest(params):
+    """编码参数的稳定哈希"""
+    payload = json.dumps(params, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class EncodeCache:
+    def __init__(self, root=DEFAULT_CACHE_DIR):
+        self.root = pathlib.Path(root)
+        self.objects = self.root / "objects"
+        self.index_path = self.root / "index.json"
+        self.objects.mkdir(parents=True, exist_ok=True)
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                self.index = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.index = {}
+        self.index.setdefault('fingerprints', {})
+
+    def save(self):
+        """原子地保存索引"""
+        temp_path = self.index_path.with_suffix('.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.index, f, ensure_ascii=False)
+        os.replace(temp_path, self.index_path)
+
+    def fingerprint(self, path):
+        """输入文件的内容指纹 (BLAKE2b)，按 (大小, 修改时间, inode) 记忆"""
+        path = pathlib.Path(path)
+        stat = path.stat()
+        stamp = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+        memo = self.index['fingerprints'].get(str(path))
+        if memo and memo[:3] == stamp:
+            return memo[3]
+
+        digest = hashlib.blake2b(digest_size=20)
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(HASH_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+        fingerprint = digest.hexdigest()
+        self.index['fingerprints'][str(path)] = stamp + [fingerprint]
+        return fingerprint
+
+    def key(self, fingerprint, params):
+        """缓存键 = 内容指纹 + 编码参数哈希（参数中自动加入ffmpeg版本）"""
+        params = dict(params, ffmpeg=ffmpeg_version())
+        return f"{fingerprint}-{params_digest(params)[:24]}"
+
+    def object_path(self, key, extension):
+        """缓存对象的路径，按键前两位分目录"""
+        return self.objects / key[:2] / f"{key}.{extension}"
+
+    def lookup(self, key, extension):
+        """查找缓存对象，命中时刷新其最近使用时间"""
+        path = self.object_path(key, extension)
+        if not path.exists():
+            return None
+        os.utime(path)
+        return path
+
+    def store(self, key, extension, produced_file):
+        """把刚编码出的文件收入缓存（优先硬链接，跨设备时复制）"""
+        path = self.object_path(key, extension)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(path.name + '.tmp')
+        temp_path.unlink(missing_ok=True)
+        try:
+            os.link(produced_file, temp_path)
+        except OSError:
+            shutil.copyfile(produced_file, temp_path)
+        os.replace(temp_path, path)
+        return path
+
+    def materialize(self, cached_path, destination):
+        """把缓存对象放到输出位置（优先硬链接，与缓存对象共享数据）；已经是同一个文件时什么都不做"""
+        destination = pathlib.Path(destination)
+        if destination.exists() and os.path.samefile(cached_path, destination):
+            return False
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = destination.with_name(destination.name + '.tmp')
+        temp_path.unlink(missing_ok=True)
+        try:
+            os.link(cached_path, temp_path)
+        except OSError:
+            shutil.copyfile(cached_path, temp_path)
+        os.replace(temp_path, destination)
+        return True
+
+    def entries(self):
+        """列出所有缓存对象 [(路径, 大小, 最近使用时间, 是否与输出共享), ...]
+
+        链接数大于1的对象与 03_compressed 中的输出共享数据，删除它不释放空间
+        """
+        result = []
+        for path in self.objects.glob('*/*'):
+            if path.name.endswith('.tmp'):
+                continue
+            stat = path.stat()
+            result.append((path, stat.st_size, stat.st_mtime, stat.st_nlink > 1))
+        return result
+
+    def evict(self, max_age_days=None, max_bytes=None):
+        """淘汰超龄对象，再按最久未使用淘汰到总大小以内，返回 (删除数量, 实际释放字节)
+
+        总大小只统计缓存独占的对象；与输出共享的对象不占额外空间，不为满足预算而淘汰
+        """
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        removed = 0
+        freed = 0
+        now = time.time()
+
+        kept = []
+        for path, size, last_used, shared in entries:
+            if max_age_days is not None and now - last_used > max_age_days * 86400:
+                path.unlink(missing_ok=True)
+                removed += 1
+                if not shared:
+                    freed += size
+            elif not shared:
+                kept.append((path, size))
+
+        if max_bytes is not None:
+            total = sum(size for _, size in kept)
+            for path, size in kept:
+                if total <= max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+                removed += 1
+                freed += size
+
+        # 清理已不存在的输入文件的指纹记忆
+        self.index['fingerprints'] = {
+            path: memo for path, memo in self.index['fingerprints'].items() if os.path.exists(path)
+        }
+        self.save()
+        return removed, freed
+
+
+def show_stats(cache):
+    """显示缓存统计"""
+    entries = cache.entries()
+    own = sum(size for _, size, _, shared in entries if not shared)
+    shared = sum(size for _, size, _, shared in entries if shared)
+    oldest = min((last_used for _, _, last_used, _ in entries), default=None)
+
+    summary_table = Table(show_header=False, box=None)
+    summary_table.add_column("", style="bold")
+    summary_table.add_column("", style="")
+    summary_table.add_row("📦 缓存对象", f"[bold cyan]{len(entries)}[/bold cyan] 个")
+    summary_table.add_row("💾 独占空间", f"[bold yellow]{own/(1024*1024):.1f}[/bold yellow] MB")
+    summary_table.add_row("🔗 与输出共享", f"[bold green]{shared/(1024*1024):.1f}[/bold green] MB (不占额外空间)")
+    if oldest is not None:
+        summary_table.add_row("⏳ 最久未使用", f"[bold magenta]{(time.time() - oldest)/86400:.1f}[/bold magenta] 天")
+    summary_table.add_row("🔍 指纹记忆", f"[bold blue]{len(cache.index['fingerprints'])}[/bold blue] 个文件")
+    console.print(Panel(summary_table, title="🗃️ 编码缓存统计", border_style="cyan"))
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="编码结果缓存管理")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help="缓存目录 (默认: .encode_cache)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('stats', help="显示缓存统计")
+    evict_parser = subparsers.add_parser('evict', help="按时间和大小淘汰缓存")
+    evict_parser.add_argument('--max-age-days', type=float, default=None, help="淘汰超过该天数未使用的对象")
+    evict_parser.add_argument('--max-size', default=None, help="缓存独占空间上限（不含与输出共享的对象），如 20G / 500M")
+    args = parser.parse_args()
+
+    cache = EncodeCache(args.cache_dir)
+    if args.command == 'stats':
+        show_stats(cache)
+    elif args.command == 'evict':
+        max_bytes = parse_size(args.max_size) if args.max_size else None
+        removed, freed = cache.evict(args.max_age_days, max_bytes)
+        console.print(f"🧹 淘汰 [bold red]{removed}[/bold red] 个对象，释放 [bold green]{freed/(1024*1024):.1f}[/bold green] MB")
+
+
+if __name__ == "__main__":
+    main()
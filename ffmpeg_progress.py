@@ -0,0 +1,220 @@
+# This file is part of ncm_cracker.
+#
+# ncm_cracker is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ncm_cracker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ncm_cracker.  If not, see <https://www.gnu.org/licenses/>.
+"""
+⏱️ ffmpeg 实时进度
+解析 ffmpeg -progress pipe:1 输出的 key=value 块，按音频时长衡量编码速度：
+1. 实时倍率 - 每秒墙钟时间编码了多少秒音频，与输入格式和文件大小无关
+2. 单文件预计剩余时间
+3. 停滞检测 - 输出时间长时间不前进的任务会被标出
+"""
+
+import asyncio
+import contextlib
+import time
+
+# 输出时间超过该秒数不前进即视为停滞
+STALL_SECONDS = 15
+
+# 刷新进度显示的间隔（秒）
+REFRESH_INTERVAL = 0.5
+
+
+def progress_args():
+    """让ffmpeg把机器可读的进度写到stdout，并关闭stderr上的人类可读统计"""
+    return ['-progress', 'pipe:1', '-nostats']
+
+
+def parse_out_time(block):
+    """从进度块中取出已编码的音频时间（秒），还没有数据时返回None"""
+    for key in ('out_time_us', 'out_time_ms'):
+        # 历史原因 out_time_ms 的单位其实也是微秒
+        try:
+            return max(0, int(block[key])) / 1_000_000
+        except (KeyError, ValueError):
+            continue
+    return None
+
+
+def parse_speed(text):
+    """把 '85.3x' 转换为浮点数，'N/A' 等无效值返回None"""
+    try:
+        return float(str(text).strip().rstrip('x'))
+    except ValueError:
+        return None
+
+
+async def read_progress(stream, on_block):
+    """逐行读取 -progress 输出，每遇到 progress=continue/end 就回调一次完整的块"""
+    block = {}
+    while True:
+        line = await stream.readline()
+        if not line:
+            return
+        key, _, value = line.decode('utf-8', errors='replace').strip().partition('=')
+        if not key:
+            continue
+        block[key] = value
+        if key == 'progress':
+            on_block(block)
+            block = {}
+
+
+def format_eta(seconds):
+    """把秒数格式化为 m:ss / h:mm:ss"""
+    seconds = int(max(0, seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+
+class JobProgress:
+    """一个输入文件的编码进度；分段编码等多个ffmpeg进程按 part 分别累计"""
+
+    def __init__(self, name, total_seconds=None):
+        self.name = name
+        self.total_seconds = total_seconds or None
+        self.start_time = None
+        self.last_advance = None
+        self.parts = {}
+        self.speed = None
+        self.stalled = False
+        self.running = 0
+        self.task_id = None
+        # 第一个ffmpeg进程启动时调用（ProgressBoard在这时才添加进度行）
+        self.on_first_begin = None
+
+    @property
+    def done_seconds(self):
+        return sum(self.parts.values())
+
+    def begin(self):
+        """一个ffmpeg进程启动；第一个进程启动时开始计时，排队等待槽位的时间不计入"""
+        now = time.monotonic()
+        if self.start_time is None:
+            self.start_time = now
+            if self.on_first_begin is not None:
+                self.on_first_begin(self)
+        if self.running == 0:
+            # 分段之间可能要等槽位，重新开始计算停滞时间
+            self.last_advance = now
+        self.running += 1
+
+    def end(self):
+        self.running -= 1
+
+    def update(self, block, part=0):
+        """处理一个进度块"""
+        out_time = parse_out_time(block)
+        if out_time is not None and out_time > self.parts.get(part, 0):
+            self.parts[part] = out_time
+            self.last_advance = time.monotonic()
+            self.stalled = False
+        speed = parse_speed(block.get('speed', ''))
+        if speed:
+            self.speed = speed
+
+    def realtime_factor(self, now=None):
+        """实时倍率：已编码音频秒数 / 墙钟秒数"""
+        if self.start_time is None:
+            return 0
+        elapsed = (now or time.monotonic()) - self.start_time
+        return self.done_seconds / elapsed if elapsed > 0 else 0
+
+    def eta(self, now=None):
+        """预计剩余秒数，总时长未知或尚无进度时返回None"""
+        rate = self.realtime_factor(now)
+        if not self.total_seconds or rate <= 0:
+            return None
+        return max(0, self.total_seconds - self.done_seconds) / rate
+
+    def elapsed(self, now=None):
+        return (now or time.monotonic()) - self.start_time if self.start_time is not None else 0
+
+    def stall_seconds(self, now=None):
+        return (now or time.monotonic()) - self.last_advance if self.last_advance is not None else 0
+
+
+@contextlib.contextmanager
+def track_part(job, part):
+    """在一个ffmpeg进程运行期间登记到job，产出传给 run_ffmpeg_async 的进度回调（job为None时产出None）"""
+    if job is None:
+        yield None
+        return
+    job.begin()
+    try:
+        yield lambda block: job.update(block, part)
+    finally:
+        job.end()
+
+
+class ProgressBoard:
+    """汇总所有编码任务的进度：驱动rich进度条，并累计整批运行的实时倍率与停滞次数"""
+
+    def __init__(self, progress=None):
+        self.progress = progress
+        self.active = []
+        self.audio_seconds = 0
+        self.encode_seconds = 0
+        self.stalls = 0
+        self.stalled_files = []
+
+    def start(self, name, total_seconds=None):
+        """登记一个要编码的文件；进度行等第一个ffmpeg进程拿到槽位启动时才添加，排队的文件不占屏幕"""
+        job = JobProgress(name, total_seconds)
+        if self.progress is not None:
+            job.on_first_begin = self._show
+        self.active.append(job)
+        return job
+
+    def _show(self, job):
+        job.task_id = self.progress.add_task(f"🎵 {job.name}", total=job.total_seconds)
+
+    def finish(self, job):
+        """文件编码结束，计入整批统计"""
+        if job in self.active:
+            self.active.remove(job)
+        self.audio_seconds += job.done_seconds
+        self.encode_seconds += job.elapsed()
+        if job.task_id is not None:
+            self.progress.remove_task(job.task_id)
+
+    def refresh(self):
+        """刷新每个进行中任务的进度行，并检测停滞"""
+        now = time.monotonic()
+        for job in self.active:
+            stall = job.stall_seconds(now)
+            if job.running and stall > STALL_SECONDS and not job.stalled:
+                job.stalled = True
+                self.stalls += 1
+                self.stalled_files.append(job.name)
+            if job.task_id is None:
+                continue
+            if job.stalled and job.running:
+                status = f"[bold red]⚠️ 停滞 {stall:.0f}s[/bold red]"
+            else:
+                eta = job.eta(now)
+                status = f"[cyan]{job.realtime_factor(now):.1f}x[/cyan]"
+                if eta is not None:
+                    status += f" 剩余 {format_eta(eta)}"
+            self.progress.update(job.task_id, completed=job.done_seconds,
+                                 description=f"🎵 {job.name[:24]} {status}")
+
+    async def watch(self, interval=REFRESH_INTERVAL):
+        """周期性刷新，直到被取消"""
+        while True:
+            self.refresh()
+            await asyncio.sleep(interval)
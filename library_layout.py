@@ -0,0 +1,312 @@
+# This file is part of ncm_cracker.
+#
+# ncm_cracker is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ncm_cracker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ncm_cracker.  If not, see <https://www.gnu.org/licenses/>.
+"""
+🗄️ 曲库目录布局
+01_original / 02_decrypted / 03_compressed 默认是平铺目录；曲库很大时（十万级以上）可以切换到分片布局：
+1. 分片布局 - `02_decrypted/ab/cd/曲目名.flac`，分片由曲目名的哈希决定，同一首曲目在三个目录中落在同一个分片
+2. 布局写在项目根目录的 .library_layout.json 中，各阶段按它读写，不需要额外参数
+3. 列目录时同时看根目录和分片目录，迁移到一半（或中断）时新旧位置的文件都能找到
+4. 迁移命令原地移动已有文件（同一文件系统上只改目录项，不复制数据），可以重复运行，也可以改回平铺
+
+用法：
+    python library_layout.py migrate --depth 2
+    python library_layout.py migrate --depth 0   # 改回平铺
+    python library_layout.py status
+"""
+
+import argparse
+import functools
+import hashlib
+import json
+import os
+import pathlib
+import string
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from rich.console import Console
+from rich.panel import Panel
+from rich.progress import Progress, SpinnerColumn, TimeElapsedColumn, BarColumn, TaskProgressColumn, TextColumn
+from rich.table import Table
+
+console = Console()
+
+LAYOUT_FILE = ".library_layout.json"
+
+# 每级分片目录名的十六进制位数：两位即每级256个目录
+SHARD_WIDTH = 2
+DEFAULT_DEPTH = 2
+
+LIBRARY_DIRS = ("01_original", "02_decrypted", "03_compressed")
+
+# 按曲目分片的文件类型；压缩包等其他文件留在原处
+TRACK_SUFFIXES = ('.ncm', '.flac', '.mp3', '.wav', '.m4a', '.aac', '.ogg', '.opus', '.wma')
+
+# 与输出文件放在一起的中间文件后缀（解密的 .part 和检查点），分片时按所属的输出文件计算
+_AUX_SUFFIXES = ('.tmp', '.ckpt', '.part')
+
+_HEX_DIGITS = set(string.hexdigits.lower())
+
+
+def _strip_aux(filename):
+    """去掉中间文件后缀：x.flac.part.ckpt -> x.flac"""
+    name = pathlib.PurePath(filename).name
+    for suffix in _AUX_SUFFIXES:
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return name
+
+
+def track_key(filename):
+    """文件名 -> 分片用的曲目名：去掉中间文件后缀和扩展名"""
+    return os.path.splitext(_strip_aux(filename))[0]
+
+
+def is_track_file(filename):
+    """曲目文件（包括它的中间文件）才按布局分片"""
+    return os.path.splitext(_strip_aux(filename))[1].lower() in TRACK_SUFFIXES
+
+
+def is_shard_dir(name):
+    return len(name) == SHARD_WIDTH and set(name) <= _HEX_DIGITS
+
+
+class LibraryLayout:
+    """曲目名到存放位置的映射；depth 为0时是平铺目录"""
+
+    def __init__(self, depth=0):
+        self.depth = int(depth)
+
+    @property
+    def sharded(self):
+        return self.depth > 0
+
+    def shard(self, name):
+        """曲目名 -> 分片相对目录（平铺时为空字符串）；只与曲目名有关，不随曲库变化"""
+        if not self.sharded:
+            return ''
+        digest = hashlib.blake2b(name.encode('utf-8'), digest_size=8).hexdigest()
+        return '/'.join(digest[level * SHARD_WIDTH:(level + 1) * SHARD_WIDTH] for level in range(self.depth))
+
+    def relative(self, filename):
+        """文件在曲库目录中的相对路径"""
+        shard = self.shard(track_key(filename))
+        return pathlib.PurePath(shard, filename) if shard else pathlib.PurePath(filename)
+
+    def path(self, directory, filename):
+        """文件在该布局下的位置（不创建目录）"""
+        return pathlib.Path(directory) / self.relative(filename)
+
+    def output_path(self, directory, filename):
+        """写出文件用的位置，需要时创建分片目录"""
+        path = self.path(directory, filename)
+        if self.sharded:
+            path.parent.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def locate(self, directory, filename):
+        """查找已有文件：先看布局中的位置，再看平铺位置（迁移前的旧文件）；都不存在时返回布局中的位置"""
+        path = self.path(directory, filename)
+        if self.sharded and not path.exists():
+            flat_path = pathlib.Path(directory) / filename
+            if flat_path.exists():
+                return flat_path
+        return path
+
+    def to_dict(self):
+        return {'depth': self.depth, 'width': SHARD_WIDTH}
+
+
+def iter_library_files(directory, suffixes=None):
+    """列出曲库目录中的文件（根目录和各级分片目录），suffixes 为小写扩展名集合
+
+    只进入名字像分片的子目录，03_compressed 中的版本子目录不算；
+
+    不论当前布局如何都会看根目录和分片目录，布局切换到一半时也不会漏掉文件
+    """
+    pending = [pathlib.Path(directory)]
+    while pending:
+        folder = pending.pop()
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if is_shard_dir(entry.name):
+                            pending.append(pathlib.Path(entry.path))
+                    elif suffixes is None or os.path.splitext(entry.name)[1].lower() in suffixes:
+                        yield pathlib.Path(entry.path)
+        except FileNotFoundError:
+            continue
+
+
+@functools.lru_cache(maxsize=None)
+def _load_layout(layout_path):
+    try:
+        with open(layout_path, 'r', encoding='utf-8') as f:
+            return LibraryLayout(json.load(f).get('depth', 0))
+    except (OSError, ValueError, AttributeError):
+        return LibraryLayout()
+
+
+def load_layout(root='.'):
+    """读取项目的目录布局（每个进程只读一次），没有配置时为平铺"""
+    return _load_layout(os.path.abspath(os.path.join(root, LAYOUT_FILE)))
+
+
+def save_layout(layout, root='.'):
+    layout_path = pathlib.Path(root) / LAYOUT_FILE
+    temp_path = layout_path.with_name(f"{layout_path.name}.{os.getpid()}.tmp")
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(layout.to_dict(), f)
+    os.replace(temp_path, layout_path)
+    _load_layout.cache_clear()
+
+
+def library_folders(root='.'):
+    """需要按布局整理的目录：三个曲库目录，以及 03_compressed 中各输出版本的子目录"""
+    root = pathlib.Path(root)
+    folders = [root / name for name in LIBRARY_DIRS]
+    compressed_dir = root / "03_compressed"
+    if compressed_dir.exists():
+        with os.scandir(compressed_dir) as entries:
+            folders += sorted(pathlib.Path(entry.path) for entry in entries
+                              if entry.is_dir(follow_symlinks=False) and not is_shard_dir(entry.name))
+    return [folder for folder in folders if folder.exists()]
+
+
+def remove_empty_shards(directory):
+    """自底向上删除空的分片目录，返回删除的数量"""
+    removed = 0
+    for dirpath, dirnames, filenames in os.walk(directory, topdown=False):
+        path = pathlib.Path(dirpath)
+        if path == pathlib.Path(directory) or not all(is_shard_dir(part) for part in path.relative_to(directory).parts):
+            continue
+        try:
+            os.rmdir(path)
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+def migrate(layout, root='.', max_workers=16):
+    """把已有文件原地移动到新布局；返回 {'moved', 'unchanged', 'conflicts', 'failed', 'removed_dirs'}
+
+    先写入新布局再移动文件：迁移期间各阶段新写的文件直接落在新位置，旧位置的文件仍能被列出和找到
+    """
+    from project_manager import move_same_device
+
+    save_layout(layout, root)
+    moves = []
+    counts = {'moved': 0, 'unchanged': 0, 'conflicts': 0, 'failed': 0, 'removed_dirs': 0}
+    for folder in library_folders(root):
+        for path in iter_library_files(folder):
+            if not is_track_file(path.name):
+                continue
+            target = layout.path(folder, path.name)
+            if target == path:
+                counts['unchanged'] += 1
+            else:
+                moves.append((path, target))
+
+    def move_one(item):
+        source, target = item
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if move_same_device(source, target):
+            return True
+        # 上次迁移在建好硬链接、删除源文件之前中断：目标就是同一个文件，删掉旧位置即可完成移动
+        if os.path.samefile(source, target):
+            os.unlink(source)
+            return True
+        return False
+
+    with Progress(
+        SpinnerColumn(),
+        TextColumn("[progress.description]{task.description}"),
+        BarColumn(),
+        TaskProgressColumn(),
+        TimeElapsedColumn(),
+        console=console,
+        transient=False
+    ) as progress:
+        task = progress.add_task("🗄️ 迁移文件", total=len(moves))
+        # 网络文件系统上每次改名都要等一个往返，用线程池让多个元数据操作同时进行
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(move_one, item) for item in moves]
+            for future in as_completed(futures):
+                try:
+                    counts['moved' if future.result() else 'conflicts'] += 1
+                except OSError:
+                    counts['failed'] += 1
+                progress.advance(task)
+
+    for folder in library_folders(root):
+        counts['removed_dirs'] += remove_empty_shards(folder)
+    return counts
+
+
+def show_status(root='.'):
+    layout = load_layout(root)
+    status_table = Table(title="🗄️ 曲库目录布局")
+    status_table.add_column("目录", style="cyan")
+    status_table.add_column("根目录文件", justify="right")
+    status_table.add_column("分片中文件", justify="right")
+    status_table.add_column("不在布局位置", justify="right", style="yellow")
+    for folder in library_folders(root):
+        top = sharded = misplaced = 0
+        for path in iter_library_files(folder):
+            if not is_track_file(path.name):
+                continue
+            if path.parent == folder:
+                top += 1
+            else:
+                sharded += 1
+            if layout.path(folder, path.name) != path:
+                misplaced += 1
+        status_table.add_row(str(folder.relative_to(root)), str(top), str(sharded), str(misplaced))
+    description = (f"分片 (深度 {layout.depth}，每级 {16 ** SHARD_WIDTH} 个目录)" if layout.sharded else "平铺")
+    console.print(Panel.fit(f"📐 当前布局: [bold cyan]{description}[/bold cyan]", border_style="cyan"))
+    console.print(status_table)
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="曲库目录布局（平铺 / 按哈希分片）")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = subparsers.add_parser('migrate', help="切换布局并原地移动已有文件")
+    migrate_parser.add_argument('--depth', type=int, default=DEFAULT_DEPTH,
+                                help=f"分片层数，0 为平铺 (默认: {DEFAULT_DEPTH})")
+    migrate_parser.add_argument('--workers', type=int, default=16, help="并行移动的线程数 (默认: 16)")
+    subparsers.add_parser('status', help="显示当前布局和各目录的文件分布")
+    args = parser.parse_args()
+
+    if args.command == 'migrate':
+        if args.depth < 0:
+            console.print("❌ 分片层数不能为负数", style="bold red")
+            return
+        counts = migrate(LibraryLayout(args.depth), max_workers=args.workers)
+        summary_table = Table(show_header=False, box=None)
+        summary_table.add_column("", style="bold")
+        summary_table.add_column("", style="")
+        summary_table.add_row("🚚 已移动", f"[bold green]{counts['moved']}[/bold green] 个文件")
+        summary_table.add_row("✅ 无需移动", f"{counts['unchanged']} 个文件")
+        summary_table.add_row("⏭️  目标已存在", f"[bold yellow]{counts['conflicts']}[/bold yellow] 个文件")
+        summary_table.add_row("❌ 失败", f"[bold red]{counts['failed']}[/bold red] 个文件")
+        summary_table.add_row("🗑️  删除空目录", f"{counts['removed_dirs']} 个")
+        console.print(Panel(summary_table, title="🗄️ 布局迁移完成", border_style="green"))
+    elif args.command == 'status':
+        show_status()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+# This file is part of ncm_cracker.
+#
+# ncm_cracker is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ncm_cracker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ncm_cracker.  If not, see <https://www.gnu.org/licenses/>.
+"""
+🔊 响度分析与 ReplayGain
+压缩时在同一个ffmpeg进程里多接一路 ebur128 分析，不再为算响度把成品重新解码一遍：
+1. 解码后的音频用 asplit 分出一路送给 ebur128（只算采样峰值，不做真峰值的过采样），结果从日志摘要中解析
+2. MP3 直接在文件头的 ID3v2 标签中写入 REPLAYGAIN_TRACK_GAIN / PEAK（只改标签，不动音频帧）
+3. Opus 写入 R128_TRACK_GAIN（相对 -23 LUFS，Q7.8 定点数），由ffmpeg流复制重封装，不重新编码
+4. 测得的数值追加写入 loudness.jsonl，播放器或其他工具可以直接查询
+
+用法：
+    python compresser_ultra_fast.py --loudness
+    python loudness.py show
+    python loudness.py lookup 曲目名
+"""
+
+import argparse
+import json
+import os
+import pathlib
+import re
+import shutil
+import subprocess
+import time
+from rich.console import Console
+from rich.table import Table
+
+console = Console()
+
+DEFAULT_STORE = "loudness.jsonl"
+
+# ReplayGain 2.0 的参考响度，与 EBU R128 的 -23 LUFS 相差 5 dB
+REPLAYGAIN_REFERENCE = -18.0
+R128_REFERENCE = -23.0
+
+# 只算采样峰值：ReplayGain 的 PEAK 本来就是采样峰值，真峰值需要4倍过采样，开销大得多
+ANALYSIS_FILTER = "ebur128=peak=sample:framelog=quiet"
+
+# ebur128 的摘要在 info 级别输出
+ANALYSIS_LOG_ARGS = ['-hide_banner', '-loglevel', 'info']
+
+_SUMMARY_PATTERNS = {
+    'integrated': re.compile(r'\bI:\s+(-?[\d.]+|-inf)\s+LUFS'),
+    'range': re.compile(r'\bLRA:\s+(-?[\d.]+)\s+LU\b'),
+    'peak': re.compile(r'\bPeak:\s+(-?[\d.]+|-inf)\s+dBFS'),
+}
+
+
+def analysis_command(input_file):
+    """只做响度分析的ffmpeg命令（分段编码的文件没有整段解码的进程可以搭车时使用）"""
+    return ['ffmpeg', *ANALYSIS_LOG_ARGS, '-nostats', '-i', str(input_file),
+            '-map', '0:a', '-af', ANALYSIS_FILTER, '-f', 'null', '-']
+
+
+def parse_ebur128(log_text):
+    """从ffmpeg日志中解析 ebur128 摘要，返回 {'integrated', 'range', 'peak'}；没有摘要或静音时返回None"""
+    if 'Summary:' not in log_text:
+        return None
+    summary = log_text.rpartition('Summary:')[2]
+    values = {}
+    for key, pattern in _SUMMARY_PATTERNS.items():
+        match = pattern.search(summary)
+        if not match:
+            return None
+        values[key] = float(match.group(1))
+    # 整段静音时积分响度为 -inf，无法计算增益
+    if values['integrated'] == float('-inf') or values['integrated'] <= -70:
+        return None
+    return values
+
+
+def replaygain_tags(loudness):
+    """ReplayGain 2.0 的曲目标签"""
+    gain = REPLAYGAIN_REFERENCE - loudness['integrated']
+    peak = 10 ** (loudness['peak'] / 20) if loudness['peak'] != float('-inf') else 0.0
+    return {
+        'REPLAYGAIN_TRACK_GAIN': f"{gain:.2f} dB",
+        'REPLAYGAIN_TRACK_PEAK': f"{peak:.6f}",
+    }
+
+
+def r128_tags(loudness):
+    """Opus 的 R128_TRACK_GAIN：相对 -23 LUFS 的增益，单位 1/256 dB"""
+    gain = round((R128_REFERENCE - loudness['integrated']) * 256)
+    return {'R128_TRACK_GAIN': str(max(-32768, min(32767, gain)))}
+
+
+def _synchsafe(data):
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def _to_synchsafe(value):
+    return bytes([(value >> 21) & 0x7F, (value >> 14) & 0x7F, (value >> 7) & 0x7F, value & 0x7F])
+
+
+def _txxx_description(frame):
+    """TXXX 帧的描述字段（只处理单字节编码，其他编码返回None）"""
+    content = frame[10:]
+    if not content or content[0] not in (0, 3):
+        return None
+    return content[1:].split(b'\x00', 1)[0].decode('latin-1').upper()
+
+
+def write_id3_txxx(path, tags):
+    """把 TXXX 帧写进MP3开头的ID3v2标签（已有的同名TXXX帧被替换），音频帧原样复制
+
+    只支持 v2.3 / v2.4 且没有扩展头和不同步处理的标签（ffmpeg写出的就是这种）；不支持时抛出 ValueError
+    """
+    path = pathlib.Path(path)
+    temp_path = path.with_name(f".{path.name}.{os.getpid()}.tag")
+    replaced = {key.upper() for key in tags}
+    with open(path, 'rb') as source:
+        header = source.read(10)
+        version = 4
+        frames = []
+        if header[:3] == b'ID3':
+            version, flags = header[3], header[5]
+            if version not in (3, 4) or flags & 0xC0:
+                raise ValueError(f"unsupported ID3v2 tag: version {version}, flags {flags:#x}")
+            body = source.read(_synchsafe(header[6:10]))
+            if flags & 0x10:
+                source.read(10)  # v2.4 的标签尾
+            position = 0
+            while position + 10 <= len(body) and body[position] != 0:
+                size_bytes = body[position + 4:position + 8]
+                size = _synchsafe(size_bytes) if version == 4 else int.from_bytes(size_bytes, 'big')
+                frame = body[position:position + 10 + size]
+                if not (frame[:4] == b'TXXX' and _txxx_description(frame) in replaced):
+                    frames.append(frame)
+                position += 10 + size
+        else:
+            source.seek(0)
+
+        for key, value in tags.items():
+            content = b'\x00' + key.encode('latin-1') + b'\x00' + value.encode('latin-1')
+            size_bytes = _to_synchsafe(len(content)) if version == 4 else len(content).to_bytes(4, 'big')
+            frames.append(b'TXXX' + size_bytes + b'\x00\x00' + content)
+
+        body = b''.join(frames)
+        try:
+            with open(temp_path, 'wb') as output:
+                output.write(b'ID3' + bytes([version, 0, 0]) + _to_synchsafe(len(body)) + body)
+                shutil.copyfileobj(source, output, 1024 * 1024)
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
+    os.replace(temp_path, path)
+
+
+def remux_with_tags(path, tags):
+    """用ffmpeg流复制重封装写入标签，音频不重新编码"""
+    path = pathlib.Path(path)
+    temp_path = path.with_name(f".{path.stem}.{os.getpid()}.tag{path.suffix}")
+    command = ['ffmpeg', '-y', '-loglevel', 'error', '-i', str(path), '-map', '0', '-c', 'copy', '-map_metadata', '0']
+    for key, value in tags.items():
+        command += ['-metadata', f"{key}={value}"]
+    command.append(str(temp_path))
+    try:
+        subprocess.run(command, check=True, capture_output=True)
+        os.replace(temp_path, path)
+    finally:
+        temp_path.unlink(missing_ok=True)
+
+
+def write_loudness_tags(path, loudness):
+    """按输出格式写入增益标签"""
+    suffix = pathlib.Path(path).suffix.lower()
+    if suffix == '.opus':
+        remux_with_tags(path, r128_tags(loudness))
+    elif suffix == '.mp3':
+        try:
+            write_id3_txxx(path, replaygain_tags(loudness))
+        except ValueError:
+            remux_with_tags(path, replaygain_tags(loudness))
+    else:
+        remux_with_tags(path, replaygain_tags(loudness))
+
+
+class LoudnessStore:
+    """曲目名 -> 响度测量值，追加写入的JSON行文件（同名多次记录时以最后一次为准）"""
+
+    def __init__(self, path=DEFAULT_STORE):
+        self.path = pathlib.Path(path)
+
+    def add(self, name, loudness):
+        record = {'name': name, **loudness, **replaygain_tags(loudness), 'time': int(time.time())}
+        # 一次write的短行在追加模式下不会与其他进程交错
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def load(self):
+        result = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    result[record.get('name')] = record
+        except FileNotFoundError:
+            pass
+        return result
+
+
+def show_store(store):
+    records = store.load()
+    if not records:
+        console.print(f"❌ 还没有响度记录 ({store.path})", style="red")
+        console.print("💡 提示：python compresser_ultra_fast.py --loudness", style="yellow")
+        return
+    loudness_table = Table(title=f"🔊 响度记录 ({len(records)} 首)")
+    loudness_table.add_column("曲目", style="cyan", overflow="fold")
+    loudness_table.add_column("响度", justify="right", style="yellow")
+    loudness_table.add_column("动态范围", justify="right")
+    loudness_table.add_column("峰值", justify="right", style="red")
+    loudness_table.add_column("曲目增益", justify="right", style="bold green")
+    for name, record in sorted(records.items()):
+        loudness_table.add_row(name, f"{record['integrated']:.1f} LUFS", f"{record['range']:.1f} LU",
+                               f"{record['peak']:.1f} dBFS", record['REPLAYGAIN_TRACK_GAIN'])
+    console.print(loudness_table)
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="压缩时测得的响度与 ReplayGain")
+    parser.add_argument('--store', default=DEFAULT_STORE, help=f"响度记录文件 (默认: {DEFAULT_STORE})")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('show', help="列出所有曲目的响度")
+    lookup_parser = subparsers.add_parser('lookup', help="以JSON输出一首曲目的响度")
+    lookup_parser.add_argument('name', help="曲目名（不含扩展名）")
+    args = parser.parse_args()
+
+    store = LoudnessStore(args.store)
+    if args.command == 'show':
+        show_store(store)
+    elif args.command == 'lookup':
+        record = store.load().get(args.name)
+        if record is None:
+            console.print(f"❌ 没有找到 {args.name} 的响度记录", style="red")
+        else:
+            print(json.dumps(record, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
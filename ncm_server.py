@@ -0,0 +1,285 @@
+# This file is part of ncm_cracker.
+#
+# ncm_cracker is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ncm_cracker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ncm_cracker.  If not, see <https://www.gnu.org/licenses/>.
+"""
+📻 NCM 边解密边播放的本地HTTP服务
+直接播放 01_original 中的NCM文件，不在磁盘上留下解密副本：
+1. 每个NCM以解密后的音频提供，Content-Type 取自元数据中的 format
+2. 支持 Range 请求 - 密钥流只与偏移量有关，只解密请求的字节区间，播放器拖动进度条不会解密整个文件
+3. 解析过的文件头（密钥查找表、元数据、音频偏移）放在LRU缓存中
+4. 首页列出所有曲目，/playlist.m3u 可以直接导入播放器
+
+用法：
+    python ncm_server.py --port 8163
+"""
+
+import argparse
+import functools
+import html
+import os
+import pathlib
+import re
+import urllib.parse
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from rich.console import Console
+from rich.panel import Panel
+
+from crack_ultra_fast import build_key_box, create_key_lookup_table, decrypt_chunk_vectorized, read_ncm_header
+from library_layout import iter_library_files, load_layout
+
+console = Console()
+
+DEFAULT_PORT = 8163
+
+# 每次读取并解密的块大小
+STREAM_CHUNK_SIZE = 256 * 1024
+
+# 文件头只在开头一小段里，解析时只读这么多（封面很大时按需再读）
+HEADER_READ_SIZE = 64 * 1024
+
+# 缓存的文件头数量
+HEADER_CACHE_SIZE = 256
+
+CONTENT_TYPES = {
+    'mp3': 'audio/mpeg',
+    'flac': 'audio/flac',
+    'm4a': 'audio/mp4',
+    'aac': 'audio/aac',
+    'ogg': 'audio/ogg',
+    'wav': 'audio/wav',
+}
+
+_RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def read_header_bytes(path):
+    """读取文件头所在的开头部分；元数据很长时加大读取量重试"""
+    size = HEADER_READ_SIZE
+    with open(path, 'rb') as f:
+        while True:
+            f.seek(0)
+            data = f.read(size)
+            try:
+                return read_ncm_header(data)
+            except Exception:
+                if len(data) < size:
+                    raise
+                size *= 4
+
+
+@functools.lru_cache(maxsize=HEADER_CACHE_SIZE)
+def load_track(path, file_size, mtime_ns):
+    """解析一个NCM文件头，返回 (密钥查找表, 元数据, 音频起始偏移)
+
+    以 (路径, 大小, 修改时间) 为缓存键，文件被替换后自动重新解析
+    """
+    header = read_header_bytes(path)
+    key_lookup = create_key_lookup_table(build_key_box(header['key_data']))
+    return key_lookup, header['meta'], header['audio_offset']
+
+
+def open_track(path):
+    """取得一个NCM文件的解析结果和解密后音频的长度"""
+    stat = os.stat(path)
+    key_lookup, meta, audio_offset = load_track(str(path), stat.st_size, stat.st_mtime_ns)
+    return key_lookup, meta, audio_offset, stat.st_size - audio_offset
+
+
+def parse_range(header, length):
+    """解析单个 Range 区间，返回 (start, end)（end 含在内）
+
+    没有 Range 或格式不支持（如多区间）时返回None，按完整内容响应；区间无法满足时抛出 ValueError
+    """
+    if not header:
+        return None
+    match = _RANGE_PATTERN.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # bytes=-N 表示最后N个字节
+        suffix = int(last)
+        if suffix == 0:
+            raise ValueError("empty suffix range")
+        return max(0, length - suffix), length - 1
+    start = int(first)
+    end = min(int(last), length - 1) if last else length - 1
+    if start >= length or start > end:
+        raise ValueError("unsatisfiable range")
+    return start, end
+
+
+def stream_range(path, key_lookup, audio_offset, start, end, write):
+    """只读取并解密音频中 [start, end] 的字节"""
+    with open(path, 'rb') as f:
+        f.seek(audio_offset + start)
+        position = start
+        while position <= end:
+            chunk = f.read(min(STREAM_CHUNK_SIZE, end - position + 1))
+            if not chunk:
+                break
+            write(decrypt_chunk_vectorized(chunk, key_lookup, position))
+            position += len(chunk)
+
+
+class NCMRequestHandler(BaseHTTPRequestHandler):
+    server_version = "NCMServer/1.0"
+    # 由 make_server 设置
+    library = None
+
+    def log_message(self, format, *args):
+        console.print(f"[dim]{self.address_string()} {format % args}[/dim]")
+
+    def tracks(self):
+        """曲目名 -> NCM路径"""
+        return {path.stem: path for path in sorted(iter_library_files(self.library, {'.ncm'}))}
+
+    def find_track(self, url_path):
+        """把 /曲目名.格式 映射到 01_original 中的NCM文件，只接受目录中实际存在的文件"""
+        name = urllib.parse.unquote(url_path.lstrip('/'))
+        stem = os.path.splitext(name)[0]
+        if not stem or '/' in stem or '\\' in stem:
+            return None
+        path = load_layout().locate(self.library, f"{stem}.ncm")
+        return path if path.is_file() else None
+
+    def do_HEAD(self):
+        self.handle_request(send_body=False)
+
+    def do_GET(self):
+        self.handle_request(send_body=True)
+
+    def handle_request(self, send_body):
+        url_path = urllib.parse.urlsplit(self.path).path
+        if url_path in ('/', '/index.html'):
+            return self.send_index(send_body)
+        if url_path == '/playlist.m3u':
+            return self.send_playlist(send_body)
+
+        path = self.find_track(url_path)
+        if path is None:
+            return self.send_error(HTTPStatus.NOT_FOUND)
+        try:
+            key_lookup, meta, audio_offset, length = open_track(path)
+        except Exception:
+            return self.send_error(HTTPStatus.UNPROCESSABLE_ENTITY, "Invalid NCM file")
+
+        try:
+            byte_range = parse_range(self.headers.get('Range'), length)
+        except ValueError:
+            self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.send_header('Content-Range', f"bytes */{length}")
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if byte_range is None:
+            start, end = 0, length - 1
+            self.send_response(HTTPStatus.OK)
+        else:
+            start, end = byte_range
+            self.send_response(HTTPStatus.PARTIAL_CONTENT)
+            self.send_header('Content-Range', f"bytes {start}-{end}/{length}")
+        self.send_header('Content-Type', CONTENT_TYPES.get(meta.get('format'), 'application/octet-stream'))
+        self.send_header('Content-Length', str(max(0, end - start + 1)))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+
+        if send_body and length > 0:
+            try:
+                stream_range(path, key_lookup, audio_offset, start, end, self.wfile.write)
+            except (BrokenPipeError, ConnectionResetError):
+                # 播放器拖动进度条时会直接断开旧连接
+                pass
+
+    def track_urls(self):
+        """[(曲目名, URL路径), ...]，扩展名取自元数据"""
+        result = []
+        for stem, path in self.tracks().items():
+            try:
+                extension = open_track(path)[1].get('format', 'mp3')
+            except Exception:
+                continue
+            result.append((stem, '/' + urllib.parse.quote(f"{stem}.{extension}")))
+        return result
+
+    def send_text(self, body, content_type, send_body):
+        data = body.encode('utf-8')
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', f"{content_type}; charset=utf-8")
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(data)
+
+    def send_index(self, send_body):
+        items = ''.join(
+            f'<li><a href="{html.escape(url)}">{html.escape(stem)}</a></li>\n'
+            for stem, url in self.track_urls()
+        )
+        body = (
+            '<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>NCM</title></head><body>\n'
+            f'<p><a href="/playlist.m3u">playlist.m3u</a></p>\n<ol>\n{items}</ol>\n</body></html>\n'
+        )
+        self.send_text(body, 'text/html', send_body)
+
+    def send_playlist(self, send_body):
+        host = self.headers.get('Host') or f"{self.server.server_address[0]}:{self.server.server_address[1]}"
+        lines = ['#EXTM3U']
+        for stem, url in self.track_urls():
+            lines.append(f"#EXTINF:-1,{stem}")
+            lines.append(f"http://{host}{url}")
+        self.send_text('\n'.join(lines) + '\n', 'audio/x-mpegurl', send_body)
+
+
+def make_server(host='127.0.0.1', port=DEFAULT_PORT, library='01_original'):
+    """创建服务器；library 是存放NCM文件的目录"""
+    handler = type('BoundNCMRequestHandler', (NCMRequestHandler,), {'library': pathlib.Path(library)})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="NCM 边解密边播放的本地HTTP服务")
+    parser.add_argument('--host', default='127.0.0.1', help="监听地址 (默认: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f"监听端口 (默认: {DEFAULT_PORT})")
+    parser.add_argument('--dir', default='01_original', help="NCM文件目录 (默认: 01_original)")
+    args = parser.parse_args()
+
+    library = pathlib.Path(args.dir)
+    if not library.exists():
+        console.print(f"❌ {args.dir} 文件夹不存在", style="bold red")
+        return
+
+    server = make_server(args.host, args.port, library)
+    count = sum(1 for _ in iter_library_files(library, {'.ncm'}))
+    console.print(Panel.fit(
+        f"📻 [bold cyan]{count}[/bold cyan] 首曲目\n"
+        f"🌐 http://{args.host}:{args.port}/\n"
+        f"🎶 http://{args.host}:{args.port}/playlist.m3u",
+        title="NCM 播放服务", border_style="green"
+    ))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        console.print("\n👋 服务已停止")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
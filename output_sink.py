@@ -0,0 +1,155 @@
+# This file is part of ncm_cracker.
+#
+# ncm_cracker is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ncm_cracker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ncm_cracker.  If not, see <https://www.gnu.org/licenses/>.
+"""
+📤 输出目标
+解密和压缩阶段把结果写到一个 "输出目标"，而不是固定写进目录：
+1. DirectorySink - 写入本地目录（默认行为，先写 .part 再改名），按曲库目录布局放进分片目录
+2. TarStreamSink - 把所有结果串成一个tar流写到stdout或文件，
+   `python crack_ultra_fast.py --out - | ssh host tar x` 可以直接把结果送到别的机器
+3. 各任务的结果按条目串行写入同一个流，数据分块写出，不在内存中缓存整个文件
+4. 其他去处（如对象存储上传）实现 write_stream / write_path / close 即可接入
+"""
+
+import os
+import pathlib
+import sys
+import tarfile
+import threading
+import time
+
+# tar 记录块大小
+TAR_BLOCK_SIZE = tarfile.BLOCKSIZE
+
+# 读取本地文件写入流时的块大小
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class OutputSink:
+    """输出目标接口"""
+
+    # 结果是否留在项目目录中；为True时才写记录文件和统计索引
+    local = False
+
+    def write_stream(self, name, size, chunks):
+        """写出一个条目：name 为相对路径，size 为总字节数，chunks 逐块产出数据；返回写出的字节数"""
+        raise NotImplementedError
+
+    def write_path(self, name, path):
+        """把一个已在磁盘上的文件作为条目写出"""
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            return self.write_stream(name, size, iter(lambda: f.read(COPY_CHUNK_SIZE), b''))
+
+    def close(self):
+        pass
+
+
+class DirectorySink(OutputSink):
+    """写入本地目录，先写 .part 再原子改名；layout 为 LibraryLayout 时按它决定文件所在的分片"""
+
+    local = True
+
+    def __init__(self, root, layout=None):
+        self.root = pathlib.Path(root)
+        self.layout = layout
+
+    def part_path(self, output_path):
+        """写入过程中使用的临时文件"""
+        return output_path.with_name(output_path.name + '.part')
+
+    def write_stream(self, name, size, chunks):
+        output_path = self.layout.path(self.root, name) if self.layout else self.root / name
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        part_path = self.part_path(output_path)
+        written = 0
+        with open(part_path, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                written += len(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(part_path, output_path)
+        return written
+
+
+class TarStreamSink(OutputSink):
+    """把条目串成一个tar流；多个线程同时写时按条目加锁串行，条目内部分块写出"""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.lock = threading.Lock()
+        self.entries = 0
+        self.bytes = 0
+
+    def write_stream(self, name, size, chunks):
+        info = tarfile.TarInfo(pathlib.PurePath(name).as_posix())
+        info.size = size
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        with self.lock:
+            self.fileobj.write(info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape'))
+            written = 0
+            error = None
+            try:
+                for chunk in chunks:
+                    chunk = chunk[:size - written]
+                    self.fileobj.write(chunk)
+                    written += len(chunk)
+                    if written >= size:
+                        break
+            except Exception as e:
+                error = e
+            # 头部已经写出，数据不足时补零保持流的结构完整，再把这个条目报告为失败
+            if written < size:
+                self._write_zeros(size - written)
+            self._write_zeros(-size % TAR_BLOCK_SIZE)
+            self.entries += 1
+            self.bytes += size
+        if error is not None:
+            raise error
+        if written < size:
+            raise ValueError(f"{name}: expected {size} bytes, got {written}")
+        return written
+
+    def _write_zeros(self, count):
+        while count > 0:
+            block = min(count, COPY_CHUNK_SIZE)
+            self.fileobj.write(bytes(block))
+            count -= block
+
+    def close(self):
+        """写出tar结束标记（两个全零块）"""
+        with self.lock:
+            self.fileobj.write(bytes(TAR_BLOCK_SIZE * 2))
+            self.fileobj.flush()
+
+
+def open_sink(out):
+    """按 --out 参数创建输出目标：None 为默认目录（返回None），'-' 为stdout上的tar流，其他为tar文件路径"""
+    if out is None:
+        return None
+    if out == '-':
+        return TarStreamSink(sys.stdout.buffer)
+    return TarStreamSink(open(out, 'wb'))
+
+
+def close_sink(sink):
+    """结束输出；写入文件的tar流同时关闭文件"""
+    if sink is None:
+        return
+    sink.close()
+    fileobj = getattr(sink, 'fileobj', None)
+    if fileobj is not None and fileobj is not sys.stdout.buffer:
+        fileobj.close()
@@ -0,0 +1,319 @@
+# This file is part of ncm_cracker.
+#
+# ncm_cracker is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ncm_cracker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ncm_cracker.  If not, see <https://www.gnu.org/licenses/>.
+"""
+🔗 解密 + 压缩 流水线 (Pipeline Edition)
+一条命令完成 01_original -> 02_decrypted -> 03_compressed：
+1. 解密阶段与压缩阶段重叠执行 - 解密完一个就立刻送去压缩
+2. 有界队列衔接两个阶段 - 压缩跟不上时自动对解密施加背压：解密任务按窗口提交，结果放进队列后才提交下一个
+3. 两个阶段各自独立、可调的工作池 - 解密轻CPU，编码重CPU
+4. 整批耗时趋近于较慢阶段的耗时，而不是两阶段之和
+5. 最长优先 - 按NCM元数据中的时长从长到短解密，长文件尽早进入压缩阶段
+6. 压缩包输入 - zip/tar 中的NCM流式解密后直接进入压缩阶段，不先解压到磁盘
+"""
+
+import argparse
+import pathlib
+import queue
+import subprocess
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from rich.console import Console
+from rich.progress import Progress, SpinnerColumn, TimeElapsedColumn, BarColumn, TaskProgressColumn, TextColumn
+from rich.table import Table
+from rich.panel import Panel
+
+from archive_input import collect_archive_jobs, dump_tar_archive, find_archives, process_zip_member
+from audio_probe import longest_first
+from batch_stream import as_completed_bounded
+from crack_ultra_fast import process_file_ultra_fast
+from compresser_ultra_fast import compress_with_probe
+from cpu_budget import available_cpu_count
+from library_layout import iter_library_files, load_layout
+from preflight import describe, failure_reason
+from stats_index import StatsIndex
+
+console = Console()
+
+# 压缩阶段支持的输入格式
+SUPPORTED_FORMATS = ['.flac', '.mp3', '.wav', '.m4a', '.aac', '.ogg']
+
+# 队列结束标记
+_STOP = None
+
+
+def load_records(record_path):
+    """读取记录文件，返回已处理文件名集合"""
+    try:
+        with open(record_path, 'r', encoding='utf-8') as f:
+            return set(f.read().strip().split('\n'))
+    except FileNotFoundError:
+        return set()
+
+
+def default_worker_counts():
+    """默认工作池大小：解密是轻CPU的I/O型任务，编码才是CPU大户"""
+    cpu_count = available_cpu_count()
+    decrypt_workers = max(1, min(2, cpu_count // 4))
+    encode_workers = max(1, cpu_count - decrypt_workers)
+    return decrypt_workers, encode_workers
+
+
+def encode_worker(encode_queue, compressed_dir, bitrate, sample_rate, threads, record_lock, on_result):
+    """压缩阶段工作线程：从队列取出已解密文件，直接驱动ffmpeg子进程
+
+    ffmpeg本身就是独立进程，父进程里的线程只负责等待它结束，
+    因此用线程即可获得真正的并行编码，且compressed.txt只在父进程中写入。
+    """
+    stats_index = StatsIndex()
+    while True:
+        input_file = encode_queue.get()
+        try:
+            if input_file is _STOP:
+                return
+            output_file = load_layout().output_path(compressed_dir, f"{input_file.stem}.mp3")
+            try:
+                previous_size = output_file.stat().st_size if output_file.exists() else None
+                action, stats = compress_with_probe(input_file, output_file, bitrate, sample_rate, threads)
+                with record_lock:
+                    with open('compressed.txt', 'a', encoding='utf-8') as f:
+                        f.write(input_file.stem + '\n')
+                stats_index.add_record('compressed')
+                if stats:
+                    stats_index.add_file('compressed', stats['output_size'], previous_size)
+                on_result({'success': True, 'action': action, 'input_file': input_file, 'stats': stats})
+            except subprocess.CalledProcessError as e:
+                on_result({'success': False, 'input_file': input_file,
+                           'error': f"FFmpeg错误: {e.stderr if hasattr(e, 'stderr') else str(e)}"})
+            except Exception as e:
+                on_result({'success': False, 'input_file': input_file, 'error': str(e)})
+        finally:
+            encode_queue.task_done()
+
+
+def main_pipeline_ultra(decrypt_workers=None, encode_workers=None, queue_size=None,
+                        bitrate='128k', sample_rate=44100, archives=None):
+    """流水线主函数：解密与压缩重叠执行；archives 为额外的压缩包输入（01_original 中的压缩包会自动加入）"""
+    console.print(Panel.fit("🔗 NCM 解密 + 压缩 流水线", style="bold magenta"))
+    console.print("⚡ 解密完成一个文件就立刻送入压缩阶段，两个阶段同时满载运行")
+    console.print("📁 使用规范化目录结构：01_original -> 02_decrypted -> 03_compressed\n")
+
+    original_dir = pathlib.Path("01_original")
+    decrypted_dir = pathlib.Path("02_decrypted")
+    compressed_dir = pathlib.Path("03_compressed")
+    for folder in (original_dir, decrypted_dir, compressed_dir):
+        folder.mkdir(exist_ok=True)
+
+    cracked = load_records('cracked.txt')
+    compressed = load_records('compressed.txt')
+
+    # 解密阶段的任务，按NCM元数据中的时长从长到短提交：长文件先解密、先进入压缩阶段
+    decrypt_jobs = [(str(file), file.stem) for file, _ in longest_first(
+        file for file in iter_library_files(original_dir, {'.ncm'}) if file.stem not in cracked)]
+    # 压缩包成员：zip 按成员并行解密，tar 每个包一个线程顺序流式解密
+    archives = find_archives(original_dir) + [pathlib.Path(archive) for archive in archives or []]
+    skip = cracked | {name for _, name in decrypt_jobs}
+    zip_jobs, tar_archives = collect_archive_jobs(archives, skip)
+    pending_stems = skip - cracked
+
+    # 上次遗留的"已解密但未压缩"文件直接进入压缩阶段，同样最长优先
+    leftover_files = [f for f, _ in longest_first(
+        f for f in iter_library_files(decrypted_dir)
+        if f.suffix.lower() in SUPPORTED_FORMATS
+        and f.stem not in compressed and f.stem not in pending_stems)]
+
+    if not decrypt_jobs and not zip_jobs and not tar_archives and not leftover_files:
+        console.print("❌ 没有需要解密或压缩的文件", style="red")
+        console.print("💡 提示：请将NCM文件放入 01_original/ 目录", style="yellow")
+        return
+
+    default_decrypt, default_encode = default_worker_counts()
+    decrypt_workers = decrypt_workers or default_decrypt
+    encode_workers = encode_workers or default_encode
+    queue_size = queue_size or encode_workers * 2
+    # 解密进程占用的核心不再分给编码，剩余核心在编码并发之间均分
+    encode_threads = max(1, (available_cpu_count() - decrypt_workers) // encode_workers)
+
+    console.print(f"🔓 待解密: [bold cyan]{len(decrypt_jobs) + len(zip_jobs)}[/bold cyan] 个文件  "
+                  f"🎵 待压缩(遗留): [bold cyan]{len(leftover_files)}[/bold cyan] 个文件")
+    if tar_archives:
+        console.print(f"📦 另有 [bold cyan]{len(tar_archives)}[/bold cyan] 个tar包流式解密")
+    console.print(f"🔥 解密进程: [bold red]{decrypt_workers}[/bold red]  "
+                  f"编码并发: [bold red]{encode_workers}[/bold red] × {encode_threads} 线程  "
+                  f"队列容量: [bold yellow]{queue_size}[/bold yellow]\n")
+
+    encode_queue = queue.Queue(maxsize=queue_size)
+    record_lock = threading.Lock()
+    stats_lock = threading.Lock()
+
+    stats = {
+        'decrypted': 0, 'decrypt_failed': 0, 'decrypted_size': 0,
+        'compressed': 0, 'compress_failed': 0, 'skipped': 0,
+        'input_size': 0, 'output_size': 0,
+    }
+    failures = []
+    start_time = time.time()
+
+    with Progress(
+        SpinnerColumn(),
+        TextColumn("[progress.description]{task.description}"),
+        BarColumn(),
+        TaskProgressColumn(),
+        TimeElapsedColumn(),
+        console=console,
+        transient=False
+    ) as progress:
+
+        # 一个tar包在进度中先占一格，展开成员后修正总数
+        decrypt_total = len(decrypt_jobs) + len(zip_jobs) + len(tar_archives)
+        decrypt_task = progress.add_task("🔓 解密阶段", total=decrypt_total)
+        encode_task = progress.add_task("🎵 压缩阶段", total=decrypt_total + len(leftover_files))
+
+        def on_encode_result(result):
+            with stats_lock:
+                if result['success'] and result['action'] == 'skip':
+                    stats['skipped'] += 1
+                elif result['success']:
+                    stats['compressed'] += 1
+                    stats['input_size'] += result['stats']['input_size']
+                    stats['output_size'] += result['stats']['output_size']
+                else:
+                    stats['compress_failed'] += 1
+                    failures.append((result['input_file'].name, result['error']))
+            progress.advance(encode_task)
+
+        encoders = [
+            threading.Thread(
+                target=encode_worker,
+                args=(encode_queue, compressed_dir, bitrate, sample_rate, encode_threads, record_lock, on_encode_result),
+                daemon=True,
+            )
+            for _ in range(encode_workers)
+        ]
+        for encoder in encoders:
+            encoder.start()
+
+        def feed_leftovers():
+            for input_file in leftover_files:
+                encode_queue.put(input_file)
+
+        # 遗留文件由单独的线程送入队列，队列满时只有它在等，解密阶段照常开始
+        feeder = threading.Thread(target=feed_leftovers, daemon=True)
+        feeder.start()
+
+        # tar包排在最前：每个包占一个窗口位置顺序流式解密，其余位置留给单文件任务
+        jobs = ([('tar', archive) for archive in tar_archives] +
+                [('file', file_info) for file_info in decrypt_jobs] +
+                [('zip', job) for job in zip_jobs])
+
+        with ProcessPoolExecutor(max_workers=decrypt_workers) as executor, \
+                ThreadPoolExecutor(max_workers=max(1, len(tar_archives))) as tar_executor:
+
+            def submit(job):
+                kind, payload = job
+                if kind == 'tar':
+                    return tar_executor.submit(dump_tar_archive, payload, skip)
+                if kind == 'zip':
+                    return executor.submit(process_zip_member, payload)
+                return executor.submit(process_file_ultra_fast, payload)
+
+            # 在途的解密任务不超过窗口大小：结果放进编码队列（队列满时阻塞）之后才会提交下一个，
+            # 压缩跟不上时解密进程随之停下，而不是把整个积压解密到磁盘上
+            for (kind, payload), future in as_completed_bounded(submit, jobs, decrypt_workers + len(tar_archives)):
+                if kind == 'tar':
+                    try:
+                        results = future.result()
+                    except Exception:
+                        results = [(pathlib.Path(payload).name, (None, 0, 0))]
+                    for task in (decrypt_task, encode_task):
+                        progress.update(task, total=progress.tasks[task].total + len(results) - 1)
+                else:
+                    file_name = payload[2] if kind == 'zip' else payload[1]
+                    try:
+                        results = [(file_name, future.result())]
+                    except Exception:
+                        results = [(file_name, (None, 0, 0))]
+
+                for file_name, result in results:
+                    output_name, _, file_size = result
+                    if output_name:
+                        stats['decrypted'] += 1
+                        stats['decrypted_size'] += file_size
+                        # 队列满时阻塞在这里 - 这就是对解密阶段的背压
+                        encode_queue.put(load_layout().locate(decrypted_dir, output_name))
+                    else:
+                        stats['decrypt_failed'] += 1
+                        with stats_lock:
+                            failures.append((file_name, f"解密失败: {describe(failure_reason(result))}"))
+                        # 解密失败的文件不会进入压缩阶段
+                        progress.update(encode_task, total=progress.tasks[encode_task].total - 1)
+                    progress.advance(decrypt_task)
+
+        feeder.join()
+        for _ in encoders:
+            encode_queue.put(_STOP)
+        for encoder in encoders:
+            encoder.join()
+
+    elapsed = time.time() - start_time
+
+    if failures:
+        failure_table = Table(title="❌ 失败文件")
+        failure_table.add_column("文件名", style="cyan", overflow="fold")
+        failure_table.add_column("原因", style="red", overflow="fold")
+        for name, error in failures:
+            failure_table.add_row(name, error)
+        console.print(failure_table)
+
+    summary_table = Table(show_header=False, box=None)
+    summary_table.add_column("", style="bold")
+    summary_table.add_column("", style="")
+
+    total_compression_ratio = (1 - stats['output_size'] / stats['input_size']) * 100 if stats['input_size'] > 0 else 0
+    summary_table.add_row("🎉 流水线处理完成", "")
+    summary_table.add_row("🔓 解密成功", f"[bold green]{stats['decrypted']}[/bold green] 个文件")
+    summary_table.add_row("🎵 压缩成功", f"[bold green]{stats['compressed']}[/bold green] 个文件")
+    summary_table.add_row("⏭️  跳过压缩", f"[bold cyan]{stats['skipped']}[/bold cyan] 个文件 (低码率有损格式)")
+    summary_table.add_row("❌ 失败", f"[bold red]{stats['decrypt_failed'] + stats['compress_failed']}[/bold red] 个文件")
+    summary_table.add_row("⏱️  总耗时", f"[bold yellow]{elapsed:.2f}[/bold yellow] 秒")
+    summary_table.add_row("💾 解密总量", f"[bold magenta]{stats['decrypted_size']/(1024*1024):.1f}[/bold magenta] MB")
+    summary_table.add_row("📦 压缩后大小", f"[bold blue]{stats['output_size']/(1024*1024):.1f}[/bold blue] MB")
+    summary_table.add_row("📊 总压缩率", f"[bold red]{total_compression_ratio:.1f}%[/bold red]")
+
+    console.print(Panel(summary_table, title="📊 流水线统计", border_style="magenta"))
+
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="NCM 解密 + 压缩 流水线")
+    parser.add_argument('--decrypt-workers', type=int, default=None, help="解密进程数 (默认: 1-2)")
+    parser.add_argument('--encode-workers', type=int, default=None, help="并发ffmpeg编码数 (默认: 剩余CPU核心)")
+    parser.add_argument('--queue-size', type=int, default=None, help="两阶段之间的队列容量 (默认: 编码并发×2)")
+    parser.add_argument('--bitrate', default='128k', help="MP3码率 (默认: 128k)")
+    parser.add_argument('--sample-rate', type=int, default=44100, help="输出采样率 (默认: 44100)")
+    parser.add_argument('archives', nargs='*', help="额外的zip/tar压缩包输入（01_original 中的压缩包会自动加入）")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    main_pipeline_ultra(
+        decrypt_workers=args.decrypt_workers,
+        encode_workers=args.encode_workers,
+        queue_size=args.queue_size,
+        bitrate=args.bitrate,
+        sample_rate=args.sample_rate,
+        archives=args.archives,
+    )
@@ -0,0 +1,154 @@
+# This file is part of ncm_cracker.
+#
+# ncm_cracker is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ncm_cracker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ncm_cracker.  If not, see <https://www.gnu.org/licenses/>.
+"""
+🛂 解密前预检
+坏文件在写出任何音频数据之前就被拒绝，不再解密出几百MB的垃圾才发现（或根本发现不了）：
+1. 文件头中的密钥 / 元数据 / 封面长度逐项与文件大小核对，截断的文件直接拒绝
+2. 密钥和元数据解密后检查固定前缀，密钥错误不会被当成正常文件继续处理
+3. 只解密音频开头的几KB，跳过ID3v2标签后识别文件头（fLaC / OggS / MPEG帧 等），并与元数据中的 format 核对
+4. 拒绝时给出固定的原因代码和说明，解密函数的返回值中带上 {'reason', 'detail'}，界面和日志可以按原因统计
+"""
+
+from audio_probe import find_mp3_frame, id3v2_size
+
+# 预检时解密的音频字节数：容得下MP4的ftyp盒、几个MPEG帧，以及不带封面的ID3标签
+PREFLIGHT_BYTES = 4096
+
+# ID3标签超出预检范围时看不到标签之后的内容：标签头本身有效就说明密钥正确，格式以元数据为准
+TAGGED = 'tagged'
+
+# 原因代码 -> 说明
+REASONS = {
+    'not_ncm': "不是NCM文件",
+    'truncated_header': "文件头被截断",
+    'bad_key': "密钥无效",
+    'bad_meta': "元数据无法解析",
+    'no_audio': "没有音频数据",
+    'unknown_audio': "解密结果无法识别",
+    'format_mismatch': "音频格式与元数据不符",
+    'error': "解密出错",
+}
+
+# 密钥解密后的固定前缀（去掉后才是RC4密钥）
+KEY_PREFIX = b'neteasecloudmusic'
+
+# 同一种音频在元数据和文件头识别结果中可能的叫法
+_FORMAT_ALIASES = {'mp4': 'm4a'}
+
+
+class PreflightError(ValueError):
+    """预检失败：reason 为 REASONS 中的原因代码，detail 为具体说明"""
+
+    def __init__(self, reason, detail=''):
+        self.reason = reason
+        self.detail = detail
+        super().__init__(f"{reason}: {detail}" if detail else reason)
+
+    def to_dict(self):
+        return {'reason': self.reason, 'detail': self.detail}
+
+
+def check_length(field, offset, length, limit):
+    """文件头中的一个长度字段：从 offset 起 length 字节必须在 limit 之内"""
+    if offset + length > limit:
+        raise PreflightError('truncated_header', f"{field} needs {offset + length} bytes, only {limit} available")
+
+
+def check_key(key_data):
+    """解密后的密钥必须带固定前缀，返回去掉前缀的RC4密钥"""
+    key_data = bytes(key_data)
+    if not key_data.startswith(KEY_PREFIX) or len(key_data) <= len(KEY_PREFIX):
+        raise PreflightError('bad_key', f"decrypted key starts with {key_data[:len(KEY_PREFIX)]!r}")
+    return key_data[len(KEY_PREFIX):]
+
+
+def check_audio_bounds(audio_offset, file_size):
+    """封面之后必须还有音频数据"""
+    if audio_offset > file_size:
+        raise PreflightError('truncated_header', f"audio starts at {audio_offset}, file has {file_size} bytes")
+    if audio_offset == file_size:
+        raise PreflightError('no_audio', f"file ends at audio offset {audio_offset}")
+
+
+def _id3_tag_size(head):
+    """开头有效ID3v2标签的总长度；没有标签或标签头无效（版本、同步安全整数不合法）时返回0"""
+    if len(head) < 10 or head[:3] != b'ID3' or head[3] not in (2, 3, 4) or any(b & 0x80 for b in head[6:10]):
+        return 0
+    return id3v2_size(head)
+
+
+def sniff_audio(head):
+    """由解密后的开头几KB识别音频格式，无法识别时返回None；ID3标签超出 head 时返回 TAGGED"""
+    head = bytes(head)
+    # ID3v2标签可以加在任何格式前面（FLAC也可以），识别的是标签之后的内容
+    tag_size = _id3_tag_size(head)
+    if tag_size and tag_size + 12 > len(head):
+        return TAGGED
+    body = head[tag_size:]
+    if body[:4] == b'fLaC':
+        return 'flac'
+    if body[:4] == b'OggS':
+        return 'ogg'
+    if body[:4] == b'RIFF' and body[8:12] == b'WAVE':
+        return 'wav'
+    if body[4:8] == b'ftyp':
+        return 'm4a'
+    # MP3第一帧之前可能有填充：在整个范围内找连续两个有效帧头，随机数据几乎不可能碰上
+    position, header = find_mp3_frame(body)
+    if position is not None and position + header['frame_length'] + 4 <= len(body):
+        return 'mp3'
+    # 帧同步之后 layer 位为0的是ADTS封装的AAC
+    if len(body) >= 2 and body[0] == 0xFF and body[1] & 0xF6 == 0xF0:
+        return 'aac'
+    # 标签有效但后面认不出来（如帧数据不完整）：保持以前的行为，按MP3处理
+    return 'mp3' if tag_size else None
+
+
+def check_audio(head, expected_format=None):
+    """解密后的音频开头必须可识别，且与元数据中的格式一致；返回识别出的格式"""
+    if not head:
+        raise PreflightError('no_audio', "audio payload is empty")
+    detected = sniff_audio(head)
+    if detected is None:
+        raise PreflightError('unknown_audio', f"decrypted payload starts with {bytes(head[:8]).hex()}")
+    if detected == TAGGED:
+        return str(expected_format).lower() if expected_format else 'mp3'
+    if expected_format:
+        expected = str(expected_format).lower()
+        if _FORMAT_ALIASES.get(detected, detected) != _FORMAT_ALIASES.get(expected, expected):
+            raise PreflightError('format_mismatch', f"metadata says {expected}, payload looks like {detected}")
+    return detected
+
+
+def failure(error):
+    """异常 -> 解密函数返回值中的原因"""
+    if isinstance(error, PreflightError):
+        return error.to_dict()
+    return {'reason': 'error', 'detail': f"{type(error).__name__}: {error}"}
+
+
+def failure_reason(result):
+    """解密函数的返回值 (名称, 速度, 大小) 失败时第二项是原因 {'reason', 'detail'}；成功或没有原因时返回None"""
+    if result and not result[0] and isinstance(result[1], dict):
+        return result[1]
+    return None
+
+
+def describe(reason):
+    """原因 -> 一行说明"""
+    if not reason:
+        return REASONS['error']
+    label = REASONS.get(reason['reason'], reason['reason'])
+    return f"{label} ({reason['detail']})" if reason.get('detail') else label
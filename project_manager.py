@@ -17,15 +17,108 @@
 自动创建和管理文件夹结构
 """
 
+import errno
 import os
 import pathlib
 import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from rich.console import Console
 from rich.panel import Panel
+from rich.progress import Progress, SpinnerColumn, TimeElapsedColumn, BarColumn, TaskProgressColumn, TextColumn
 from rich.table import Table
 
+from audio_probe import parse_mp3_frame_header
+from library_layout import load_layout
+from stats_index import StatsIndex
+
 console = Console()
 
+# 文件头魔数 -> (类型, 规范扩展名)；MP3 单独归到 03_compressed
+_MAGIC_KINDS = [
+    (0, b'CTENFDAM', 'ncm', '.ncm'),
+    (0, b'fLaC', 'audio', '.flac'),
+    (0, b'OggS', 'audio', '.ogg'),
+    (8, b'WAVE', 'audio', '.wav'),
+    (0, b'ID3', 'mp3', '.mp3'),
+]
+
+# ISO-BMFF（ftyp盒）的主品牌中只表示音频的几种；HEIC/AVIF照片、MP4/MOV视频也以ftyp开头
+_AUDIO_BRANDS = (b'M4A ', b'M4B ', b'M4P ', b'F4A ', b'F4B ')
+# 通用品牌（mp42 / isom 等）分不出音视频，只有扩展名本来就是音频时才当作音频
+_AUDIO_SUFFIXES = ('.m4a', '.aac')
+
+# 同一种内容可以接受的其他扩展名
+_EXTENSION_ALIASES = {'.m4a': ('.m4a', '.mp4', '.aac'), '.ogg': ('.ogg', '.opus')}
+
+def detect_file_kind(path):
+    """按文件头魔数识别文件类型，返回 ('ncm' / 'audio' / 'mp3', 规范扩展名)，无法识别返回 (None, None)"""
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(16)
+    except OSError:
+        return None, None
+    for offset, magic, kind, extension in _MAGIC_KINDS:
+        if header[offset:offset + len(magic)] == magic:
+            return kind, extension
+    if header[4:8] == b'ftyp':
+        if header[8:12] in _AUDIO_BRANDS or pathlib.Path(path).suffix.lower() in _AUDIO_SUFFIXES:
+            return 'audio', '.m4a'
+        return None, None
+    if len(header) >= 4 and header[0] == 0xFF:
+        # ADTS封装的AAC：同步字后层号为0
+        if header[1] & 0xF6 == 0xF0:
+            return 'audio', '.aac'
+        if parse_mp3_frame_header(header[:4]):
+            return 'mp3', '.mp3'
+    return None, None
+
+def target_name(path, extension):
+    """扩展名与内容不符时改用规范扩展名，保证后续按扩展名查找的工具能找到它"""
+    if path.suffix.lower() in _EXTENSION_ALIASES.get(extension, (extension,)):
+        return path.name
+    return path.stem + extension
+
+def move_same_device(source, target):
+    """同一文件系统上移动文件，不复制数据；目标已存在时不覆盖并返回False
+
+    优先用硬链接 + 删除源文件：os.link 在目标存在时直接失败，不会有先检查后覆盖的竞争。
+    跨设备时抛出 errno.EXDEV 的 OSError，由调用方改为复制。
+    """
+    try:
+        os.link(source, target)
+    except FileExistsError:
+        return False
+    except OSError as e:
+        if e.errno == errno.EXDEV:
+            raise
+        # 文件系统不支持硬链接（如FAT），退回到重命名
+        if target.exists():
+            return False
+        os.rename(source, target)
+        return True
+    os.unlink(source)
+    return True
+
+def copy_across_devices(source, target):
+    """跨设备复制：先写到目标目录的临时文件，完成后原子改名，再删除源文件；目标已存在时返回False"""
+    if target.exists():
+        return False
+    temp_path = target.with_name(f".{target.name}.part")
+    shutil.copy2(source, temp_path)
+    try:
+        os.link(temp_path, target)
+    except FileExistsError:
+        return False
+    except OSError:
+        if target.exists():
+            return False
+        os.rename(temp_path, target)
+    finally:
+        temp_path.unlink(missing_ok=True)
+    os.unlink(source)
+    return True
+
 class ProjectStructure:
     def __init__(self, root_path="."):
         self.root = pathlib.Path(root_path)
@@ -38,6 +131,7 @@ class ProjectStructure:
             "cracked": self.root / "cracked.txt",
             "compressed": self.root / "compressed.txt"
         }
+        self.stats_index = StatsIndex(self.root)
     
     def create_structure(self):
         """创建项目目录结构"""
@@ -58,88 +152,174 @@ class ProjectStructure:
         
         console.print("\n🎉 项目结构创建完成！")
     
-    def organize_existing_files(self):
-        """整理现有文件到对应目录"""
+    def organize_existing_files(self, max_workers=16, copy_workers=4):
+        """整理现有文件到对应目录
+
+        按文件头魔数识别类型（扩展名不符时改用正确的扩展名），同一文件系统上用硬链接/重命名瞬间完成，
+        跨设备的复制放到有界线程池中并行进行；只显示汇总进度，不逐个打印文件。
+        """
         console.print(Panel.fit("🗂️  整理现有文件", style="bold yellow"))
         
-        moved_files = {"ncm": 0, "audio": 0, "mp3": 0}
-        
-        for file in self.root.iterdir():
-            if file.is_file():
-                # NCM文件 -> 01_original
-                if file.suffix.lower() == '.ncm':
-                    target = self.folders["original"] / file.name
-                    if not target.exists():
-                        shutil.move(str(file), str(target))
-                        moved_files["ncm"] += 1
-                        console.print(f"📦 移动NCM文件: {file.name} -> 01_original/")
+        # 根目录下的所有文件，以及旧版本 result 目录中的文件
+        candidates = []
+        result_dir = self.root / "result"
+        for folder in (self.root, result_dir):
+            if folder.exists():
+                with os.scandir(folder) as entries:
+                    candidates += [pathlib.Path(entry.path) for entry in entries if entry.is_file()]
+        
+        targets = {"ncm": "original", "audio": "decrypted", "mp3": "compressed"}
+        # 按项目的曲库目录布局放置（分片布局下直接放进对应的分片目录）
+        layout = load_layout(self.root)
+        counts = {"ncm": 0, "audio": 0, "mp3": 0, "exists": 0, "copied": 0, "failed": 0}
+        moved_bytes = 0
+        failures = []
+        cross_device = []
+        
+        def organize_one(path):
+            """识别并移动一个文件，跨设备的文件留给第二阶段复制"""
+            kind, extension = detect_file_kind(path)
+            if kind is None:
+                return None
+            folder = targets[kind]
+            target = layout.output_path(self.folders[folder], target_name(path, extension))
+            size = path.stat().st_size
+            try:
+                if not move_same_device(path, target):
+                    return kind, folder, path, target, size, 'exists'
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                return kind, folder, path, target, size, 'cross_device'
+            return kind, folder, path, target, size, 'moved'
+        
+        def record(kind, folder, size):
+            nonlocal moved_bytes
+            counts[kind] += 1
+            moved_bytes += size
+            self.stats_index.add_file(folder, size)
+        
+        for path in self.folders.values():
+            path.mkdir(exist_ok=True)
+        
+        with Progress(
+            SpinnerColumn(),
+            TextColumn("[progress.description]{task.description}"),
+            BarColumn(),
+            TaskProgressColumn(),
+            TimeElapsedColumn(),
+            console=console,
+            transient=False
+        ) as progress:
+            
+            scan_task = progress.add_task("🔍 识别并移动", total=len(candidates))
+            
+            def summary_text():
+                return (f"📦 {counts['ncm']}  🎵 {counts['audio']}  🎧 {counts['mp3']}  "
+                        f"⏭️ {counts['exists']}  ❌ {counts['failed']}")
+            
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {executor.submit(organize_one, path): path for path in candidates}
+                for future in as_completed(futures):
+                    try:
+                        outcome = future.result()
+                    except OSError as e:
+                        counts['failed'] += 1
+                        failures.append((futures[future].name, str(e)))
+                        outcome = None
+                    if outcome:
+                        kind, folder, path, target, size, status = outcome
+                        if status == 'moved':
+                            record(kind, folder, size)
+                        elif status == 'exists':
+                            counts['exists'] += 1
+                        else:
+                            cross_device.append((kind, folder, path, target, size))
+                    progress.update(scan_task, advance=1, description=f"🔍 识别并移动  {summary_text()}")
+            
+            if cross_device:
+                copy_task = progress.add_task("🚚 跨设备复制", total=sum(item[4] for item in cross_device))
                 
-                # 音频文件 -> 02_decrypted
-                elif file.suffix.lower() in ['.flac', '.wav', '.m4a', '.aac', '.ogg']:
-                    target = self.folders["decrypted"] / file.name
-                    if not target.exists():
-                        shutil.move(str(file), str(target))
-                        moved_files["audio"] += 1
-                        console.print(f"🎵 移动音频文件: {file.name} -> 02_decrypted/")
+                def copy_one(item):
+                    kind, folder, path, target, size = item
+                    copied = copy_across_devices(path, target)
+                    progress.advance(copy_task, size)
+                    return item, copied
                 
-                # MP3文件 -> 03_compressed (如果在result目录外的话)
-                elif file.suffix.lower() == '.mp3' and 'result' not in str(file):
-                    target = self.folders["compressed"] / file.name
-                    if not target.exists():
-                        shutil.move(str(file), str(target))
-                        moved_files["mp3"] += 1
-                        console.print(f"🎧 移动MP3文件: {file.name} -> 03_compressed/")
-        
-        # 处理result目录中的文件
-        result_dir = self.root / "result"
+                with ThreadPoolExecutor(max_workers=copy_workers) as executor:
+                    futures = {executor.submit(copy_one, item): item for item in cross_device}
+                    for future in as_completed(futures):
+                        try:
+                            (kind, folder, path, target, size), copied = future.result()
+                        except OSError as e:
+                            counts['failed'] += 1
+                            failures.append((futures[future][2].name, str(e)))
+                            continue
+                        if copied:
+                            counts['copied'] += 1
+                            record(kind, folder, size)
+                        else:
+                            counts['exists'] += 1
+                        progress.update(copy_task, description=f"🚚 跨设备复制  {summary_text()}")
+        
+        # 删除空的result目录
         if result_dir.exists():
-            for file in result_dir.iterdir():
-                if file.is_file() and file.suffix.lower() == '.mp3':
-                    target = self.folders["compressed"] / file.name
-                    if not target.exists():
-                        shutil.move(str(file), str(target))
-                        moved_files["mp3"] += 1
-                        console.print(f"🎧 移动MP3文件: {file.name} -> 03_compressed/")
-            
-            # 删除空的result目录
             try:
                 result_dir.rmdir()
                 console.print("🗑️  删除空的result目录")
             except OSError:
                 console.print("⚠️  result目录不为空，保留")
         
+        if failures:
+            failure_table = Table(title=f"❌ 移动失败 (共 {len(failures)} 个，显示前 {min(len(failures), 20)} 个)")
+            failure_table.add_column("文件名", style="cyan", overflow="fold")
+            failure_table.add_column("原因", style="red", overflow="fold")
+            for name, error in failures[:20]:
+                failure_table.add_row(name, error)
+            console.print(failure_table)
+        
         # 显示统计
         summary_table = Table(show_header=False, box=None)
         summary_table.add_column("", style="bold")
         summary_table.add_column("", style="")
         
-        summary_table.add_row("📦 NCM文件", f"{moved_files['ncm']} 个")
-        summary_table.add_row("🎵 音频文件", f"{moved_files['audio']} 个") 
-        summary_table.add_row("🎧 MP3文件", f"{moved_files['mp3']} 个")
+        summary_table.add_row("📦 NCM文件", f"{counts['ncm']} 个")
+        summary_table.add_row("🎵 音频文件", f"{counts['audio']} 个") 
+        summary_table.add_row("🎧 MP3文件", f"{counts['mp3']} 个")
+        summary_table.add_row("🚚 跨设备复制", f"{counts['copied']} 个")
+        summary_table.add_row("⏭️  目标已存在", f"{counts['exists']} 个")
+        summary_table.add_row("❌ 失败", f"{counts['failed']} 个")
+        summary_table.add_row("💾 整理总量", f"{moved_bytes/(1024*1024):.1f} MB")
         
         console.print(Panel(summary_table, title="📊 文件整理统计", border_style="green"))
     
-    def show_structure(self):
-        """显示当前项目结构"""
+    def stats(self, refresh=False):
+        """返回项目统计（来自增量统计索引，不遍历目录），可供外部程序轮询"""
+        if refresh:
+            return self.stats_index.rebuild()
+        return self.stats_index.snapshot()
+    
+    def show_structure(self, refresh=False):
+        """显示当前项目结构；refresh=True 时全量重建统计索引"""
         console.print(Panel.fit("📁 项目目录结构", style="bold cyan"))
         
+        stats = self.stats(refresh)
+        
         structure_table = Table(show_header=False, box=None)
         structure_table.add_column("", style="bold")
         structure_table.add_column("", style="")
         structure_table.add_column("", style="dim")
         
+        labels = {
+            "original": "📦 01_original/",
+            "decrypted": "🎵 02_decrypted/",
+            "compressed": "🎧 03_compressed/",
+        }
         for name, path in self.folders.items():
             if path.exists():
-                file_count = len([f for f in path.iterdir() if f.is_file()])
-                size = sum(f.stat().st_size for f in path.rglob('*') if f.is_file())
-                size_mb = size / (1024 * 1024)
-                
-                if name == "original":
-                    structure_table.add_row("📦 01_original/", f"{file_count} 个文件", f"{size_mb:.1f} MB")
-                elif name == "decrypted":
-                    structure_table.add_row("🎵 02_decrypted/", f"{file_count} 个文件", f"{size_mb:.1f} MB")
-                elif name == "compressed":
-                    structure_table.add_row("🎧 03_compressed/", f"{file_count} 个文件", f"{size_mb:.1f} MB")
+                folder = stats['folders'].get(name, {'files': 0, 'bytes': 0})
+                size_mb = folder['bytes'] / (1024 * 1024)
+                structure_table.add_row(labels[name], f"{folder['files']} 个文件", f"{size_mb:.1f} MB")
         
         console.print(structure_table)
         console.print()
@@ -147,9 +327,10 @@ class ProjectStructure:
         # 显示记录文件状态
         for name, path in self.records.items():
             if path.exists():
-                with open(path, 'r', encoding='utf-8') as f:
-                    lines = len([line for line in f.read().strip().split('\n') if line])
-                console.print(f"📝 {path.name}: {lines} 条记录")
+                console.print(f"📝 {path.name}: {stats['records'].get(name, 0)} 条记录")
+        
+        updated = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(stats['updated']))
+        console.print(f"[dim]📈 统计索引快照于 {updated}，之后的变化由解密/压缩阶段增量记录[/dim]")
 
 def main():
     """主函数"""
@@ -161,9 +342,10 @@ def main():
     console.print("2. 整理现有文件")
     console.print("3. 显示项目结构")
     console.print("4. 全部执行")
+    console.print("5. 重建统计索引")
     console.print()
     
-    choice = input("请选择操作 (1-4): ").strip()
+    choice = input("请选择操作 (1-5): ").strip()
     
     if choice == "1":
         pm.create_structure()
@@ -177,6 +359,8 @@ def main():
         pm.organize_existing_files()
         console.print()
         pm.show_structure()
+    elif choice == "5":
+        pm.show_structure(refresh=True)
     else:
         console.print("❌ 无效选择")
 
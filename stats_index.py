@@ -0,0 +1,158 @@
+# This file is part of ncm_cracker.
+#
+# ncm_cracker is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ncm_cracker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ncm_cracker.  If not, see <https://www.gnu.org/licenses/>.
+"""
+📈 项目统计索引
+增量维护各目录的文件数、字节数和记录文件条数，查看统计时无需遍历目录：
+1. 解密 / 压缩阶段写出文件时，向日志追加一行增量（追加写，多进程安全）
+2. 快照 + 日志偏移量 - 读取时只回放上次之后的新增日志
+3. 日志积累到一定大小自动合并进快照
+4. 索引缺失或怀疑不准时可以全量重建
+"""
+
+import json
+import os
+import pathlib
+import time
+
+STATS_SNAPSHOT = ".project_stats.json"
+STATS_JOURNAL = ".project_stats.journal"
+
+# 统计的目录和记录文件
+FOLDERS = {
+    "original": "01_original",
+    "decrypted": "02_decrypted",
+    "compressed": "03_compressed",
+}
+RECORDS = {
+    "cracked": "cracked.txt",
+    "compressed": "compressed.txt",
+}
+
+# 未合并的日志超过该字节数时合并进快照
+COMPACT_BYTES = 64 * 1024
+
+
+def _empty_stats():
+    return {
+        'folders': {name: {'files': 0, 'bytes': 0} for name in FOLDERS},
+        'records': {name: 0 for name in RECORDS},
+        'journal_offset': 0,
+        'updated': 0,
+    }
+
+
+class StatsIndex:
+    def __init__(self, root_path="."):
+        self.root = pathlib.Path(root_path)
+        self.snapshot_path = self.root / STATS_SNAPSHOT
+        self.journal_path = self.root / STATS_JOURNAL
+
+    def _append(self, *fields):
+        """向日志追加一行；一次write的短行在追加模式下不会与其他进程交错"""
+        try:
+            with open(self.journal_path, 'a', encoding='utf-8') as f:
+                f.write(' '.join(str(field) for field in fields) + '\n')
+        except OSError:
+            # 统计只是辅助信息，写不进去也不能影响解密和压缩
+            pass
+
+    def add_file(self, folder, size, previous_size=None):
+        """目录中写出了一个文件；previous_size 不为None表示覆盖了同名旧文件"""
+        files = 0 if previous_size is not None else 1
+        self._append('file', folder, files, size - (previous_size or 0))
+
+    def remove_file(self, folder, size):
+        """目录中删除了一个文件"""
+        self._append('file', folder, -1, -size)
+
+    def add_record(self, record, count=1):
+        """记录文件新增了 count 行"""
+        self._append('record', record, count, 0)
+
+    def _load_snapshot(self):
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _save_snapshot(self, stats):
+        temp_path = self.snapshot_path.with_name(self.snapshot_path.name + '.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(stats, f, ensure_ascii=False)
+        os.replace(temp_path, self.snapshot_path)
+
+    def _replay(self, stats):
+        """回放快照之后的日志，返回未合并的日志字节数"""
+        try:
+            with open(self.journal_path, 'rb') as f:
+                f.seek(stats['journal_offset'])
+                tail = f.read()
+        except FileNotFoundError:
+            return 0
+        # 只回放完整的行，正在写入的半行留到下次
+        complete = tail[:tail.rfind(b'\n') + 1]
+        for line in complete.decode('utf-8', errors='replace').splitlines():
+            fields = line.split()
+            if len(fields) != 4:
+                continue
+            kind, name, count, size = fields[0], fields[1], int(fields[2]), int(fields[3])
+            if kind == 'file':
+                folder = stats['folders'].setdefault(name, {'files': 0, 'bytes': 0})
+                folder['files'] += count
+                folder['bytes'] += size
+            elif kind == 'record':
+                stats['records'][name] = stats['records'].get(name, 0) + count
+        stats['journal_offset'] += len(complete)
+        return len(complete)
+
+    def snapshot(self):
+        """返回当前统计；没有快照时全量重建一次"""
+        stats = self._load_snapshot()
+        if stats is None:
+            return self.rebuild()
+        replayed = self._replay(stats)
+        if replayed > COMPACT_BYTES:
+            stats['updated'] = time.time()
+            self._save_snapshot(stats)
+        return stats
+
+    def rebuild(self):
+        """全量遍历目录和记录文件，重建快照（慢，只在索引缺失或需要校正时使用）"""
+        stats = _empty_stats()
+        try:
+            # 从当前日志末尾开始，之前的增量都已体现在遍历结果里
+            stats['journal_offset'] = self.journal_path.stat().st_size
+        except FileNotFoundError:
+            pass
+
+        for name, folder_name in FOLDERS.items():
+            path = self.root / folder_name
+            if not path.exists():
+                continue
+            # 与增量更新一致，子目录（如多版本输出）中的文件也计入
+            sizes = [f.stat().st_size for f in path.rglob('*') if f.is_file()]
+            stats['folders'][name]['files'] = len(sizes)
+            stats['folders'][name]['bytes'] = sum(sizes)
+
+        for name, record_name in RECORDS.items():
+            path = self.root / record_name
+            if path.exists():
+                with open(path, 'r', encoding='utf-8') as f:
+                    stats['records'][name] = sum(1 for line in f if line.strip())
+
+        stats['updated'] = time.time()
+        self._save_snapshot(stats)
+        return stats